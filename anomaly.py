@@ -0,0 +1,187 @@
+"""
+计数异常检测 - 在每次发布时按视频流式检测观看增速的突增（爆红）和停滞（计数冻结）
+
+每个视频只保存固定几个数值：上次的计数和变化时间、增速的指数加权均值和方差
+（Welford在线方差的指数加权形式，旧样本的权重逐渐衰减）、计数变化的平均间隔。
+时间使用计数实际获取的时间（stats_updated_at）；分层刷新时本轮没有重新获取的视频
+沿用的是缓存的计数，不参与本轮检测。
+每个账号的状态为按视频对齐的numpy数组，一次发布的全部视频用向量运算更新，
+10万个视频的耗时见bench_anomaly.py。
+"""
+
+import threading
+import time
+from typing import Dict, List
+import numpy as np
+from config import Config
+from snapshot_store import stats_times
+
+# 参与检测的计数
+ANOMALY_COUNTER = 'views'
+
+# 异常类型（flag数组中的取值）
+SPIKE = 1
+STALL = -1
+ANOMALY_KINDS = {SPIKE: 'spike', STALL: 'stall'}
+
+
+class AccountAnomalyState:
+    """一个账号所有视频的检测状态（按视频ID列表对齐的数组）"""
+
+    def __init__(self, video_ids: List[str] = ()):
+        n = len(video_ids)
+        self.video_ids = list(video_ids)
+        self.value = np.zeros(n, dtype=np.int64)         # 上次观察到的计数
+        self.changed_at = np.full(n, np.nan)              # 计数上次变化的时间（NaN为尚未观察）
+        self.observed_at = np.full(n, np.nan)             # 上次观察到的计数的获取时间
+        self.mean = np.zeros(n)                           # 增速（次/小时）的加权均值
+        self.var = np.zeros(n)                            # 增速的加权方差
+        self.interval = np.zeros(n)                       # 计数变化的平均间隔（秒）
+        self.count = np.zeros(n, dtype=np.int32)          # 已计入的增速样本数
+        self.flag = np.zeros(n, dtype=np.int8)            # 当前的异常状态
+
+    def realign(self, video_ids: List[str]) -> 'AccountAnomalyState':
+        """按新的视频列表重新排列状态：保留仍存在的视频，新视频从头开始，已移除的视频丢弃"""
+        position = {video_id: i for i, video_id in enumerate(self.video_ids)}
+        old = np.fromiter((position.get(video_id, -1) for video_id in video_ids),
+                          dtype=np.int64, count=len(video_ids))
+        kept = old >= 0
+        state = AccountAnomalyState(video_ids)
+        for name in ('value', 'changed_at', 'observed_at', 'mean', 'var', 'interval', 'count', 'flag'):
+            getattr(state, name)[kept] = getattr(self, name)[old[kept]]
+        return state
+
+
+class AnomalyDetector:
+    """
+    流式z-score异常检测
+
+    突增：计数变化时，本次间隔内的增速相对加权均值的z-score达到阈值，且增速至少为均值的若干倍。
+    停滞：计数已冻结k个平均变化间隔，按均值预期的增长相对其标准差（随√k增长）的z-score达到阈值，
+    上游统计查询静默返回空列表、计数停止更新时会逐步触发。
+    样本数不足ANOMALY_MIN_SAMPLES的视频只更新统计量不报告；同一异常状态只报告一次。
+    """
+
+    def __init__(self, threshold: float = None, alpha: float = None, min_samples: int = None,
+                 stall_intervals: float = None, min_std: float = None, spike_ratio: float = None):
+        self.threshold = threshold or Config.ANOMALY_Z_THRESHOLD
+        self.alpha = alpha or Config.ANOMALY_ALPHA
+        self.min_samples = min_samples or Config.ANOMALY_MIN_SAMPLES
+        self.stall_intervals = stall_intervals or Config.ANOMALY_STALL_INTERVALS
+        self.min_std = min_std or Config.ANOMALY_MIN_STD
+        self.spike_ratio = spike_ratio or Config.ANOMALY_SPIKE_RATIO
+        self._accounts: Dict[str, AccountAnomalyState] = {}
+        self._lock = threading.Lock()
+
+        # 指标
+        self.observations = 0
+        self.spikes = 0
+        self.stalls = 0
+        self.last_observe_ms = None
+
+    def observe(self, snapshot) -> List[Dict]:
+        """用快照更新账号各视频的统计量，返回新出现的异常"""
+        if snapshot.account_id is None or snapshot.status != 'success':
+            return []
+        started = time.perf_counter()
+        videos = [video for video in snapshot.videos if video.get('video_id')]
+        video_ids = [video['video_id'] for video in videos]
+        values = np.fromiter((int(video.get(ANOMALY_COUNTER) or 0) for video in videos),
+                             dtype=np.int64, count=len(videos))
+        now = snapshot.published_at
+        times = np.array(stats_times(videos, now), dtype=np.float64)
+        with self._lock:
+            state = self._accounts.get(snapshot.account_id)
+            if state is None:
+                state = AccountAnomalyState(video_ids)
+            elif state.video_ids != video_ids:
+                state = state.realign(video_ids)
+            self._accounts[snapshot.account_id] = state
+            anomalies = self._update(state, values, times)
+            self.observations += 1
+            self.last_observe_ms = round((time.perf_counter() - started) * 1000, 2)
+        return anomalies
+
+    def _update(self, state: AccountAnomalyState, values: np.ndarray, times: np.ndarray) -> List[Dict]:
+        # 获取时间没有前进的视频是沿用的缓存计数，不作为新的观察（否则会被当作计数冻结）
+        fresh = ~(times <= state.observed_at)
+        new = np.isnan(state.changed_at)
+        elapsed = np.where(fresh & ~new, times - state.changed_at, 0.0)
+        delta = values - state.value
+        # 计数减少（上游修正）只重置基准，不计入样本
+        grew = fresh & ~new & (delta > 0) & (elapsed > 0)
+        frozen = fresh & ~new & (delta == 0)
+
+        std = np.maximum(np.sqrt(state.var), self.min_std)
+        warm = state.count >= self.min_samples
+        flag = np.zeros(len(values), dtype=np.int8)
+
+        # 突增：本次变化间隔内的增速。观看按泊松到达计，间隔越短增速的离散越大，
+        # 标准差不低于按均值在该间隔内的泊松标准差；另外要求增速至少为均值的ANOMALY_SPIKE_RATIO倍
+        rate = np.zeros(len(values))
+        rate[grew] = delta[grew] * 3600 / elapsed[grew]
+        poisson = np.sqrt(np.divide(state.mean * 3600, elapsed, out=np.zeros(len(values)), where=grew))
+        z_rate = (rate - state.mean) / np.maximum(std, poisson)
+        flag[grew & warm & (z_rate >= self.threshold) & (rate >= state.mean * self.spike_ratio)] = SPIKE
+
+        # 停滞：冻结时长折合为平均变化间隔的个数k，预期增长的z-score为 -均值·√k / 标准差
+        k = np.divide(elapsed, state.interval, out=np.zeros(len(values)), where=state.interval > 0)
+        z_stall = -state.mean * np.sqrt(k) / std
+        flag[frozen & warm & (k >= self.stall_intervals) & (z_stall <= -self.threshold)] = STALL
+
+        # 样本较少时权重为1/n（即Welford在线均值/方差），之后固定为alpha（指数加权），
+        # 避免方差从0开始的低估造成误报；报告中使用更新前的均值
+        mean = state.mean.copy()
+        weight = np.maximum(self.alpha, 1.0 / (state.count[grew] + 1))
+        diff = rate[grew] - mean[grew]
+        increment = weight * diff
+        state.mean[grew] += increment
+        state.var[grew] = (1 - weight) * (state.var[grew] + diff * increment)
+        state.interval[grew] += weight * (elapsed[grew] - state.interval[grew])
+        state.count[grew] += 1
+
+        changed = fresh & (new | (delta != 0))
+        state.value[changed] = values[changed]
+        state.changed_at[changed] = times[changed]
+        state.observed_at[fresh] = times[fresh]
+        # 没有新观察的视频保持之前的异常状态
+        flag[~fresh] = state.flag[~fresh]
+
+        reported = np.flatnonzero((flag != 0) & (flag != state.flag))
+        state.flag = flag
+        anomalies = []
+        for i in reported.tolist():
+            kind = ANOMALY_KINDS[int(flag[i])]
+            anomalies.append({
+                'video_id': state.video_ids[i],
+                'kind': kind,
+                'z': round(float(z_rate[i] if flag[i] == SPIKE else z_stall[i]), 1),
+                'rate': round(float(rate[i]), 1),
+                'mean_rate': round(float(mean[i]), 1),
+                'frozen_seconds': int(elapsed[i]) if flag[i] == STALL else 0,
+                ANOMALY_COUNTER: int(values[i])
+            })
+            if flag[i] == SPIKE:
+                self.spikes += 1
+            else:
+                self.stalls += 1
+        return anomalies
+
+    def remove(self, account_id: str):
+        with self._lock:
+            self._accounts.pop(account_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._accounts.clear()
+
+    def stats(self) -> Dict:
+        """检测指标，用于自省接口"""
+        return {
+            'accounts': len(self._accounts),
+            'videos': sum(len(state.video_ids) for state in self._accounts.values()),
+            'observations': self.observations,
+            'spikes': self.spikes,
+            'stalls': self.stalls,
+            'last_observe_ms': self.last_observe_ms
+        }
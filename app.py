@@ -1,11 +1,28 @@
-from flask import Flask, render_template, jsonify, request, redirect, session, url_for
-from flask_socketio import SocketIO, emit
+from flask import Flask, Response, render_template, jsonify, request, redirect, send_file, session, stream_with_context, url_for
+from flask_socketio import SocketIO, emit, join_room, leave_room, rooms
 import json
 import random
 import datetime
 import time
-import threading
+import zlib
 from config import Config
+from scheduler import RefreshScheduler
+from worker_pool import RefreshWorkerPool, DeadlineExceeded
+from token_store import TokenStore, account_room
+from snapshot_store import DASHBOARD_FIELDS, SnapshotStore, make_snapshot, parse_fields
+from json_codec import SocketJSON, dumps_bytes
+from compression import compress, negotiate_encoding
+from msgpack_codec import parse_codec
+from socket_emitter import CoalescingEmitter
+from history_store import COUNTER_FIELDS, HistoryStore
+from history_rollup import HistoryRollup
+from history_archive import HistoryArchive
+from snapshot_persistence import SnapshotPersistence
+from series import SeriesCache, build_series, choose_tier
+from trending import TRENDING_METRICS, TrendingTracker
+from anomaly import AnomalyDetector
+from video_query import QUERY_PARAMS, page_payload, parse_query
+from export import EXPORT_FORMATS, ExportJobs, check_format, encode, export_columns, export_filename, history_chunks, snapshot_chunks
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'tiktok_analytics_secret_key'
@@ -24,10 +41,41 @@ socketio = SocketIO(app,
                    max_http_buffer_size=1000000,
                    allow_upgrades=True,
                    # 生产环境使用更稳定的传输配置
-                   transports=['polling', 'websocket'])
+                   transports=['polling', 'websocket'],
+                   # polling响应超过阈值时gzip压缩；websocket由simple-websocket协商permessage-deflate
+                   http_compression=True,
+                   compression_threshold=Config.COMPRESSION_MIN_SIZE,
+                   # 快照负载已预先编码，打包事件时直接拼接
+                   json=SocketJSON)
 
-# 全局变量存储实时数据
-current_data = []
+# 已授权账号的令牌和账号级缓存（以open_id为键）
+token_store = TokenStore()
+
+# 每个账号最新的不可变数据快照（写时复制发布，读取无锁）
+snapshot_store = SnapshotStore()
+
+# 按节拍合并的Socket推送：每个房间每个节拍最多一帧，发送队列积压的客户端稍后补发最新一帧
+emitter = CoalescingEmitter(socketio)
+
+# 每个账号最新快照的磁盘副本，进程重启后在处理请求之前恢复
+snapshot_persistence = SnapshotPersistence()
+
+# 视频计数历史（SQLite WAL），每次发布后由后台线程批量写入，并定期汇总为分钟/小时/天粒度，
+# 较早的汇总封存为只读列式段文件
+history_archive = HistoryArchive()
+history_store = HistoryStore(rollup=HistoryRollup(archive=history_archive), archive=history_archive)
+snapshot_store.subscribe(history_store.record)
+
+# /api/series降采样结果的LRU缓存
+series_cache = SeriesCache()
+
+# 按滑动窗口增速维护的热门视频排名（每个账号和所有账号）
+trending = TrendingTracker()
+snapshot_store.subscribe(trending.record)
+
+# 每个账号的Socket客户端订阅过的(字段投影, 编码)，发布时每种组合只编码一次并推送到对应房间
+DEFAULT_SUBSCRIPTION = (DASHBOARD_FIELDS, 'json')
+socket_subscriptions = {}
 
 def generate_sample_data():
     """生成示例数据"""
@@ -91,9 +139,61 @@ def generate_sample_data():
     ]
     return sample_videos
 
-def update_data(from_background=False):
-    """更新数据并通过WebSocket发送"""
-    global current_data
+def get_session_account_id():
+    """从当前请求的session中获取账号open_id（请求上下文之外返回None）"""
+    try:
+        return session.get('open_id')
+    except RuntimeError:
+        # 在请求上下文之外，忽略session访问
+        return None
+
+def save_account_token(token_data):
+    """保存授权得到的令牌到令牌存储，并将账号加入刷新调度"""
+    open_id = token_data.get('open_id')
+    if not open_id:
+        # 令牌响应中没有open_id时，通过用户信息接口获取
+        from oauth_handler import TikTokOfficialAPI
+        user_info = TikTokOfficialAPI(token_data['access_token']).get_user_info(fields=['open_id'])
+        open_id = user_info.get('data', {}).get('user', {}).get('open_id')
+    if not open_id:
+        raise Exception("无法获取授权账号的open_id")
+    
+    token_store.save(open_id, token_data)
+    session['open_id'] = open_id
+    # 数据接口只读取快照，由调度器在后台刷新
+    scheduler.add_account(open_id, run_now=True)
+    scheduler.start()
+    return open_id
+
+def refresh_account_token(account):
+    """访问令牌过期时使用刷新令牌换取新令牌"""
+    if not account.is_expired() or not account.refresh_token:
+        return
+    from oauth_handler import TikTokOAuth
+    token_data = TikTokOAuth().refresh_token(account.refresh_token)
+    if 'access_token' in token_data:
+        account.update_token(token_data)
+        print(f"🔑 账号 {account.open_id} 访问令牌已刷新")
+        # 刷新令牌可能已轮换，立即落盘（之后的数据刷新失败时不会发布快照），
+        # 重启或回收后的worker恢复的是新令牌
+        snapshot = snapshot_store.get(account.open_id)
+        if snapshot is not None:
+            snapshot_persistence.save(snapshot, account.token_state())
+
+def status_snapshot(status, message):
+    """没有授权账号时使用的临时快照（不发布、版本号为0）"""
+    return make_snapshot(None, 0, [], status, message)
+
+def update_data(account_id=None, from_background=False, deadline=None):
+    """
+    刷新指定账号的数据并发布新快照，返回快照
+    
+    快照发布后由订阅者推送到该账号的房间；没有可刷新的账号或刷新失败时返回不发布的临时快照。
+    deadline为刷新截止时间（time.monotonic()），由工作池传入，用于约束上游请求超时
+    """
+    if account_id is None and not from_background:
+        account_id = get_session_account_id()
+    account = token_store.get(account_id)
     
     api_type = Config.get_api_type()
     
@@ -101,104 +201,298 @@ def update_data(from_background=False):
         if api_type == 'official':
             # 使用官方API
             if not Config.has_official_api_config():
-                current_data = []
-                message = "请配置API密钥并授权TikTok账号"
-                status = 'need_config'
-            else:
-                # 检查是否有访问令牌 - 优先使用app对象中的令牌（避免session上下文问题）
-                access_token = getattr(app, '_access_token', None)
-                
-                # 如果不是后台任务且没有app令牌，尝试从session获取
-                if not access_token and not from_background:
-                    try:
-                        from flask import session
-                        access_token = session.get('access_token')
-                    except RuntimeError:
-                        # 在请求上下文之外，忽略session访问
-                        pass
-                
-                if not access_token:
-                    current_data = []
-                    message = "需要授权TikTok账号才能获取数据"
-                    status = 'need_auth'
-                else:
-                    # 用户已授权，获取实际数据
-                    try:
-                        from oauth_handler import TikTokOfficialAPI
-                        api = TikTokOfficialAPI(access_token)
-                        
-                        # 获取用户视频数据
-                        videos_response = api.get_user_videos(count=20)
-                        
-                        # Display API的响应格式: {"data": {"videos": [...], "cursor": ..., "has_more": bool}, "error": {...}}
-                        if videos_response.get('data'):
-                            if videos_response['data'].get('videos'):
-                                raw_videos = videos_response['data']['videos']
-                                current_data = api.process_video_analytics(raw_videos)
-                                message = f"成功获取 {len(current_data)} 个视频数据"
-                                status = 'success'
-                            else:
-                                current_data = []
-                                message = "暂无视频数据或API返回为空"
-                                status = 'no_data'
-                        else:
-                            current_data = []
-                            message = "暂无视频数据或API返回为空"
-                            status = 'no_data'
-                    except Exception as e:
-                        print(f"获取官方API数据失败: {e}")
-                        # 如果是API限制，显示演示数据
-                        if "Display API限制" in str(e) or "只能查询特定视频" in str(e):
-                            current_data = generate_display_api_demo_data()
-                            message = "TikTok Display API限制：只能查询特定视频。当前显示演示数据。"
-                            status = 'api_limitation'
-                        else:
-                            current_data = []
-                            message = f"获取数据失败: {str(e)}"
-                            status = 'error'
+                return status_snapshot('need_config', "请配置API密钥并授权TikTok账号")
+            if account is None:
+                return status_snapshot('need_auth', "需要授权TikTok账号才能获取数据")
+            
+            # 同一账号的刷新和发布串行执行，不同账号的刷新互不阻塞
+            wait = -1 if deadline is None else max(0, deadline - time.monotonic())
+            if not account.refresh_lock.acquire(timeout=wait):
+                raise DeadlineExceeded("等待同账号的刷新任务超时")
+            try:
+                videos, status, message = fetch_account_videos(account, deadline)
+                if status == 'error':
+                    # 刷新失败时不发布，保留上次成功的快照（版本号不变、不推送、不落盘），
+                    # 失败通过刷新任务的状态返回
+                    print(f"❌ 数据更新失败 [{account.open_id}]: {message}")
+                    return status_snapshot('error', message)
+                snapshot = snapshot_store.publish(account.open_id, videos, status, message)
+            finally:
+                account.refresh_lock.release()
+            
+            print(f"🔄 数据更新完成 [{account.open_id}]: 版本 {snapshot.version}, "
+                  f"{len(snapshot.videos)} 条视频数据, 状态: {status}")
+            return snapshot
                 
         elif api_type == 'third_party':
             # 使用第三方API获取真实数据
             # 暂时返回空数据，因为我们不再使用模拟数据
-            current_data = []
-            message = "第三方API功能暂未实现"
-            status = 'not_implemented'
+            return status_snapshot('not_implemented', "第三方API功能暂未实现")
             
         else:
             # 未配置API
-            current_data = []
-            message = "请先配置API密钥"
-            status = 'no_config'
+            return status_snapshot('no_config', "请先配置API密钥")
             
     except Exception as e:
+        # 保留已发布的快照不变，只把错误返回给调用方
         print(f"Error updating data: {e}")
-        current_data = []
-        message = f"数据获取失败: {str(e)}"
-        status = 'error'
-    
-    # 构造数据负载
-    data_payload = {
-        'videos': current_data,
-        'status': status,
-        'message': message,
-        'timestamp': datetime.datetime.now().isoformat()
+        return status_snapshot('error', f"数据获取失败: {str(e)}")
+
+def current_snapshot(account_id=None):
+    """读取账号最新快照（无锁），尚无快照时同步刷新一次"""
+    if account_id is None:
+        account_id = get_session_account_id()
+    return snapshot_store.get(account_id) or update_data(account_id=account_id)
+
+def manual_refresh(account_id=None):
+    """
+    客户端触发的刷新（/api/refresh和request_update），返回(快照, 刷新结果)
+
+    同一账号距上次刷新不足MIN_REFRESH_INTERVAL时直接返回最近的快照（throttled），
+    已有排队或运行中的刷新任务时等待该任务完成（joined），否则提交新任务（refreshed）；
+    刷新失败时返回上次成功刷新的快照（failed，失败的刷新不发布快照）。所有上游请求都经过刷新工作池，连续点击不会重复请求。
+    """
+    if account_id is None:
+        account_id = get_session_account_id()
+    if token_store.get(account_id) is None or not Config.has_official_api_config():
+        # 没有可刷新的账号，返回临时快照
+        return update_data(account_id=account_id), 'refreshed'
+
+    job = refresh_pool.last_job(account_id)
+    if job is not None and not job.done:
+        result = 'joined'
+    else:
+        # 距上次发布或上次刷新结束（含失败）的秒数
+        snapshot = snapshot_store.get(account_id)
+        elapsed = time.time() - snapshot.published_at if snapshot else float('inf')
+        if job is not None:
+            elapsed = min(elapsed, time.monotonic() - job.finished_at)
+        if elapsed < Config.MIN_REFRESH_INTERVAL:
+            return snapshot or status_snapshot('error', f"数据获取失败: {job.error or '刷新返回失败状态'}"), 'throttled'
+        result = 'refreshed'
+        refresh_pool.start()
+        job = refresh_pool.submit(account_id)
+
+    job.wait(max(0, job.remaining()))
+    if not job.ok:
+        result = 'failed'
+    # 失败的刷新不发布，这里读到的是上次成功刷新的快照
+    snapshot = snapshot_store.get(account_id)
+    if snapshot is None:
+        return status_snapshot('error', f"数据获取失败: {job.error or '刷新返回失败状态'}"), result
+    return snapshot, result
+
+def freshness(snapshot, result):
+    """刷新结果和返回数据的新鲜度（数据年龄、距下次允许手动刷新的秒数）"""
+    if snapshot.account_id is None:
+        return {'refresh': result, 'version': 0, 'age': 0, 'next_refresh_in': 0}
+    age = max(0.0, time.time() - snapshot.published_at)
+    return {
+        'refresh': result,
+        'version': snapshot.version,
+        'age': round(age, 1),
+        'next_refresh_in': round(max(0.0, Config.MIN_REFRESH_INTERVAL - age), 1)
     }
+
+def snapshot_response(snapshot, conditional=False, fields=DASHBOARD_FIELDS, layout='rows'):
+    """
+    用快照的已编码负载构造JSON响应（每个版本每种字段投影和格式只序列化一次）
     
-    print(f"📤 准备发送数据: {len(current_data)} 条视频数据, 状态: {status}")
+    按Accept-Encoding返回预压缩的负载（每个版本每种编码只压缩一次）；
+    conditional为True时附带由版本号派生的ETag和Last-Modified，
+    客户端带If-None-Match/If-Modified-Since且数据未变化时返回304
+    """
+    body = snapshot.encoded(fields, layout)
+    encoding = negotiate_encoding(request.accept_encodings, len(body))
+    if encoding is not None:
+        body = snapshot.compressed(encoding, fields, layout)
+    response = Response(body, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if encoding is not None:
+        response.content_encoding = encoding
+    if not conditional or snapshot.account_id is None:
+        # 未发布的临时快照没有稳定版本，不允许缓存
+        response.cache_control.no_store = True
+        return response
     
-    # 只有在有数据且不是后台任务时才发送WebSocket（避免连接问题）
-    if not from_background:
-        try:
-            # 发送WebSocket数据
-            socketio.emit('data_update', data_payload, broadcast=True)
-            print(f"✅ WebSocket数据发送成功")
-        except Exception as e:
-            print(f"❌ WebSocket数据发送失败: {e}")
-            # 不要因为WebSocket发送失败就中断整个流程
+    # 不同字段投影、格式和编码是不同的表示，强ETag需要区分
+    tag = snapshot.etag
+    if fields != DASHBOARD_FIELDS:
+        tag += f"-f{zlib.crc32(','.join(fields or ('all',)).encode('utf-8')):x}"
+    if layout != 'rows':
+        tag += f'-{layout}'
+    response.set_etag(tag if encoding is None else f'{tag}-{encoding}')
+    response.last_modified = datetime.datetime.fromtimestamp(snapshot.published_at, datetime.timezone.utc)
+    # 账号数据只允许浏览器缓存，每次使用前必须重新验证
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
+
+def page_response(snapshot, query, fields=DASHBOARD_FIELDS, layout='rows'):
+    """
+    分页查询的JSON响应（排序索引按快照版本缓存，每个请求只取出一页）
     
-    print(f"🔄 数据更新完成于: {datetime.datetime.now()}")
+    ETag由快照版本和查询参数派生，同一版本的同一页重复请求返回304
+    """
+    body = dumps_bytes(page_payload(snapshot, query, fields, layout))
+    encoding = negotiate_encoding(request.accept_encodings, len(body))
+    if encoding is not None:
+        body = compress(body, encoding)
+    response = Response(body, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if encoding is not None:
+        response.content_encoding = encoding
+    if snapshot.account_id is None:
+        response.cache_control.no_store = True
+        return response
+    tag = f'{snapshot.etag}-q{zlib.crc32(request.query_string):x}'
+    response.set_etag(tag if encoding is None else f'{tag}-{encoding}')
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
+
+def subscription_room(open_id, fields, codec):
+    """账号在某种字段投影和编码下的Socket.IO房间，默认组合使用账号房间"""
+    room = account_room(open_id)
+    if fields != DASHBOARD_FIELDS:
+        room += '|' + (','.join(fields) if fields else 'all')
+    if codec != 'json':
+        room += '|' + codec
+    return room
+
+def join_subscription_room(open_id, fields, codec):
+    """当前Socket客户端改为订阅指定投影和编码（离开该账号的其他房间）"""
+    room = subscription_room(open_id, fields, codec)
+    prefix = account_room(open_id)
+    for joined in rooms():
+        if joined != room and (joined == prefix or joined.startswith(prefix + '|')):
+            leave_room(joined)
+    join_room(room)
+    socket_subscriptions.setdefault(open_id, {DEFAULT_SUBSCRIPTION}).add((fields, codec))
+
+def socket_message(snapshot, fields, codec):
+    """
+    快照对应的Socket事件名和负载
     
-    return current_data, status, message
+    msgpack客户端收到二进制的data_update_bin事件，其余客户端收到JSON的data_update事件，
+    两者内容相同
+    """
+    if codec == 'msgpack':
+        return 'data_update_bin', snapshot.packed(fields)
+    return 'data_update', snapshot.socket_payload(fields)
+
+def emit_snapshot(snapshot):
+    """按当前连接的投影和编码把快照发送给请求的客户端"""
+    emit(*socket_message(snapshot, session.get('fields', DASHBOARD_FIELDS), session.get('codec', 'json')))
+
+def request_layout():
+    """请求的负载格式：format=columnar时按列返回，否则为记录数组"""
+    return 'columnar' if request.args.get('format') == 'columnar' else 'rows'
+
+def push_snapshot(snapshot, previous):
+    """快照发布后按字段投影和编码安排推送到该账号的各个房间（由emitter按节拍合并发送）"""
+    try:
+        subscriptions = socket_subscriptions.get(snapshot.account_id, {DEFAULT_SUBSCRIPTION})
+        for fields, codec in list(subscriptions):
+            room = subscription_room(snapshot.account_id, fields, codec)
+            if ((fields, codec) != DEFAULT_SUBSCRIPTION
+                    and next(socketio.server.manager.get_participants('/', room), None) is None):
+                # 已没有客户端订阅该组合，不再为它编码
+                subscriptions.discard((fields, codec))
+                continue
+            emitter.schedule(room, lambda fields=fields, codec=codec: socket_message(snapshot, fields, codec))
+        print(f"✅ WebSocket数据已安排推送 [{snapshot.account_id}]: 版本 {snapshot.version}")
+    except Exception as e:
+        # 不要因为WebSocket发送失败就中断整个流程
+        print(f"❌ WebSocket数据发送失败: {e}")
+
+snapshot_store.subscribe(push_snapshot)
+
+def persist_snapshot(snapshot, previous):
+    """快照发布订阅者：把账号最新快照和令牌状态写入磁盘"""
+    account = token_store.get(snapshot.account_id)
+    snapshot_persistence.save(snapshot, account.token_state() if account else None)
+
+snapshot_store.subscribe(persist_snapshot)
+
+# 观看增速的流式异常检测（突增/停滞），新出现的异常以anomaly事件推送到账号的各个房间
+anomaly_detector = AnomalyDetector()
+
+def push_anomalies(snapshot, previous):
+    """快照发布订阅者：检测计数异常并推送"""
+    anomalies = anomaly_detector.observe(snapshot)
+    if not anomalies:
+        return
+    print(f"⚠️ 检测到 {len(anomalies)} 个计数异常 [{snapshot.account_id}]: 版本 {snapshot.version}")
+    spikes = sum(1 for item in anomalies if item['kind'] == 'spike')
+    payload = {
+        'version': snapshot.version,
+        'timestamp': snapshot.timestamp,
+        'spikes': spikes,
+        'stalls': len(anomalies) - spikes,
+        'anomalies': sorted(anomalies, key=lambda item: -abs(item['z']))[:Config.ANOMALY_MAX_EVENTS]
+    }
+    for fields, codec in list(socket_subscriptions.get(snapshot.account_id, {DEFAULT_SUBSCRIPTION})):
+        socketio.emit('anomaly', payload, to=subscription_room(snapshot.account_id, fields, codec))
+
+snapshot_store.subscribe(push_anomalies)
+
+def sse_event(event, data, event_id=None):
+    """编码一条SSE事件（data为单行JSON字节串）"""
+    frame = b'event: ' + event.encode('utf-8') + b'\ndata: ' + data + b'\n\n'
+    if event_id is not None:
+        frame = b'id: ' + event_id.encode('utf-8') + b'\n' + frame
+    return frame
+
+def snapshot_event(snapshot, fields=DASHBOARD_FIELDS):
+    """完整快照的SSE事件，事件ID为快照ETag（每个版本每种投影只编码一次）"""
+    if snapshot.account_id is None:
+        return sse_event('snapshot', snapshot.encoded(fields))
+    return snapshot.cached(('sse', fields), lambda: sse_event('snapshot', snapshot.encoded(fields), snapshot.etag))
+
+def delta_event(base, snapshot, fields=DASHBOARD_FIELDS):
+    """从base版本到snapshot版本的增量SSE事件"""
+    return snapshot.cached(('sse_delta', base.version, fields),
+                           lambda: sse_event('delta', snapshot.encoded_delta(base, fields), snapshot.etag))
+
+def resume_base(account_id, last_event_id):
+    """按Last-Event-ID（快照ETag）查找客户端已有的历史版本，找不到时返回None"""
+    try:
+        version = int(last_event_id.split('.', 1)[0].lstrip('v'))
+    except (AttributeError, ValueError):
+        return None
+    base = snapshot_store.get_version(account_id, version)
+    if base is None or base.etag != last_event_id:
+        # 进程重启后版本号重新计数，ETag中的发布时间不同
+        return None
+    return base
+
+def fetch_account_videos(account, deadline=None):
+    """获取单个账号的视频数据，返回 (videos, status, message)"""
+    try:
+        refresh_account_token(account)
+        
+        from oauth_handler import TikTokOfficialAPI
+        api = TikTokOfficialAPI(account.access_token, deadline=deadline)
+        
+        # 获取用户视频数据
+        videos_response = api.get_user_videos(count=20, planner=account.planner)
+        
+        # Display API的响应格式: {"data": {"videos": [...], "cursor": ..., "has_more": bool}, "error": {...}}
+        if videos_response.get('data') and videos_response['data'].get('videos'):
+            raw_videos = videos_response['data']['videos']
+            videos = api.process_video_analytics(raw_videos)
+            return videos, 'success', f"成功获取 {len(videos)} 个视频数据"
+        return [], 'no_data', "暂无视频数据或API返回为空"
+    except Exception as e:
+        print(f"获取官方API数据失败: {e}")
+        # 如果是API限制，显示演示数据
+        if "Display API限制" in str(e) or "只能查询特定视频" in str(e):
+            return (generate_display_api_demo_data(), 'api_limitation',
+                    "TikTok Display API限制：只能查询特定视频。当前显示演示数据。")
+        return [], 'error', f"获取数据失败: {str(e)}"
 
 @app.route('/')
 def index():
@@ -206,7 +500,10 @@ def index():
     # 检查是否已配置API
     if not Config.has_api_config():
         return redirect(url_for('api_config'))
-    return render_template('index.html')
+    # 二进制推送需要显式开启（配置或?codec=msgpack），且服务端安装了msgpack；默认使用JSON
+    binary_codec = ((Config.SOCKET_BINARY_CODEC or request.args.get('codec') == 'msgpack')
+                    and parse_codec('msgpack') == 'msgpack')
+    return render_template('index.html', binary_codec=binary_codec)
 
 @app.route('/config')
 def api_config():
@@ -247,18 +544,37 @@ def auth_test():
 
 @app.route('/api/data')
 def get_data():
-    """获取当前数据"""
+    """
+    获取当前数据（读取最新快照，不触发上游请求，支持ETag条件请求）
+    
+    fields为逗号分隔的字段投影，默认只返回面板表格显示的字段，fields=all返回完整记录；
+    format=columnar时按列返回（每个字段一个数组，index为video_id列表）；
+    带since=版本号参数时为长轮询：since等于当前版本时挂起直到发布新快照，超时返回204，
+    其他版本号（包括进程重启后比当前版本大的）立即返回当前快照；
+    带sort/order/published_after/published_before/min_views/limit/cursor参数时为分页查询，
+    只返回一页并在page中给出下一页的cursor
+    """
     try:
-        # 触发数据更新
-        data, status, message = update_data()
-        
-        return jsonify({
-            'success': True,
-            'videos': data,
-            'status': status,
-            'message': message,
-            'timestamp': datetime.datetime.now().isoformat()
-        })
+        fields = parse_fields(request.args.get('fields'))
+        query = None
+        if any(name in request.args for name in QUERY_PARAMS):
+            try:
+                query = parse_query(request.args)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+        snapshot = current_snapshot()
+        since = request.args.get('since', type=int)
+        # 只在客户端已持有当前版本时挂起；since大于当前版本说明工作进程已重启、版本号重新计数，
+        # 客户端的数据不可能比当前快照新，直接返回当前快照
+        if since is not None and snapshot.account_id is not None and snapshot.version == since:
+            timeout = min(request.args.get('timeout', Config.LONG_POLL_TIMEOUT, type=float),
+                          Config.LONG_POLL_TIMEOUT)
+            snapshot = snapshot_store.wait_for(snapshot.account_id, since, timeout)
+            if snapshot is None:
+                return Response(status=204)
+        if query is not None:
+            return page_response(snapshot, query, fields=fields, layout=request_layout())
+        return snapshot_response(snapshot, conditional=True, fields=fields, layout=request_layout())
     except Exception as e:
         print(f"获取数据API错误: {e}")
         return jsonify({
@@ -271,16 +587,20 @@ def get_data():
 
 @app.route('/api/refresh')
 def refresh_data():
-    """手动刷新数据"""
+    """
+    手动刷新数据（按账号限流，并入进行中的刷新）
+
+    响应头Age为数据年龄（秒），X-Refresh为刷新结果：refreshed、joined、throttled或failed
+    """
     try:
-        data, status, message = update_data()
-        return jsonify({
-            'success': True,
-            'videos': data,
-            'status': status,
-            'message': message,
-            'timestamp': datetime.datetime.now().isoformat()
-        })
+        snapshot, result = manual_refresh()
+        response = snapshot_response(snapshot, fields=parse_fields(request.args.get('fields')),
+                                     layout=request_layout())
+        info = freshness(snapshot, result)
+        response.headers['Age'] = str(int(info['age']))
+        response.headers['X-Refresh'] = result
+        response.headers['X-Next-Refresh-In'] = str(info['next_refresh_in'])
+        return response
     except Exception as e:
         print(f"刷新数据错误: {e}")
         return jsonify({
@@ -291,6 +611,220 @@ def refresh_data():
             'timestamp': datetime.datetime.now().isoformat()
         })
 
+@app.route('/api/stream')
+def stream_data():
+    """
+    SSE数据流：连接后发送完整快照，之后每次发布推送相对上一版本的增量
+    
+    断线重连时浏览器自动带上Last-Event-ID，仍在历史窗口内的版本只补发增量，
+    否则重新发送完整快照。空闲时定期发送注释行作为心跳
+    """
+    account_id = get_session_account_id()
+    snapshot = current_snapshot(account_id)
+    fields = parse_fields(request.args.get('fields'))
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    
+    def generate():
+        if snapshot.account_id is None:
+            # 未授权或未配置：发送临时快照后结束，客户端按较长的间隔重连
+            yield b'retry: %d\n\n' % (Config.SSE_RETRY_MS * 10)
+            yield snapshot_event(snapshot, fields)
+            return
+        
+        yield b'retry: %d\n\n' % Config.SSE_RETRY_MS
+        current = snapshot
+        base = resume_base(account_id, last_event_id)
+        if base is None:
+            yield snapshot_event(current, fields)
+        elif base.version != current.version:
+            yield delta_event(base, current, fields)
+        
+        while account_id in token_store:
+            latest = snapshot_store.wait_for(account_id, current.version, Config.SSE_KEEPALIVE)
+            if latest is None:
+                yield b': keepalive\n\n'
+                continue
+            yield delta_event(current, latest, fields)
+            current = latest
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.cache_control.no_cache = True
+    # 禁止反向代理缓冲事件流
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/video/<video_id>')
+def video_detail(video_id):
+    """
+    单个视频的完整记录和详情字段（描述、尺寸、嵌入代码）
+    
+    列表刷新不再获取这些大字段，打开详情时按需向上游查询并按VIDEO_DETAIL_TTL缓存
+    """
+    account = token_store.get(get_session_account_id())
+    if account is None:
+        return jsonify({'success': False, 'error': '需要授权TikTok账号'}), 401
+    
+    snapshot = snapshot_store.get(account.open_id)
+    video = next((v for v in snapshot.videos if v.get('video_id') == video_id), None) if snapshot else None
+    if video is None:
+        return jsonify({'success': False, 'error': '视频不存在'}), 404
+    
+    try:
+        cached = account.video_details.get(video_id)
+        if cached is None or time.time() - cached[0] > Config.VIDEO_DETAIL_TTL:
+            from oauth_handler import TikTokOfficialAPI
+            # 与数据刷新共用账号的刷新锁，避免两个请求同时用同一个刷新令牌换取令牌并各自落盘
+            if not account.refresh_lock.acquire(timeout=Config.REFRESH_DEADLINE):
+                raise DeadlineExceeded("等待同账号的刷新任务超时")
+            try:
+                refresh_account_token(account)
+            finally:
+                account.refresh_lock.release()
+            detail = TikTokOfficialAPI(account.access_token).get_video_detail(video_id) or {}
+            cached = account.video_details[video_id] = (time.time(), detail)
+        return jsonify({'success': True, 'video': {**video, **cached[1]}, 'version': snapshot.version})
+    except Exception as e:
+        print(f"获取视频详情失败: {e}")
+        return jsonify({'success': False, 'error': f'获取视频详情失败: {str(e)}'}), 502
+
+@app.route('/api/series')
+def video_series():
+    """
+    单个视频计数的历史曲线：/api/series?video_id=...&from=&to=&points=N&counters=views,likes
+
+    from/to为Unix时间戳（秒，默认最近24小时），范围越宽使用越粗的汇总层级，
+    每条曲线用LTTB降采样到最多points个点，结果按(范围, 层级, 点数)缓存SERIES_CACHE_TTL秒
+    """
+    account_id = get_session_account_id()
+    if not account_id:
+        return jsonify({'success': False, 'error': '需要授权TikTok账号'}), 401
+    video_id = request.args.get('video_id')
+    if not video_id:
+        return jsonify({'success': False, 'error': '缺少video_id参数'}), 400
+    
+    now = time.time()
+    end = int(request.args.get('to', now, type=float))
+    start = int(request.args.get('from', end - 86400, type=float))
+    if start >= end:
+        return jsonify({'success': False, 'error': 'from必须早于to'}), 400
+    points = max(3, min(request.args.get('points', Config.SERIES_DEFAULT_POINTS, type=int), Config.SERIES_MAX_POINTS))
+    requested = (request.args.get('counters') or '').split(',')
+    counters = tuple(name for name in COUNTER_FIELDS if name in requested) or COUNTER_FIELDS
+    
+    # 范围按层级桶宽量化，同一个桶内的请求共用缓存
+    tier, width = choose_tier(start, end, now)
+    start -= start % width
+    end -= end % width
+    key = (account_id, video_id, counters, tier, start, end, points)
+    body = series_cache.get(key)
+    if body is None:
+        body = dumps_bytes(build_series(history_store, account_id, video_id, start, end + width - 1,
+                                        points, counters, tier))
+        series_cache.put(key, body)
+    return Response(body, mimetype='application/json')
+
+@app.route('/api/trending')
+def trending_videos():
+    """
+    增速最高的视频：/api/trending?metric=views|likes&limit=N&scope=account|all
+
+    直接读取发布时增量维护的排名索引；scope=all时在所有账号中排名，
+    其他账号的视频只返回计数和增速，不包含账号和视频标识
+    """
+    account_id = get_session_account_id()
+    if not account_id:
+        return jsonify({'success': False, 'error': '需要授权TikTok账号'}), 401
+    metric = request.args.get('metric', 'views')
+    if metric not in TRENDING_METRICS:
+        return jsonify({'success': False, 'error': f'metric只能是{"、".join(TRENDING_METRICS)}'}), 400
+    scope = request.args.get('scope', 'account')
+    limit = max(1, min(request.args.get('limit', Config.TRENDING_DEFAULT_LIMIT, type=int), Config.TRENDING_MAX_LIMIT))
+    videos = trending.top(metric, limit, account_id=None if scope == 'all' else account_id)
+    if scope == 'all':
+        # 账号数据按用户隔离，跨账号排名中不暴露其他账号的账号ID和视频ID
+        videos = [video if video['account_id'] == account_id else
+                  {name: value for name, value in video.items() if name not in ('account_id', 'video_id')}
+                  for video in videos]
+    return jsonify({
+        'success': True,
+        'metric': metric,
+        'scope': 'all' if scope == 'all' else 'account',
+        'window': trending.window,
+        'videos': videos
+    })
+
+# 后台导出任务（范围很大的导出写入文件后再下载）
+export_jobs = ExportJobs()
+
+@app.route('/api/export')
+def export_data():
+    """
+    导出当前快照或历史：/api/export?kind=snapshot|history&format=csv|parquet|arrow
+    
+    snapshot导出最新快照（fields同/api/data，默认全部字段）；history导出账号所有视频
+    在from/to（默认最近24小时）内的样本，tier为raw、1m、1h、1d。
+    默认以分块传输流式返回；mode=job时提交后台任务，返回202和任务状态
+    """
+    account_id = get_session_account_id()
+    if not account_id:
+        return jsonify({'success': False, 'error': '需要授权TikTok账号'}), 401
+    kind = request.args.get('kind', 'snapshot')
+    fmt = request.args.get('format', 'csv')
+    tier = request.args.get('tier', 'raw')
+    try:
+        check_format(fmt)
+        if kind not in ('snapshot', 'history'):
+            raise ValueError('kind只能是snapshot或history')
+        if tier not in ('raw', '1m', '1h', '1d'):
+            raise ValueError('tier只能是raw、1m、1h或1d')
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    tier = None if tier == 'raw' else tier
+    
+    if kind == 'snapshot':
+        snapshot = current_snapshot(account_id)
+        columns = export_columns(kind, fields=parse_fields(request.args.get('fields') or 'all'))
+        chunks = lambda: snapshot_chunks(snapshot, columns)
+        description = {'kind': kind, 'version': snapshot.version}
+    else:
+        end = int(request.args.get('to', time.time(), type=float))
+        start = int(request.args.get('from', end - 86400, type=float))
+        columns = export_columns(kind, tier=tier)
+        chunks = lambda: history_chunks(history_store, account_id, start, end, tier)
+        description = {'kind': kind, 'tier': tier or 'raw', 'from': start, 'to': end}
+    
+    if request.args.get('mode') == 'job':
+        job = export_jobs.submit(account_id, fmt, columns, chunks, description)
+        response = jsonify({'success': True, 'job': job.to_dict()})
+        response.status_code = 202
+        response.headers['Location'] = url_for('export_job_status', job_id=job.id)
+        return response
+    
+    response = Response(stream_with_context(encode(fmt, columns, chunks())), mimetype=EXPORT_FORMATS[fmt][1])
+    response.headers['Content-Disposition'] = f'attachment; filename="{export_filename(account_id, kind, fmt)}"'
+    response.cache_control.no_store = True
+    return response
+
+@app.route('/api/export/jobs/<job_id>')
+def export_job_status(job_id):
+    """后台导出任务状态，完成后download给出下载地址"""
+    job = export_jobs.get(job_id, get_session_account_id())
+    if job is None:
+        return jsonify({'success': False, 'error': '导出任务不存在'}), 404
+    result = {'success': True, 'job': job.to_dict()}
+    if job.state == 'done':
+        result['download'] = url_for('export_job_download', job_id=job.id)
+    return jsonify(result)
+
+@app.route('/api/export/jobs/<job_id>/download')
+def export_job_download(job_id):
+    """下载已完成的后台导出结果"""
+    job = export_jobs.get(job_id, get_session_account_id())
+    if job is None or job.state != 'done':
+        return jsonify({'success': False, 'error': '导出任务不存在或尚未完成'}), 404
+    return send_file(os.path.abspath(job.path), mimetype=EXPORT_FORMATS[job.format][1], as_attachment=True,
+                     download_name=export_filename(job.account_id, job.description['kind'], job.format))
+
 @app.route('/auth')
 def authorize():
     """跳转到TikTok官方API授权页面"""
@@ -365,16 +899,10 @@ def callback():
         print(f"Token响应: {token_data}")
         
         if 'access_token' in token_data:
-            # 保存访问令牌到session和app对象
-            session['access_token'] = token_data['access_token']
-            session['refresh_token'] = token_data.get('refresh_token')
-            session['token_expires'] = token_data.get('expires_in', 3600)
+            # 保存访问令牌到令牌存储（以open_id为键），session中只记录open_id
+            open_id = save_account_token(token_data)
             
-            # 保存到app对象供WebSocket使用
-            app._access_token = token_data['access_token']
-            app._refresh_token = token_data.get('refresh_token')
-            
-            print(f"成功保存访问令牌: {token_data['access_token'][:20]}...")
+            print(f"成功保存账号 {open_id} 的访问令牌: {token_data['access_token'][:20]}...")
             
             # 清除state和code_verifier
             session.pop('oauth_state', None)
@@ -425,18 +953,21 @@ def clear_config():
     try:
         Config.clear_runtime_config()
         # 清除session中的OAuth相关数据
-        session.pop('access_token', None)
-        session.pop('refresh_token', None)
-        session.pop('token_expires', None)
+        session.pop('open_id', None)
         session.pop('user_info', None)
         session.pop('oauth_state', None)
         session.pop('code_verifier', None)
         
-        # 清除app对象中的访问令牌
-        if hasattr(app, '_access_token'):
-            delattr(app, '_access_token')
-        if hasattr(app, '_refresh_token'):
-            delattr(app, '_refresh_token')
+        # 清除所有账号的访问令牌并停止调度
+        for open_id in token_store.clear():
+            scheduler.remove_account(open_id)
+        snapshot_store.clear()
+        snapshot_persistence.clear()
+        series_cache.clear()
+        trending.clear()
+        anomaly_detector.clear()
+        export_jobs.clear()
+        socket_subscriptions.clear()
         
         return jsonify({
             'success': True,
@@ -566,20 +1097,14 @@ def manual_auth():
         print(f"Token Response: {token_data}")
         
         if 'access_token' in token_data:
-            # 保存访问令牌到session和app对象
-            session['access_token'] = token_data['access_token']
-            session['refresh_token'] = token_data.get('refresh_token')
-            session['token_expires'] = token_data.get('expires_in', 3600)
-            
-            # 保存到app对象供WebSocket使用
-            app._access_token = token_data['access_token']
-            app._refresh_token = token_data.get('refresh_token')
+            # 保存访问令牌到令牌存储（以open_id为键），session中只记录open_id
+            open_id = save_account_token(token_data)
             
             # 清除临时数据
             session.pop('oauth_state', None)
             session.pop('code_verifier', None)
             
-            print(f"成功保存访问令牌: {token_data['access_token'][:20]}...")
+            print(f"成功保存账号 {open_id} 的访问令牌: {token_data['access_token'][:20]}...")
             
             return jsonify({
                 'success': True,
@@ -610,6 +1135,7 @@ def auth_status():
         'api_type': api_type,
         'configured': False,
         'authenticated': False,
+        'accounts': len(token_store),
         'message': ''
     }
     
@@ -617,9 +1143,8 @@ def auth_status():
         # 检查是否已配置客户端密钥
         if Config.has_official_api_config():
             status['configured'] = True
-            # 检查是否已获得access_token（session或app对象）
-            has_token = 'access_token' in session or hasattr(app, '_access_token')
-            if has_token:
+            # 检查当前session对应的账号是否已授权
+            if session.get('open_id') in token_store:
                 status['authenticated'] = True
                 status['message'] = '已成功连接TikTok官方API'
             else:
@@ -639,12 +1164,12 @@ def auth_status():
 def test_api_endpoints():
     """测试TikTok API端点"""
     try:
-        access_token = getattr(app, '_access_token', None) or session.get('access_token')
-        if not access_token:
+        account = token_store.get(session.get('open_id'))
+        if account is None:
             return jsonify({'error': '需要先授权'}), 401
         
         from oauth_handler import TikTokOfficialAPI
-        api = TikTokOfficialAPI(access_token)
+        api = TikTokOfficialAPI(account.access_token)
         test_results = api.test_api_endpoints()
         
         return jsonify({
@@ -656,24 +1181,30 @@ def test_api_endpoints():
 
 @socketio.on('connect')
 def handle_connect():
-    """处理WebSocket连接"""
-    print("客户端已连接")
+    """
+    处理WebSocket连接
     
-    # 发送当前数据给新连接的客户端
+    连接参数fields为字段投影（与/api/data相同）；codec=msgpack时改用二进制的data_update_bin事件，
+    服务端不支持msgpack时仍使用JSON
+    """
+    open_id = session.get('open_id')
+    print(f"客户端已连接: {open_id}")
+    
+    # 发送当前快照给新连接的客户端
     try:
-        # 获取当前数据（非后台任务）
-        data, status, message = update_data(from_background=False)
-        
-        # 构造数据负载
-        data_payload = {
-            'videos': data,
-            'status': status,
-            'message': message,
-            'timestamp': datetime.datetime.now().isoformat()
-        }
+        # Socket会话中的修改只对当前连接有效
+        fields = session['fields'] = parse_fields(request.args.get('fields'))
+        codec = session['codec'] = parse_codec(request.args.get('codec'))
+        snapshot = current_snapshot(open_id)
         
-        emit('data_update', data_payload)
-        print(f"✅ 向新连接客户端发送数据: {len(data)} 条记录")
+        # 加入账号（及字段投影、编码）房间，只接收该账号的数据推送
+        if open_id:
+            join_subscription_room(open_id, fields, codec)
+            # 加入房间后重新读取，避免错过期间发布的版本
+            snapshot = snapshot_store.get(open_id) or snapshot
+        
+        emit_snapshot(snapshot)
+        print(f"✅ 向新连接客户端发送数据: 版本 {snapshot.version}, {len(snapshot.videos)} 条记录")
     except Exception as e:
         print(f"❌ 发送初始数据失败: {e}")
         # 发送错误状态给客户端
@@ -695,12 +1226,29 @@ def handle_disconnect():
 
 @socketio.on('request_update')
 def handle_request_update():
-    """处理客户端请求数据更新"""
+    """处理客户端请求数据更新（与/api/refresh共用限流），并回复refresh_status说明数据新鲜度"""
     try:
-        update_data(from_background=False)
+        snapshot, result = manual_refresh(session.get('open_id'))
+        if snapshot.account_id is None or result in ('throttled', 'failed'):
+            # 没有发布新快照（临时快照、限流或失败），当前快照只回复给请求的客户端
+            emit_snapshot(snapshot)
+        emit('refresh_status', freshness(snapshot, result))
     except Exception as e:
         print(f"❌ 客户端请求更新失败: {e}")
 
+@socketio.on('set_fields')
+def handle_set_fields(data):
+    """切换当前连接的字段投影，并立即发送该投影下的当前快照"""
+    try:
+        value = data.get('fields') if isinstance(data, dict) else data
+        fields = session['fields'] = parse_fields(value)
+        open_id = session.get('open_id')
+        if open_id:
+            join_subscription_room(open_id, fields, session.get('codec', 'json'))
+        emit_snapshot(current_snapshot(open_id))
+    except Exception as e:
+        print(f"❌ 切换字段投影失败: {e}")
+
 
 
 def generate_sample_data_with_note(note="模拟数据"):
@@ -743,7 +1291,8 @@ def generate_display_api_demo_data():
             'video_id': f'demo_video_{i+1}',
             'description': sample_descriptions[i],
             'author': 'Display API 演示',
-            'publish_time': publish_time,
+            # 与真实数据一样使用ISO格式字符串（_parse_timestamp），游标编码和按发布时间筛选都按字符串比较
+            'publish_time': publish_time.isoformat(),
             'views': views,
             'likes': likes,
             'comments': comments,
@@ -761,29 +1310,69 @@ def generate_display_api_demo_data():
     
     return demo_videos
 
-def schedule_updates():
-    """定时任务调度器"""
-    print("🔄 定时更新任务启动")
-    while True:
-        try:
-            # 每30秒更新一次数据
-            time.sleep(30)
-            print("⏰ 执行定时数据更新...")
-            # 使用from_background=True避免Flask上下文问题和WebSocket发送
-            update_data(from_background=True)
-        except Exception as e:
-            print(f"定时更新任务异常: {e}")
-            time.sleep(60)  # 出错时等待更长时间
+def scheduled_update(account_id, deadline):
+    """刷新工作池执行的任务（定时刷新和手动刷新），返回是否成功（定时刷新失败时调度器会指数退避）"""
+    print(f"⏰ 执行定时数据更新: {account_id}")
+    # 使用from_background=True避免访问Flask session
+    snapshot = update_data(account_id=account_id, from_background=True, deadline=deadline)
+    if snapshot.status == 'error':
+        # 失败原因记录到任务的error中，手动刷新据此返回failed
+        raise Exception(snapshot.message)
+    return True
+
+# 定时任务调度器：每个已授权账号独立排期，到期后交给有界工作池并发刷新
+refresh_pool = RefreshWorkerPool(scheduled_update)
+scheduler = RefreshScheduler(refresh_pool)
+
+def restore_snapshots():
+    """
+    恢复持久化的快照和令牌（处理第一个请求之前执行）
+
+    有令牌的账号加入刷新调度，在后台立即刷新；调度线程由调用方启动。
+    gunicorn（preload_app）时在每个worker的post_fork中调用：主进程只在启动时加载一次，
+    按max_requests回收后重新fork的worker若继承主进程启动时的状态，快照、版本号和令牌都是过期的
+    """
+    restored = 0
+    for snapshot, token in snapshot_persistence.load():
+        snapshot = snapshot_store.restore(snapshot)
+        # 恢复的计数作为增速窗口的起点，重启后的第一次刷新即可计算增速
+        trending.record(snapshot)
+        if token and token.get('access_token'):
+            token_store.restore(snapshot.account_id, token)
+            scheduler.add_account(snapshot.account_id, run_now=True)
+        restored += 1
+    if restored:
+        print(f"♻️ 已从磁盘恢复 {restored} 个账号的快照")
+
+# gunicorn配置中设置了RESTORE_IN_WORKER，由post_fork在worker进程中恢复
+if not os.environ.get('RESTORE_IN_WORKER'):
+    restore_snapshots()
+
+@app.route('/api/scheduler')
+def scheduler_status():
+    """调度器自省：队列深度、延迟、每个账号的上次运行耗时和工作池指标"""
+    return jsonify(scheduler.stats())
+
+@app.route('/api/history_stats')
+def history_stats():
+    """历史存储自省：写入行数、批次数、批次耗时和汇总任务的水位"""
+    return jsonify({**history_store.stats(), 'rollup': history_store.rollup.stats()})
+
+@app.route('/api/socket_stats')
+def socket_stats():
+    """Socket推送自省：合并/补发计数和每个客户端的发送队列深度"""
+    return jsonify(emitter.stats())
+
+@app.route('/api/anomaly_stats')
+def anomaly_stats():
+    """异常检测自省：检测次数、报告的突增/停滞数量和单次检测耗时"""
+    return jsonify(anomaly_detector.stats())
 
 if __name__ == '__main__':
     import os
     
-    # 初始化数据
-    current_data = generate_sample_data()
-    
-    # 启动定时任务线程
-    update_thread = threading.Thread(target=schedule_updates, daemon=True)
-    update_thread.start()
+    # 启动定时任务调度器
+    scheduler.start()
     
     # 获取端口号（云平台会设置PORT环境变量）
     port = int(os.environ.get('PORT', 5000))
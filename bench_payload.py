@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+数据负载编码基准测试
+
+对比每个客户端各自序列化一次（原先 jsonify / socket emit 的做法）
+与每个快照版本只序列化一次、所有客户端复用字节串的CPU开销，
+以及记录数组和列式格式（format=columnar）的负载大小与解析耗时。
+
+用法:
+    python bench_payload.py --videos 200 --clients 1000
+    python bench_payload.py --videos 1000
+"""
+
+import argparse
+import datetime
+import json
+import random
+import time
+import gzip
+
+from compression import SUPPORTED_ENCODINGS, compress
+from json_codec import dumps_bytes, loads, orjson
+from msgpack_codec import msgpack, packb
+from snapshot_store import DASHBOARD_FIELDS, make_snapshot
+
+
+def make_videos(count: int) -> list:
+    """生成与 process_video_analytics 输出结构一致的模拟视频数据"""
+    now = datetime.datetime.now()
+    videos = []
+    for i in range(count):
+        views = random.randint(1000, 500000)
+        likes = random.randint(10, views // 10)
+        videos.append({
+            'video_id': f'7{random.randint(10**17, 10**18 - 1)}',
+            'description': f'视频描述 #{i} #TikTok #数据分析',
+            'title': f'视频标题 {i}',
+            'author': 'current_user',
+            'publish_time': (now - datetime.timedelta(hours=i * 7)).isoformat(),
+            'views': views,
+            'likes': likes,
+            'comments': likes // 20,
+            'shares': likes // 50,
+            'duration': random.randint(10, 90),
+            'engagement_rate': round(random.uniform(1, 15), 2),
+            'avg_watch_time': round(random.uniform(3, 40), 1),
+            'completion_rate': round(random.uniform(20, 90), 1),
+            'bounce_rate': round(random.uniform(1, 9), 2),
+            'share_url': f'https://www.tiktok.com/@creator/video/{i}',
+            'cover_image': f'https://p16-sign.tiktokcdn.com/obj/cover_{i}.jpeg?x-expires=1700000000&x-signature=abc',
+            'stats_updated_at': now.isoformat(),
+            'new_followers': likes // 50
+        })
+    return videos
+
+
+def cpu_time(func, repeat: int) -> float:
+    """执行func repeat次的CPU耗时（秒）"""
+    start = time.process_time()
+    for _ in range(repeat):
+        func()
+    return time.process_time() - start
+
+
+def decode_columnar(payload: dict) -> list:
+    """与 main.js 中 decodeVideos 相同的还原逻辑"""
+    columns = payload['columns']
+    return [
+        {'video_id': video_id, **{name: values[i] for name, values in columns.items() if values[i] is not None}}
+        for i, video_id in enumerate(payload['index'])
+    ]
+
+
+def compare_layouts(snapshot):
+    """对比记录数组和列式格式的负载大小与解析耗时（面板默认字段投影）"""
+    print("格式对比（面板默认字段投影）:")
+    for layout in ('rows', 'columnar'):
+        data = snapshot.encoded(DASHBOARD_FIELDS, layout)
+        parse = cpu_time(lambda: json.loads(data), 20) / 20
+        if layout == 'columnar':
+            decode = cpu_time(lambda: decode_columnar(json.loads(data)), 20) / 20
+        else:
+            decode = parse
+        print(f"  {layout:<8}: {len(data) / 1024:.1f} KB, gzip {len(gzip.compress(data)) / 1024:.1f} KB, "
+              f"json.loads {parse * 1000:.2f} ms, 解析并还原为记录 {decode * 1000:.2f} ms")
+
+
+def compare_socket_codecs(snapshot):
+    """对比Socket推送的JSON和MessagePack负载大小与编解码耗时（面板默认字段投影）"""
+    if msgpack is None:
+        print("Socket编码对比: 未安装msgpack，跳过")
+        return
+    payload = snapshot.to_payload(DASHBOARD_FIELDS)
+    json_data, packed = dumps_bytes(payload), packb(payload)
+    print("Socket编码对比（面板默认字段投影）:")
+    print(f"  json    : {len(json_data) / 1024:.1f} KB, 编码 {cpu_time(lambda: dumps_bytes(payload), 20) / 20 * 1000:.2f} ms, "
+          f"解码 {cpu_time(lambda: loads(json_data), 20) / 20 * 1000:.2f} ms")
+    print(f"  msgpack : {len(packed) / 1024:.1f} KB, 编码 {cpu_time(lambda: packb(payload), 20) / 20 * 1000:.2f} ms, "
+          f"解码 {cpu_time(lambda: msgpack.unpackb(packed), 20) / 20 * 1000:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='数据负载编码基准测试')
+    parser.add_argument('--videos', type=int, default=200, help='快照中的视频数量')
+    parser.add_argument('--clients', type=int, default=1000, help='客户端数量')
+    args = parser.parse_args()
+
+    snapshot = make_snapshot('bench', 1, make_videos(args.videos), 'success', 'benchmark')
+    payload = snapshot.to_payload()
+
+    # 原做法：每个客户端都用标准库json（Flask默认编码器）重新编码一次
+    per_client = cpu_time(lambda: json.dumps(payload, sort_keys=True).encode('utf-8'), args.clients)
+
+    # 新做法：每个版本编码一次，所有客户端复用字节串
+    def encode_once():
+        snapshot._cache.clear()
+        data = snapshot.encoded()
+        for _ in range(args.clients):
+            data = snapshot.encoded()
+        return data
+    once = cpu_time(encode_once, 1)
+
+    print(f"视频数: {args.videos}, 客户端数: {args.clients}, 负载大小: {len(snapshot.encoded()) / 1024:.1f} KB")
+    print(f"JSON库: {'orjson' if orjson is not None else 'json (标准库)'}")
+    print(f"每客户端编码一次: {per_client * 1000:.1f} ms CPU")
+    print(f"每版本编码一次:   {once * 1000:.1f} ms CPU")
+    print(f"每1000个客户端节省: {(per_client - once) * 1000 * 1000 / args.clients:.1f} ms CPU")
+    print(f"单次编码耗时: 标准库 {cpu_time(lambda: json.dumps(payload), 20) / 20 * 1000:.2f} ms, "
+          f"dumps_bytes {cpu_time(lambda: dumps_bytes(payload), 20) / 20 * 1000:.2f} ms")
+
+    # 压缩：每个版本每种编码只压缩一次，对比每个客户端各自压缩
+    data = snapshot.encoded()
+    for encoding in SUPPORTED_ENCODINGS:
+        size = len(snapshot.compressed(encoding))
+        single = cpu_time(lambda: compress(data, encoding), 10) / 10
+        print(f"{encoding}: {size / 1024:.1f} KB（{size / len(data) * 100:.0f}%）, 单次压缩 {single * 1000:.2f} ms, "
+              f"每客户端压缩一次共 {single * args.clients * 1000:.0f} ms CPU")
+
+    compare_layouts(snapshot)
+    compare_socket_codecs(snapshot)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""
+响应压缩 - 按Accept-Encoding协商gzip/brotli，小于阈值的负载不压缩
+"""
+
+import gzip
+from typing import Optional
+from config import Config
+
+try:
+    import brotli
+except ImportError:  # brotli为可选依赖，未安装时只提供gzip
+    brotli = None
+
+# 按优先级排列的可用编码
+SUPPORTED_ENCODINGS = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """按指定编码压缩数据"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=Config.BROTLI_QUALITY)
+    if encoding == 'gzip':
+        # mtime固定为0，同一负载的压缩结果完全一致
+        return gzip.compress(data, compresslevel=Config.GZIP_LEVEL, mtime=0)
+    raise ValueError(f"不支持的压缩编码: {encoding}")
+
+
+def negotiate_encoding(accept_encodings, size: int) -> Optional[str]:
+    """
+    根据请求的Accept-Encoding选择压缩编码
+
+    Args:
+        accept_encodings: werkzeug解析后的request.accept_encodings
+        size: 未压缩负载的字节数
+
+    Returns:
+        编码名称；负载小于COMPRESSION_MIN_SIZE或客户端不支持时返回None
+    """
+    if size < Config.COMPRESSION_MIN_SIZE:
+        return None
+    return accept_encodings.best_match(SUPPORTED_ENCODINGS)
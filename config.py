@@ -26,7 +26,107 @@ class Config:
     TIKTOK_API_BASE_URL = 'https://open.tiktokapis.com/v2'
     
     # 数据更新间隔（秒）
-    UPDATE_INTERVAL = 30
+    UPDATE_INTERVAL = int(os.environ.get('UPDATE_INTERVAL') or 30)
+    # 刷新调度：抖动比例、失败退避上限（秒）、工作池大小（并发刷新账号数上限）
+    UPDATE_JITTER = float(os.environ.get('UPDATE_JITTER') or 0.1)
+    UPDATE_MAX_BACKOFF = int(os.environ.get('UPDATE_MAX_BACKOFF') or 600)
+    UPDATE_CONCURRENCY = int(os.environ.get('UPDATE_CONCURRENCY') or 4)
+    # 单次账号刷新的截止时长（秒），包括排队等待和所有上游请求
+    REFRESH_DEADLINE = int(os.environ.get('REFRESH_DEADLINE') or 45)
+    # 手动刷新的最小间隔（秒）：距上次刷新不足该时长时直接返回最近的快照
+    MIN_REFRESH_INTERVAL = int(os.environ.get('MIN_REFRESH_INTERVAL') or 15)
+    # 全局上游请求并发上限和单个请求超时（秒）
+    UPSTREAM_CONCURRENCY = int(os.environ.get('UPSTREAM_CONCURRENCY') or 8)
+    UPSTREAM_TIMEOUT = int(os.environ.get('UPSTREAM_TIMEOUT') or 15)
+    
+    # 视频统计分层刷新：[(最大视频年龄秒数, 刷新间隔秒数), ...]，None表示不限
+    STATS_REFRESH_TIERS = [
+        (48 * 3600, 60),          # 发布48小时内：每分钟
+        (7 * 24 * 3600, 3600),    # 7天内：每小时
+        (None, 24 * 3600)         # 更早：每天
+    ]
+    # 观看增速（次/小时）超过该值的视频提升到最高频层级
+    STATS_HOT_VELOCITY = int(os.environ.get('STATS_HOT_VELOCITY') or 500)
+    # /v2/video/query/ 单次最多查询的视频ID数量
+    VIDEO_QUERY_BATCH_SIZE = 20
+    
+    # 视频详情（描述、嵌入代码等大字段）缓存时间（秒）
+    VIDEO_DETAIL_TTL = int(os.environ.get('VIDEO_DETAIL_TTL') or 3600)
+    
+    # /api/data分页查询（sort/筛选/cursor参数）的默认和最大每页条数
+    DATA_PAGE_SIZE = int(os.environ.get('DATA_PAGE_SIZE') or 50)
+    DATA_MAX_PAGE_SIZE = int(os.environ.get('DATA_MAX_PAGE_SIZE') or 500)
+    
+    # 长轮询（/api/data?since=版本号）最长挂起时间（秒）
+    LONG_POLL_TIMEOUT = int(os.environ.get('LONG_POLL_TIMEOUT') or 25)
+    
+    # SSE推送（/api/stream）：心跳间隔（秒）和客户端断线重连等待时间（毫秒）
+    SSE_KEEPALIVE = int(os.environ.get('SSE_KEEPALIVE') or 15)
+    SSE_RETRY_MS = int(os.environ.get('SSE_RETRY_MS') or 3000)
+    
+    # Socket.IO推送节拍（秒）：每个房间每个节拍最多发送一帧，期间的多次发布只发送最新版本
+    SOCKET_EMIT_INTERVAL = float(os.environ.get('SOCKET_EMIT_INTERVAL') or 1.0)
+    # 客户端发送队列积压达到该数量时暂停向其推送，队列清空后补发最新一帧
+    SOCKET_MAX_QUEUE = int(os.environ.get('SOCKET_MAX_QUEUE') or 8)
+    
+    # 面板的二进制（MessagePack）推送：默认关闭，面板使用JSON且不加载MessagePack解码库；
+    # 设为1时页面从CDN加载解码库并请求data_update_bin，也可以在页面地址上加?codec=msgpack单独开启
+    SOCKET_BINARY_CODEC = bool(int(os.environ.get('SOCKET_BINARY_CODEC') or 0))
+    
+    # 每个账号保留的历史快照数量，断线重连时可以只发送增量
+    SNAPSHOT_HISTORY = int(os.environ.get('SNAPSHOT_HISTORY') or 8)
+    # 最新快照的持久化目录，进程重启时从这里恢复
+    SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR') or 'data/snapshots'
+    
+    # 视频计数历史存储（SQLite WAL）：数据库路径、每个写入事务的最大行数和最长写入间隔（秒）
+    HISTORY_DB_PATH = os.environ.get('HISTORY_DB_PATH') or 'data/history.db'
+    HISTORY_BATCH_SIZE = int(os.environ.get('HISTORY_BATCH_SIZE') or 5000)
+    HISTORY_FLUSH_INTERVAL = float(os.environ.get('HISTORY_FLUSH_INTERVAL') or 2.0)
+    # 历史汇总（分钟/小时/天）运行间隔（秒）和各层级保留天数（0表示永久保留）
+    HISTORY_ROLLUP_INTERVAL = int(os.environ.get('HISTORY_ROLLUP_INTERVAL') or 60)
+    HISTORY_RAW_RETENTION_DAYS = int(os.environ.get('HISTORY_RAW_RETENTION_DAYS') or 2)
+    HISTORY_MINUTE_RETENTION_DAYS = int(os.environ.get('HISTORY_MINUTE_RETENTION_DAYS') or 14)
+    HISTORY_HOUR_RETENTION_DAYS = int(os.environ.get('HISTORY_HOUR_RETENTION_DAYS') or 365)
+    HISTORY_DAY_RETENTION_DAYS = int(os.environ.get('HISTORY_DAY_RETENTION_DAYS') or 0)
+    # 冷历史归档：早于该天数的分钟/小时汇总封存为只读列式段文件
+    HISTORY_ARCHIVE_DIR = os.environ.get('HISTORY_ARCHIVE_DIR') or 'data/archive'
+    HISTORY_ARCHIVE_AFTER_DAYS = int(os.environ.get('HISTORY_ARCHIVE_AFTER_DAYS') or 7)
+    
+    # 历史曲线（/api/series）：默认/最大点数、单次最多扫描的样本数（超过时改用更粗的汇总层级）、
+    # 结果缓存条数和缓存有效期（秒，新样本和新汇总的桶在有效期后出现在曲线中）
+    SERIES_DEFAULT_POINTS = int(os.environ.get('SERIES_DEFAULT_POINTS') or 500)
+    SERIES_MAX_POINTS = int(os.environ.get('SERIES_MAX_POINTS') or 2000)
+    SERIES_MAX_SAMPLES = int(os.environ.get('SERIES_MAX_SAMPLES') or 5000)
+    SERIES_CACHE_SIZE = int(os.environ.get('SERIES_CACHE_SIZE') or 256)
+    SERIES_CACHE_TTL = float(os.environ.get('SERIES_CACHE_TTL') or 30)
+    
+    # 热门趋势（/api/trending）：增速计算的滑动窗口（秒）、默认/最大返回条数
+    TRENDING_WINDOW = int(os.environ.get('TRENDING_WINDOW') or 3600)
+    TRENDING_DEFAULT_LIMIT = int(os.environ.get('TRENDING_DEFAULT_LIMIT') or 20)
+    TRENDING_MAX_LIMIT = int(os.environ.get('TRENDING_MAX_LIMIT') or 100)
+    
+    # 计数异常检测：z-score阈值、加权均值/方差的衰减系数、开始报告前需要的样本数、
+    # 判定停滞至少需要冻结的平均变化间隔个数、增速标准差下限（次/小时，避免平稳增长的视频稍有波动就报告）
+    ANOMALY_Z_THRESHOLD = float(os.environ.get('ANOMALY_Z_THRESHOLD') or 5.0)
+    ANOMALY_ALPHA = float(os.environ.get('ANOMALY_ALPHA') or 0.1)
+    ANOMALY_MIN_SAMPLES = int(os.environ.get('ANOMALY_MIN_SAMPLES') or 8)
+    ANOMALY_STALL_INTERVALS = float(os.environ.get('ANOMALY_STALL_INTERVALS') or 3)
+    ANOMALY_MIN_STD = float(os.environ.get('ANOMALY_MIN_STD') or 20)
+    # 报告突增还要求增速至少为均值的该倍数
+    ANOMALY_SPIKE_RATIO = float(os.environ.get('ANOMALY_SPIKE_RATIO') or 3)
+    # 单个anomaly事件最多列出的视频数（按|z|从大到小），上游整体停滞时其余只计数
+    ANOMALY_MAX_EVENTS = int(os.environ.get('ANOMALY_MAX_EVENTS') or 100)
+    
+    # 数据导出：每块的行数（内存占用与之成正比）、后台导出任务的目录、并发数和结果保留时间（秒）
+    EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE') or 10000)
+    EXPORT_DIR = os.environ.get('EXPORT_DIR') or 'data/exports'
+    EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS') or 2)
+    EXPORT_JOB_TTL = int(os.environ.get('EXPORT_JOB_TTL') or 3600)
+    
+    # 响应压缩：小于COMPRESSION_MIN_SIZE字节的负载不压缩（压缩收益抵不上CPU开销）
+    COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE') or 1024)
+    GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL') or 6)
+    BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY') or 5)
     
     # 运行时API配置存储
     _runtime_client_key = None
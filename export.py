@@ -0,0 +1,276 @@
+"""
+数据导出 - 把当前快照或一段历史以CSV、Parquet或Arrow IPC流式输出
+
+数据源按块产出行，编码器每处理一块就输出对应的字节，HTTP响应以分块传输边生成边发送，
+内存占用只与块大小有关，与导出的总行数无关。范围很大的导出可以提交为后台任务，
+写入EXPORT_DIR下的文件后再下载。
+"""
+
+import csv
+import io
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from config import Config
+from history_store import COUNTER_FIELDS, ROLLUP_COLUMNS
+from snapshot_store import VIDEO_FIELDS
+from worker_pool import gevent_patched
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # pyarrow为可选依赖，未安装时只支持CSV
+    pyarrow = None
+
+# 导出格式: (扩展名, MIME类型)
+EXPORT_FORMATS = {
+    'csv': ('csv', 'text/csv; charset=utf-8'),
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('arrows', 'application/vnd.apache.arrow.stream')
+}
+
+# 各字段的列类型（Parquet/Arrow的schema需要在第一块之前确定，整列为空的块也不能改变类型）
+INTEGER_FIELDS = {'views', 'likes', 'comments', 'shares', 'new_followers', 'ts', 'bucket', *ROLLUP_COLUMNS}
+FLOAT_FIELDS = {'duration', 'engagement_rate', 'avg_watch_time', 'completion_rate', 'bounce_rate'}
+
+
+def export_columns(kind: str, tier: Optional[str] = None,
+                   fields: Optional[Tuple[str, ...]] = None) -> Tuple[str, ...]:
+    """导出的列名：快照为视频字段，历史为(video_id, 时间, 计数列...)"""
+    if kind == 'snapshot':
+        return fields or VIDEO_FIELDS
+    if tier is None:
+        return ('video_id', 'ts', *COUNTER_FIELDS)
+    return ('video_id', 'bucket', *ROLLUP_COLUMNS)
+
+
+def snapshot_chunks(snapshot, columns: Tuple[str, ...], chunk_size: int = None) -> Iterator[List[Tuple]]:
+    """按块产出快照中的视频行"""
+    chunk_size = chunk_size or Config.EXPORT_CHUNK_SIZE
+    videos = snapshot.videos
+    for start in range(0, len(videos), chunk_size):
+        yield [tuple(video.get(name) for name in columns) for video in videos[start:start + chunk_size]]
+
+
+def history_chunks(history_store, account_id: str, start: float, end: float, tier: Optional[str],
+                   chunk_size: int = None) -> Iterator[List[Tuple]]:
+    """按块产出账号在时间范围内的历史样本或汇总"""
+    return history_store.iter_range(account_id, start, end, tier, chunk_size or Config.EXPORT_CHUNK_SIZE)
+
+
+class _ChunkSink:
+    """Parquet/Arrow写入器的输出对象：缓存写入的字节，每处理一块由调用方取走"""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def arrow_schema(columns: Tuple[str, ...]):
+    return pyarrow.schema([
+        (name, pyarrow.int64() if name in INTEGER_FIELDS else
+         pyarrow.float64() if name in FLOAT_FIELDS else pyarrow.string())
+        for name in columns
+    ])
+
+
+def encode_csv(columns: Tuple[str, ...], chunks: Iterable[List[Tuple]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    tail = buffer.getvalue()
+    if tail:
+        yield tail.encode('utf-8')
+
+
+def encode_arrow(columns: Tuple[str, ...], chunks: Iterable[List[Tuple]], fmt: str) -> Iterator[bytes]:
+    """Parquet（每块一个行组）或Arrow IPC流（每块一个记录批次）"""
+    schema = arrow_schema(columns)
+    sink = _ChunkSink()
+    if fmt == 'parquet':
+        writer = pyarrow.parquet.ParquetWriter(sink, schema, compression='zstd')
+    else:
+        writer = pyarrow.ipc.new_stream(sink, schema)
+    try:
+        for rows in chunks:
+            if not rows:
+                continue
+            arrays = [pyarrow.array(list(values), type=field.type) for values, field in zip(zip(*rows), schema)]
+            writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def encode(fmt: str, columns: Tuple[str, ...], chunks: Iterable[List[Tuple]]) -> Iterator[bytes]:
+    """按格式编码分块的行，逐块产出字节"""
+    if fmt == 'csv':
+        return encode_csv(columns, chunks)
+    if pyarrow is None:
+        raise ValueError(f"{fmt}格式需要安装pyarrow")
+    return encode_arrow(columns, chunks, fmt)
+
+
+def check_format(fmt: str):
+    """检查导出格式是否可用，不可用时抛出ValueError"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"format只能是: {', '.join(EXPORT_FORMATS)}")
+    if fmt != 'csv' and pyarrow is None:
+        raise ValueError(f"{fmt}格式需要安装pyarrow")
+
+
+class ExportJob:
+    """一个后台导出任务"""
+
+    def __init__(self, account_id: str, fmt: str, description: Dict):
+        self.id = uuid.uuid4().hex
+        self.account_id = account_id
+        self.format = fmt
+        self.description = description
+        self.state = 'queued'
+        self.rows = 0
+        self.bytes = 0
+        self.error = None
+        self.path = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self) -> Dict:
+        return {
+            'id': self.id,
+            'state': self.state,
+            'format': self.format,
+            'export': self.description,
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'error': self.error,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at
+        }
+
+
+class ExportJobs:
+    """
+    后台导出任务
+
+    任务在有界线程池中执行（gevent模式下为gevent的原生线程池，编码和写文件不阻塞hub），
+    结果先写临时文件再改名；完成超过EXPORT_JOB_TTL秒的任务和文件在提交新任务时清理
+    """
+
+    def __init__(self, directory: str = None, workers: int = None):
+        self.directory = directory or Config.EXPORT_DIR
+        workers = workers or Config.EXPORT_WORKERS
+        if gevent_patched():
+            # monkey patch后ThreadPoolExecutor的工作线程是greenlet，改用始终使用原生线程的实现
+            from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+            self._executor = NativeThreadPoolExecutor(max_workers=workers)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='export')
+        self._jobs: Dict[str, ExportJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, account_id: str, fmt: str, columns: Tuple[str, ...],
+               chunks: Callable[[], Iterable[List[Tuple]]], description: Dict) -> ExportJob:
+        """提交任务，chunks在工作线程中调用以产出数据块"""
+        check_format(fmt)
+        self._expire()
+        job = ExportJob(account_id, fmt, description)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, columns, chunks)
+        return job
+
+    def _run(self, job: ExportJob, columns: Tuple[str, ...], chunks: Callable[[], Iterable[List[Tuple]]]):
+        job.state = 'running'
+        path = os.path.join(self.directory, f'{job.id}.{EXPORT_FORMATS[job.format][0]}')
+        temp = f'{path}.tmp'
+
+        def counted():
+            for rows in chunks():
+                job.rows += len(rows)
+                yield rows
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temp, 'wb') as f:
+                for data in encode(job.format, columns, counted()):
+                    f.write(data)
+                    job.bytes += len(data)
+            os.replace(temp, path)
+            job.path = path
+            job.state = 'done'
+            print(f"📦 导出任务完成 [{job.account_id}]: {job.id}, {job.rows} 行, {job.bytes} 字节")
+        except Exception as e:
+            job.state = 'failed'
+            job.error = str(e)
+            print(f"❌ 导出任务失败 [{job.account_id}]: {job.id}: {e}")
+            if os.path.exists(temp):
+                os.remove(temp)
+        job.finished_at = time.time()
+
+    def get(self, job_id: str, account_id: str) -> Optional[ExportJob]:
+        """读取任务（只能读取本账号提交的任务）"""
+        job = self._jobs.get(job_id)
+        if job is None or job.account_id != account_id:
+            return None
+        return job
+
+    def _expire(self):
+        cutoff = time.time() - Config.EXPORT_JOB_TTL
+        with self._lock:
+            expired = [job for job in self._jobs.values() if job.finished_at and job.finished_at < cutoff]
+            for job in expired:
+                del self._jobs[job.id]
+        for job in expired:
+            if job.path and os.path.exists(job.path):
+                os.remove(job.path)
+
+    def clear(self):
+        """删除所有已完成任务及其文件（运行中的任务完成后仍保留）"""
+        with self._lock:
+            finished = [job for job in self._jobs.values() if job.finished_at]
+            for job in finished:
+                del self._jobs[job.id]
+        for job in finished:
+            if job.path and os.path.exists(job.path):
+                os.remove(job.path)
+
+
+def export_filename(account_id: str, kind: str, fmt: str) -> str:
+    """下载文件名: <账号>-<snapshot|history>-<时间>.<扩展名>"""
+    safe = re.sub(r'[^A-Za-z0-9_.-]', '_', account_id)
+    return f"{safe}-{kind}-{time.strftime('%Y%m%d-%H%M%S')}.{EXPORT_FORMATS[fmt][0]}"
@@ -1,5 +1,13 @@
+# gevent worker配合preload_app时，需要在加载应用之前完成monkey patch，
+# 否则应用导入时创建的锁和条件变量不是协作式的，长轮询等待会阻塞整个worker
+from gevent import monkey
+monkey.patch_all()
+
 import os
 
+# 快照和令牌在每个worker的post_fork中从磁盘恢复，而不是在主进程加载应用时恢复
+os.environ['RESTORE_IN_WORKER'] = '1'
+
 # 服务器配置
 bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
 workers = 1  # SocketIO需要单worker模式
@@ -23,4 +31,15 @@ preload_app = True
 
 # 最大请求数（防止内存泄漏）
 max_requests = 1000
-max_requests_jitter = 100 
\ No newline at end of file
+max_requests_jitter = 100 
+
+def post_fork(server, worker):
+    """
+    worker进程中恢复快照和令牌并启动刷新调度
+
+    preload_app时应用在主进程中加载，回收后重新fork的worker继承的是主进程启动时的内存，
+    因此每个worker都从磁盘读取最新持久化的快照（版本号从其之后继续）和令牌
+    """
+    from app import restore_snapshots, scheduler
+    restore_snapshots()
+    scheduler.start()
@@ -0,0 +1,447 @@
+"""
+冷历史归档 - 把超过保留阈值的汇总数据封存为不可变的列式段文件
+
+每个段文件保存一个账号在一个时间段内某个汇总层级的全部视频，按(视频, 桶)排序。
+每列对每个视频单独编码：时间戳为二阶差分，计数（最后值/最大值）为一阶差分，
+增量列保持原值，全部经zigzag变换后写为varint。文件头带每个视频的行范围、
+每列的字节偏移和时间范围（段级和视频级的最小/最大值索引）。
+
+读取时以只读方式mmap段文件，偏移表和列数据都是numpy零拷贝视图，
+查询一个视频只会触及该视频在相关段中的那几页数据。
+"""
+
+import itertools
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from config import Config
+from history_store import ROLLUP_COLUMNS
+
+MAGIC = b'TKSEG1'
+HEADER = struct.Struct('<6sI')  # 魔数, 文件头JSON长度
+
+# 段文件中的列（bucket为时间戳）及其编码
+SEGMENT_COLUMNS = ('bucket',) + ROLLUP_COLUMNS
+COLUMN_ENCODINGS = {
+    'bucket': 'delta_of_delta',
+    **{column: 'delta' if column.endswith(('_last', '_max')) else 'raw' for column in ROLLUP_COLUMNS}
+}
+
+# 归档的汇总层级和每个段覆盖的时间跨度（秒）
+ARCHIVE_SPANS = {'1m': 86400, '1h': 30 * 86400}
+
+# 解码结果中空值（该视频没有此计数）的取值，计数不会为负
+NULL_VALUE = -1
+
+
+def _zigzag(values: np.ndarray) -> np.ndarray:
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def _unzigzag(codes: np.ndarray) -> np.ndarray:
+    # 按无符号数移位，码值不小于2⁶³（绝对值不小于2⁶²的值）时int64的算术右移会带上符号位
+    codes = codes.astype(np.uint64)
+    return (codes >> np.uint64(1)).astype(np.int64) ^ -(codes & np.uint64(1)).astype(np.int64)
+
+
+def encode_varints(values: np.ndarray) -> Tuple[bytes, np.ndarray]:
+    """
+    把uint64数组编码为LEB128 varint字节串（向量化，每轮处理所有值的同一个字节）
+
+    Returns:
+        (字节串, 每个值编码结束位置的数组)
+    """
+    values = values.astype(np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    remaining = values >> np.uint64(7)
+    while remaining.any():
+        lengths += remaining > 0
+        remaining >>= np.uint64(7)
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    out = np.zeros(int(ends[-1]) if len(ends) else 0, dtype=np.uint8)
+    for k in range(int(lengths.max()) if len(lengths) else 0):
+        mask = lengths > k
+        byte = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        more = (lengths[mask] > k + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[mask] + k] = (byte | more).astype(np.uint8)
+    return out.tobytes(), ends
+
+
+def decode_varints(buffer: np.ndarray) -> np.ndarray:
+    """把varint字节（uint8数组，可以是mmap上的零拷贝视图）解码为uint64数组"""
+    if len(buffer) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    ends = np.flatnonzero(buffer < 0x80)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    positions = np.arange(len(buffer)) - np.repeat(starts, ends - starts + 1)
+    contributions = (buffer & 0x7F).astype(np.uint64) << (positions * 7).astype(np.uint64)
+    return np.add.reduceat(contributions, starts)
+
+
+def encode_column(values: np.ndarray, nulls: np.ndarray, group_starts: np.ndarray,
+                  encoding: str) -> np.ndarray:
+    """
+    对一列（多个视频首尾相接）做差分和zigzag变换，返回varint编码前的码值
+
+    每个视频的第一个值保存原值；空值的码值为0，其余码值为zigzag值加1，
+    差分以前一个非空值为基准
+    """
+    is_start = np.zeros(len(values), dtype=bool)
+    is_start[group_starts] = True
+    # 空值用组内前一个非空值填充（组首为空时填0），差分在空值处为0
+    filled = np.where(nulls, 0, values)
+    source = np.where(~nulls | is_start, np.arange(len(values)), 0)
+    filled = filled[np.maximum.accumulate(source)]
+
+    if encoding == 'raw':
+        encoded = filled
+    else:
+        previous = np.empty_like(filled)
+        previous[1:] = filled[:-1]
+        previous[is_start] = 0
+        encoded = filled - previous
+        if encoding == 'delta_of_delta':
+            previous = np.empty_like(encoded)
+            previous[1:] = encoded[:-1]
+            second = group_starts + 1
+            previous[is_start] = 0
+            previous[second[second < len(values)]] = 0
+            encoded = encoded - previous
+    codes = _zigzag(encoded) + np.uint64(1)
+    codes[nulls] = 0
+    return codes
+
+
+def decode_column(codes: np.ndarray, encoding: str) -> np.ndarray:
+    """解码一个视频的一列，空值为NULL_VALUE"""
+    nulls = codes == 0
+    values = _unzigzag(np.where(nulls, np.uint64(1), codes) - np.uint64(1))
+    if encoding == 'delta_of_delta':
+        # 第一个值为原值，第二个为一阶差分，之后为二阶差分
+        values[1:] = np.cumsum(values[1:])
+        values = np.cumsum(values)
+    elif encoding == 'delta':
+        values = np.cumsum(values)
+    if nulls.any():
+        values[nulls] = NULL_VALUE
+    return values
+
+
+def write_segment(path: str, tier: str, account_id: str, start: int, end: int, rows: List[Tuple]):
+    """
+    把按(video_id, bucket)排序的汇总行写为段文件（先写临时文件再原子替换）
+
+    rows: (video_id, bucket, *ROLLUP_COLUMNS)
+    """
+    video_ids = [row[0] for row in rows]
+    boundaries = [0] + [i for i in range(1, len(rows)) if video_ids[i] != video_ids[i - 1]]
+    group_starts = np.array(boundaries, dtype=np.int64)
+    series = [video_ids[i] for i in boundaries]
+    counts = np.diff(np.append(group_starts, len(rows)))
+
+    table = np.array([row[1:] for row in rows], dtype=object)
+    blobs, offsets, minimums, maximums = [], [], {}, {}
+    for c, column in enumerate(SEGMENT_COLUMNS):
+        raw = table[:, c]
+        nulls = np.array([value is None for value in raw], dtype=bool)
+        values = np.where(nulls, 0, raw).astype(np.int64)
+        present = values[~nulls]
+        minimums[column] = int(present.min()) if len(present) else None
+        maximums[column] = int(present.max()) if len(present) else None
+        codes = encode_column(values, nulls, group_starts, COLUMN_ENCODINGS[column])
+        blob, ends = encode_varints(codes)
+        # 每个视频的码值首尾相接，记录每个视频在列数据中的字节范围
+        column_offsets = np.zeros(len(series) + 1, dtype=np.uint64)
+        column_offsets[1:] = ends[group_starts + counts - 1]
+        blobs.append(blob)
+        offsets.append(column_offsets)
+
+    buckets = table[:, 0].astype(np.int64)
+    header = {
+        'tier': tier,
+        'account_id': account_id,
+        'start': start,
+        'end': end,
+        'rows': len(rows),
+        'columns': list(SEGMENT_COLUMNS),
+        'encodings': [COLUMN_ENCODINGS[column] for column in SEGMENT_COLUMNS],
+        'series': series,
+        'row_counts': counts.tolist(),
+        'ts_min': buckets[group_starts].tolist(),
+        'ts_max': buckets[group_starts + counts - 1].tolist(),
+        'min': minimums,
+        'max': maximums,
+        'column_sizes': [len(blob) for blob in blobs]
+    }
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    prefix = HEADER.size + len(header_bytes)
+    padding = b'\0' * (-prefix % 8)  # 偏移表按8字节对齐，便于零拷贝读取
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    temp = f'{path}.tmp'
+    with open(temp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(padding)
+        # 偏移表: 每列 len(series)+1 个uint64
+        for column_offsets in offsets:
+            f.write(column_offsets.tobytes())
+        for blob in blobs:
+            f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
+
+class Segment:
+    """只读mmap打开的段文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_size = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"不是历史段文件: {path}")
+        self.header = json.loads(self._mmap[HEADER.size:HEADER.size + header_size])
+        self.series = {video_id: i for i, video_id in enumerate(self.header['series'])}
+        self.start = self.header['start']
+        self.end = self.header['end']
+
+        prefix = HEADER.size + header_size
+        offsets_at = prefix + (-prefix % 8)
+        n = len(self.header['series']) + 1
+        columns = len(self.header['columns'])
+        # 偏移表为mmap上的零拷贝视图
+        self._offsets = np.frombuffer(self._mmap, dtype=np.uint64, count=n * columns,
+                                      offset=offsets_at).reshape(columns, n)
+        self._column_at = offsets_at + n * columns * 8 + np.concatenate(
+            ([0], np.cumsum(self.header['column_sizes'][:-1]))).astype(np.int64)
+        self._bytes = np.frombuffer(self._mmap, dtype=np.uint8)
+        # 正在读取的调用数和是否已从缓存移除（由HistoryArchive在其锁内维护）
+        self.readers = 0
+        self.evicted = False
+
+    def scan(self, video_id: str, start: int = None, end: int = None) -> Optional[Dict[str, np.ndarray]]:
+        """
+        读取一个视频在[start, end]内的数据，返回每列一个int64数组；视频不在段中或不在时间范围内时返回None
+        """
+        index = self.series.get(video_id)
+        if index is None:
+            return None
+        if (start is not None and self.header['ts_max'][index] < start) or \
+                (end is not None and self.header['ts_min'][index] > end):
+            return None
+        columns = {}
+        for c, (column, encoding) in enumerate(zip(self.header['columns'], self.header['encodings'])):
+            base = self._column_at[c]
+            view = self._bytes[base + int(self._offsets[c, index]):base + int(self._offsets[c, index + 1])]
+            columns[column] = decode_column(decode_varints(view), encoding)
+        mask = np.ones(len(columns['bucket']), dtype=bool)
+        if start is not None:
+            mask &= columns['bucket'] >= start
+        if end is not None:
+            mask &= columns['bucket'] <= end
+        if not mask.all():
+            columns = {column: values[mask] for column, values in columns.items()}
+        return columns
+
+    def rows(self) -> List[Tuple]:
+        """解码全部数据为(video_id, bucket, *ROLLUP_COLUMNS)行（合并重封时使用）"""
+        return [(video_id, *row) for video_id in self.header['series'] for row in to_rows(self.scan(video_id))]
+
+    def close(self):
+        self._bytes = None
+        self._offsets = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            # 仍有读取中的零拷贝视图，映射在视图释放后由垃圾回收关闭
+            pass
+
+
+def to_rows(columns: Dict[str, np.ndarray]) -> List[Tuple]:
+    """把scan返回的列转换为(bucket, *ROLLUP_COLUMNS)行，空值还原为None"""
+    lists = [columns[column].tolist() for column in SEGMENT_COLUMNS]
+    nullable = [COLUMN_ENCODINGS[column] == 'delta' for column in SEGMENT_COLUMNS]
+    return [
+        tuple(None if value == NULL_VALUE and flag else value for value, flag in zip(values, nullable))
+        for values in zip(*lists)
+    ]
+
+
+def _safe_name(account_id: str) -> str:
+    """账号ID转换为安全的目录名"""
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', account_id)
+
+
+class HistoryArchive:
+    """
+    段文件目录: <root>/<层级>/<账号>/<段起始时间>.seg
+
+    打开的段按路径缓存（段文件不可变）。重封或删除时从缓存移除旧段，
+    旧段的映射在最后一个正在读取它的调用结束后才关闭
+    """
+
+    def __init__(self, root: str = None):
+        self.root = root or Config.HISTORY_ARCHIVE_DIR
+        self._segments: Dict[str, Segment] = {}
+        self._lock = threading.Lock()
+
+    def segment_path(self, tier: str, account_id: str, start: int) -> str:
+        return os.path.join(self.root, tier, _safe_name(account_id), f'{start}.seg')
+
+    def _segment_paths(self, tier: str, account_id: str) -> List[Tuple[int, str]]:
+        directory = os.path.join(self.root, tier, _safe_name(account_id))
+        if not os.path.isdir(directory):
+            return []
+        paths = []
+        for name in os.listdir(directory):
+            if name.endswith('.seg'):
+                paths.append((int(name[:-4]), os.path.join(directory, name)))
+        return sorted(paths)
+
+    @contextmanager
+    def _reading(self, path: str) -> Iterator[Segment]:
+        """打开（或从缓存取得）段并在读取期间持有引用，期间被移除的段在退出时关闭"""
+        with self._lock:
+            segment = self._segments.get(path)
+            if segment is None:
+                segment = self._segments[path] = Segment(path)
+            segment.readers += 1
+        try:
+            yield segment
+        finally:
+            with self._lock:
+                segment.readers -= 1
+                close = segment.evicted and not segment.readers
+            if close:
+                segment.close()
+
+    def _evict(self, path: str):
+        with self._lock:
+            segment = self._segments.pop(path, None)
+            if segment is None:
+                return
+            segment.evicted = True
+            close = not segment.readers
+        if close:
+            segment.close()
+
+    def seal(self, tier: str, account_id: str, start: int, rows: List[Tuple]) -> str:
+        """封存一个时间段的汇总行，段已存在时与其中的数据合并（同一桶以新数据为准）"""
+        path = self.segment_path(tier, account_id, start)
+        if os.path.exists(path):
+            with self._reading(path) as segment:
+                merged = {(row[0], row[1]): row for row in segment.rows()}
+            merged.update({(row[0], row[1]): row for row in rows})
+            rows = [merged[key] for key in sorted(merged)]
+            self._evict(path)
+        write_segment(path, tier, account_id, start, start + ARCHIVE_SPANS[tier], rows)
+        return path
+
+    def scan(self, tier: str, account_id: str, video_id: str, start: int = None,
+             end: int = None) -> Dict[str, np.ndarray]:
+        """读取一个视频在时间范围内的归档数据，只打开与范围重叠的段"""
+        span = ARCHIVE_SPANS.get(tier)
+        parts = []
+        if span is not None:
+            for segment_start, path in self._segment_paths(tier, account_id):
+                if (end is not None and segment_start > end) or (start is not None and segment_start + span <= start):
+                    continue
+                with self._reading(path) as segment:
+                    columns = segment.scan(video_id, start, end)
+                if columns is not None:
+                    parts.append(columns)
+        if not parts:
+            return {column: np.zeros(0, dtype=np.int64) for column in SEGMENT_COLUMNS}
+        if len(parts) == 1:
+            return parts[0]
+        return {column: np.concatenate([part[column] for part in parts]) for column in SEGMENT_COLUMNS}
+
+    def query(self, tier: str, account_id: str, video_id: str, start: int = None,
+              end: int = None) -> List[Tuple]:
+        """按行返回归档数据: (bucket, *ROLLUP_COLUMNS)"""
+        return to_rows(self.scan(tier, account_id, video_id, start, end))
+
+    def archived_until(self, tier: str, account_id: str) -> Optional[int]:
+        """账号在该层级已封存的时间上界（最后一个段的结束时间），没有段时返回None"""
+        paths = self._segment_paths(tier, account_id)
+        if not paths or tier not in ARCHIVE_SPANS:
+            return None
+        return paths[-1][0] + ARCHIVE_SPANS[tier]
+
+    def iter_rows(self, tier: str, account_id: str, start: int = None,
+                  end: int = None) -> Iterator[List[Tuple]]:
+        """
+        逐段、逐视频读取账号在时间范围内的全部归档数据
+
+        每次产出一个视频在一个段内的(video_id, bucket, *ROLLUP_COLUMNS)行，内存占用与总行数无关
+        """
+        for rows in itertools.chain.from_iterable(self.iter_segments(tier, account_id, start, end)):
+            yield rows
+
+    def iter_segments(self, tier: str, account_id: str, start: int = None,
+                      end: int = None) -> List[Iterator[List[Tuple]]]:
+        """
+        与时间范围重叠的每个段一个迭代器（导出使用），逐视频产出该段内的行
+
+        每个迭代器内按(video_id, bucket)排序，各段时间范围不重叠，调用方可以按(video_id, bucket)归并
+        """
+        span = ARCHIVE_SPANS.get(tier)
+        if span is None:
+            return []
+        return [self._iter_segment(path, start, end) for segment_start, path in self._segment_paths(tier, account_id)
+                if not ((end is not None and segment_start > end) or
+                        (start is not None and segment_start + span <= start))]
+
+    def _iter_segment(self, path: str, start: int = None, end: int = None) -> Iterator[List[Tuple]]:
+        # 产出之间持有段的引用，导出期间同一段被重封或删除时继续读取旧映射
+        with self._reading(path) as segment:
+            for video_id in segment.header['series']:
+                columns = segment.scan(video_id, start, end)
+                if columns is not None and len(columns['bucket']):
+                    yield [(video_id, *row) for row in to_rows(columns)]
+
+    def remove_before(self, tier: str, cutoff: int) -> int:
+        """删除整段都早于cutoff的段文件，返回删除的段数量"""
+        removed = 0
+        directory = os.path.join(self.root, tier)
+        if not os.path.isdir(directory):
+            return 0
+        span = ARCHIVE_SPANS[tier]
+        for account_dir in os.listdir(directory):
+            for name in os.listdir(os.path.join(directory, account_dir)):
+                if name.endswith('.seg') and int(name[:-4]) + span <= cutoff:
+                    path = os.path.join(directory, account_dir, name)
+                    self._evict(path)
+                    os.remove(path)
+                    removed += 1
+        return removed
+
+    def stats(self) -> Dict:
+        """每个层级的段数量和总字节数"""
+        result = {}
+        for tier in ARCHIVE_SPANS:
+            directory = os.path.join(self.root, tier)
+            count = size = 0
+            if os.path.isdir(directory):
+                for dirpath, _, names in os.walk(directory):
+                    for name in names:
+                        if name.endswith('.seg'):
+                            count += 1
+                            size += os.path.getsize(os.path.join(dirpath, name))
+            result[tier] = {'segments': count, 'bytes': size}
+        return result
@@ -0,0 +1,336 @@
+"""
+计数历史汇总与保留 - 把原始样本逐层汇总为分钟、小时、天粒度，按层级删除过期数据，
+并把较早的分钟/小时汇总移入冷历史归档
+
+每一层记录一个水位（已汇总到的时间点），每次运行只处理水位之后已经完整的桶，
+并按固定时间窗口分成多个短事务，写入线程不会被长时间阻塞。
+gevent模式下汇总任务为greenlet，每轮的SQLite事务和段文件写入在原生线程中执行，不阻塞hub。
+汇总列为每个计数在桶内的最后值、最大值和相对上一个桶的增量（各桶增量之和等于区间增长）。
+"""
+
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from config import Config
+from history_archive import ARCHIVE_SPANS
+from history_store import COUNTER_FIELDS, ROLLUP_COLUMNS, ROLLUP_TIERS, connect
+from worker_pool import native_sleep, run_blocking
+
+COUNTERS = len(COUNTER_FIELDS)
+
+# 每个事务最多汇总的源数据时间跨度（秒），按层级：每个事务只处理一个目标桶，
+# 每分钟1万个视频时单个事务约为1万行原始样本或60万行分钟汇总
+ROLLUP_WINDOWS = {'1m': 60, '1h': 3600, '1d': 86400}
+
+# 原始样本写入存在延迟（写入队列批量提交），最新的这段时间暂不汇总
+ROLLUP_GRACE = 60
+
+INSERT_ROLLUP = (
+    'INSERT OR REPLACE INTO video_rollup_{tier} (account_id, video_id, bucket, ' + ', '.join(ROLLUP_COLUMNS) + ') '
+    'VALUES (?, ?, ?, ' + ', '.join('?' for _ in ROLLUP_COLUMNS) + ')'
+)
+
+UPSERT_CARRY = (
+    'INSERT OR REPLACE INTO rollup_carry (account_id, video_id, ' + ', '.join(COUNTER_FIELDS) + ') '
+    'VALUES (?, ?, ' + ', '.join('?' for _ in COUNTER_FIELDS) + ')'
+)
+
+
+def retention_days() -> Dict[str, int]:
+    """各层级的保留天数，0表示永久保留"""
+    return {
+        'raw': Config.HISTORY_RAW_RETENTION_DAYS,
+        '1m': Config.HISTORY_MINUTE_RETENTION_DAYS,
+        '1h': Config.HISTORY_HOUR_RETENTION_DAYS,
+        '1d': Config.HISTORY_DAY_RETENTION_DAYS
+    }
+
+
+def rollup_samples(rows, width: int, changed: Dict, carry: Dict) -> List[Tuple]:
+    """
+    把按(账号, 视频, 时间)排序的原始样本汇总为桶
+
+    carry为每个视频在窗口之前最后一次出现的计数，用于计算第一个桶的增量，
+    窗口结束时的计数写入changed（不修改carry，事务失败时无需回滚内存状态）；
+    视频首次出现时以该样本为基准，增量从0开始
+    """
+    buckets = {}
+    for account_id, video_id, ts, *values in rows:
+        key = (account_id, video_id)
+        previous = changed.get(key) or carry.get(key) or values
+        bucket_key = (account_id, video_id, ts - ts % width)
+        state = buckets.get(bucket_key)
+        if state is None:
+            state = buckets[bucket_key] = [None] * COUNTERS + [None] * COUNTERS + [0] * COUNTERS
+        current = list(previous)
+        for i, value in enumerate(values):
+            if value is None:
+                continue
+            if previous[i] is not None:
+                state[2 * COUNTERS + i] += value - previous[i]
+            state[i] = value
+            state[COUNTERS + i] = value if state[COUNTERS + i] is None else max(state[COUNTERS + i], value)
+            current[i] = value
+        changed[key] = current
+    return [(*key, *state) for key, state in buckets.items()]
+
+
+def merge_rollup_sql(tier: str, width: int, source: str) -> str:
+    """
+    把下层汇总合并为更粗的桶的SQL（在SQLite内完成，不把行读到Python）：
+    最后值取桶内最后一个下层桶的最后值，最大值取最大，增量求和
+    """
+    maxes = ', '.join(f'max({name}_max) AS {name}_max' for name in COUNTER_FIELDS)
+    deltas = ', '.join(f'sum({name}_delta) AS {name}_delta' for name in COUNTER_FIELDS)
+    return (
+        f'INSERT OR REPLACE INTO video_rollup_{tier} (account_id, video_id, bucket, {", ".join(ROLLUP_COLUMNS)}) '
+        f'SELECT g.account_id, g.video_id, g.bucket, '
+        + ', '.join(f'l.{name}_last' for name in COUNTER_FIELDS) + ', '
+        + ', '.join(f'g.{name}_max' for name in COUNTER_FIELDS) + ', '
+        + ', '.join(f'g.{name}_delta' for name in COUNTER_FIELDS) + ' '
+        f'FROM (SELECT account_id, video_id, bucket - bucket % {width} AS bucket, max(bucket) AS last_bucket, '
+        f'{maxes}, {deltas} FROM video_rollup_{source} WHERE bucket >= ? AND bucket < ? '
+        f'GROUP BY account_id, video_id, bucket - bucket % {width}) AS g '
+        f'JOIN video_rollup_{source} AS l ON l.account_id = g.account_id AND l.video_id = g.video_id '
+        f'AND l.bucket = g.last_bucket'
+    )
+
+
+class HistoryRollup:
+    """
+    历史汇总压缩任务
+
+    后台线程每隔interval秒运行一次run_once；也可以直接调用run_once（基准测试、手动维护）。
+    """
+
+    def __init__(self, path: str = None, interval: float = None, archive=None):
+        """
+        Args:
+            path: SQLite数据库文件路径
+            interval: 运行间隔（秒）
+            archive: 冷历史归档（HistoryArchive），超过HISTORY_ARCHIVE_AFTER_DAYS的汇总移入段文件
+        """
+        self.path = path or Config.HISTORY_DB_PATH
+        self.archive = archive
+        self.interval = interval or Config.HISTORY_ROLLUP_INTERVAL
+        self._conn = None
+        self._carry = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+        # 指标
+        self.runs = 0
+        self.last_run = None
+        self.last_duration = None
+        self.rows_rolled = {tier: 0 for tier, _ in ROLLUP_TIERS}
+        self.rows_deleted = {'raw': 0, **{tier: 0 for tier, _ in ROLLUP_TIERS}}
+        self.longest_transaction = 0.0
+        self.segments_sealed = 0
+        self.errors = 0
+
+    def start(self):
+        """启动后台汇总线程"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name='history-rollup', daemon=True)
+            self._thread.start()
+        print(f"🗜️ 历史汇总任务启动: 间隔={self.interval}s")
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception as e:
+                self.errors += 1
+                print(f"❌ 历史汇总失败: {e}")
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = connect(self.path)
+        return self._conn
+
+    def _watermark(self, name: str) -> Optional[int]:
+        row = self._connection().execute('SELECT value FROM history_watermarks WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def run_once(self, now: float = None) -> Dict[str, int]:
+        """执行一轮汇总和保留清理，返回本轮每个层级新写入的汇总行数"""
+        started = time.perf_counter()
+        now = time.time() if now is None else now
+        # 锁由调用方（greenlet）持有，等待锁的stats()只挂起当前greenlet
+        with self._lock:
+            rolled = run_blocking(self._run, now)
+        self.runs += 1
+        self.last_run = time.time()
+        self.last_duration = time.perf_counter() - started
+        return rolled
+
+    def _run(self, now: float) -> Dict[str, int]:
+        rolled = {}
+        # 上一层已汇总到的时间点：第一层的源数据为原始样本，截止到当前时间减去写入延迟
+        source_limit = int(now) - ROLLUP_GRACE
+        source = None
+        for tier, width in ROLLUP_TIERS:
+            rolled[tier] = self._rollup_tier(tier, width, source, source_limit)
+            source = tier
+            source_limit = self._watermark(tier) or 0
+        self._apply_retention(now)
+        if self.archive is not None:
+            self._archive_closed(now)
+        return rolled
+
+    def _rollup_tier(self, tier: str, width: int, source: Optional[str], source_limit: int) -> int:
+        """把源数据中水位之后、source_limit之前已完整的桶汇总到tier层"""
+        conn = self._connection()
+        limit = source_limit - source_limit % width
+        watermark = self._watermark(tier)
+        if watermark is None:
+            # 首次运行从源数据最早的时间开始
+            if source is None:
+                row = conn.execute('SELECT min(ts) FROM video_samples').fetchone()
+            else:
+                row = conn.execute(f'SELECT min(bucket) FROM video_rollup_{source}').fetchone()
+            if row[0] is None:
+                return 0
+            watermark = row[0] - row[0] % width
+
+        written = 0
+        step = max(width, ROLLUP_WINDOWS[tier] - ROLLUP_WINDOWS[tier] % width)
+        while watermark < limit:
+            end = min(watermark + step, limit)
+            began = time.perf_counter()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if source is None:
+                    rows = conn.execute(
+                        'SELECT account_id, video_id, ts, ' + ', '.join(COUNTER_FIELDS) + ' FROM video_samples '
+                        'WHERE ts >= ? AND ts < ? ORDER BY account_id, video_id, ts', (watermark, end)
+                    ).fetchall()
+                    carry = self._load_carry(conn)
+                    changed = {}
+                    buckets = rollup_samples(rows, width, changed, carry)
+                    conn.executemany(UPSERT_CARRY, [(*key, *values) for key, values in changed.items()])
+                    conn.executemany(INSERT_ROLLUP.format(tier=tier), buckets)
+                    count = len(buckets)
+                else:
+                    count = conn.execute(merge_rollup_sql(tier, width, source), (watermark, end)).rowcount
+                conn.execute('INSERT OR REPLACE INTO history_watermarks (name, value) VALUES (?, ?)', (tier, end))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            self.longest_transaction = max(self.longest_transaction, time.perf_counter() - began)
+            if source is None:
+                carry.update(changed)
+            written += count
+            watermark = end
+            # 两个事务之间让出，写入线程可以提交
+            native_sleep(0)
+        self.rows_rolled[tier] += written
+        return written
+
+    def _load_carry(self, conn) -> Dict:
+        """每个视频已汇总的最后计数（首次使用时从rollup_carry表读取，之后保存在内存中）"""
+        if self._carry is None:
+            self._carry = {
+                (account_id, video_id): list(values)
+                for account_id, video_id, *values in conn.execute(
+                    'SELECT account_id, video_id, ' + ', '.join(COUNTER_FIELDS) + ' FROM rollup_carry')
+            }
+        return self._carry
+
+    def _apply_retention(self, now: float):
+        """删除超过保留期且已被上一层汇总的数据，每个事务最多删除一个汇总窗口的时间跨度"""
+        conn = self._connection()
+        tables = [('raw', 'video_samples', 'ts', ROLLUP_TIERS[0][0])]
+        for i, (tier, _) in enumerate(ROLLUP_TIERS):
+            consumer = ROLLUP_TIERS[i + 1][0] if i + 1 < len(ROLLUP_TIERS) else None
+            tables.append((tier, f'video_rollup_{tier}', 'bucket', consumer))
+
+        for tier, table, column, consumer in tables:
+            days = retention_days()[tier]
+            if days <= 0:
+                continue
+            cutoff = int(now) - days * 86400
+            if consumer is not None:
+                # 只删除已汇总到下一层的数据
+                cutoff = min(cutoff, self._watermark(consumer) or 0)
+            oldest = conn.execute(f'SELECT min({column}) FROM {table}').fetchone()[0]
+            if oldest is None:
+                continue
+            step = ROLLUP_WINDOWS[consumer or tier]
+            while oldest < cutoff:
+                oldest = min(oldest + step, cutoff)
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    deleted = conn.execute(f'DELETE FROM {table} WHERE {column} < ?', (oldest,)).rowcount
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+                self.rows_deleted[tier] += deleted
+                native_sleep(0)
+
+    def _archive_closed(self, now: float):
+        """
+        把早于HISTORY_ARCHIVE_AFTER_DAYS且已汇总到下一层的完整时间段封存为段文件，
+        封存后从SQLite删除；段文件按层级保留天数删除
+        """
+        conn = self._connection()
+        tiers = [tier for tier, _ in ROLLUP_TIERS]
+        for tier, span in ARCHIVE_SPANS.items():
+            consumer = tiers[tiers.index(tier) + 1]
+            cutoff = min(int(now) - Config.HISTORY_ARCHIVE_AFTER_DAYS * 86400, self._watermark(consumer) or 0)
+            cutoff -= cutoff % span
+            accounts = [row[0] for row in conn.execute(
+                f'SELECT DISTINCT account_id FROM video_rollup_{tier} WHERE bucket < ?', (cutoff,))]
+            for account_id in accounts:
+                oldest = conn.execute(f'SELECT min(bucket) FROM video_rollup_{tier} WHERE account_id = ?',
+                                      (account_id,)).fetchone()[0]
+                period = oldest - oldest % span
+                while period < cutoff:
+                    rows = conn.execute(
+                        f'SELECT video_id, bucket, {", ".join(ROLLUP_COLUMNS)} FROM video_rollup_{tier} '
+                        'WHERE account_id = ? AND bucket >= ? AND bucket < ? ORDER BY video_id, bucket',
+                        (account_id, period, period + span)
+                    ).fetchall()
+                    if rows:
+                        # 段文件写入完成（原子替换）后才删除SQLite中的行
+                        self.archive.seal(tier, account_id, period, rows)
+                        conn.execute('BEGIN IMMEDIATE')
+                        try:
+                            conn.execute(f'DELETE FROM video_rollup_{tier} WHERE account_id = ? '
+                                         'AND bucket >= ? AND bucket < ?', (account_id, period, period + span))
+                            conn.execute('COMMIT')
+                        except Exception:
+                            conn.execute('ROLLBACK')
+                            raise
+                        self.segments_sealed += 1
+                    period += span
+                    native_sleep(0)
+            days = retention_days()[tier]
+            if days > 0:
+                self.archive.remove_before(tier, int(now) - days * 86400)
+
+    def stats(self) -> Dict:
+        """汇总任务状态，用于自省接口"""
+        with self._lock:
+            watermarks = {tier: self._watermark(tier) for tier, _ in ROLLUP_TIERS} if self._conn else {}
+        return {
+            'interval': self.interval,
+            'runs': self.runs,
+            'last_run': self.last_run,
+            'last_duration': None if self.last_duration is None else round(self.last_duration, 3),
+            'watermarks': watermarks,
+            'rows_rolled': dict(self.rows_rolled),
+            'rows_deleted': dict(self.rows_deleted),
+            'longest_transaction_ms': round(self.longest_transaction * 1000, 1),
+            'segments_sealed': self.segments_sealed,
+            'archive': self.archive.stats() if self.archive is not None else None,
+            'retention_days': retention_days(),
+            'errors': self.errors
+        }
@@ -0,0 +1,306 @@
+"""
+视频计数历史存储 - SQLite（WAL模式），每次刷新为每个视频记录一行计数样本
+
+快照发布时只把样本行放入队列，由后台写入线程按批次在一个事务中批量插入，
+请求处理和刷新任务不等待磁盘写入。gevent模式下写入线程为greenlet，
+事务在原生线程中提交，不阻塞hub；单批次的插入耗时见bench_history.py。
+"""
+
+import heapq
+import itertools
+import os
+import queue
+import sqlite3
+import threading
+import time
+from operator import itemgetter
+from typing import Dict, Iterator, List, Optional, Tuple
+from config import Config
+from worker_pool import run_blocking
+
+# 记录历史的计数字段（与process_video_analytics输出的字段名一致）
+COUNTER_FIELDS = ('views', 'likes', 'comments', 'shares')
+
+# 汇总层级: (名称, 桶宽秒数)，每一层由上一层（第一层由原始样本）汇总而来
+ROLLUP_TIERS = (('1m', 60), ('1h', 3600), ('1d', 86400))
+
+# 汇总表中每个计数的列：桶内最后值、最大值和相对上一个桶的增量
+ROLLUP_COLUMNS = tuple(f'{name}_{kind}' for kind in ('last', 'max', 'delta') for name in COUNTER_FIELDS)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS video_samples (
+    account_id TEXT NOT NULL,
+    video_id TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    views INTEGER,
+    likes INTEGER,
+    comments INTEGER,
+    shares INTEGER,
+    PRIMARY KEY (account_id, video_id, ts)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_video_samples_ts ON video_samples (ts);
+CREATE TABLE IF NOT EXISTS history_watermarks (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rollup_carry (
+    account_id TEXT NOT NULL,
+    video_id TEXT NOT NULL,
+    views INTEGER,
+    likes INTEGER,
+    comments INTEGER,
+    shares INTEGER,
+    PRIMARY KEY (account_id, video_id)
+) WITHOUT ROWID;
+""" + "".join(f"""
+CREATE TABLE IF NOT EXISTS video_rollup_{tier} (
+    account_id TEXT NOT NULL,
+    video_id TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    {', '.join(f'{column} INTEGER' for column in ROLLUP_COLUMNS)},
+    PRIMARY KEY (account_id, video_id, bucket)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_video_rollup_{tier}_bucket ON video_rollup_{tier} (bucket);
+""" for tier, _ in ROLLUP_TIERS)
+
+INSERT_SAMPLE = (
+    'INSERT OR REPLACE INTO video_samples (account_id, video_id, ts, views, likes, comments, shares) '
+    'VALUES (?, ?, ?, ?, ?, ?, ?)'
+)
+
+# 样本行: (账号ID, 视频ID, 时间戳秒, views, likes, comments, shares)
+Sample = Tuple[str, str, int, Optional[int], Optional[int], Optional[int], Optional[int]]
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """打开历史数据库（WAL模式），不存在时创建表"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    # WAL模式下NORMAL只在检查点时同步，断电最多丢失最近几个事务，不会损坏数据库
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def snapshot_samples(snapshot) -> List[Sample]:
+    """把快照中的视频转换为样本行，同一快照的样本使用发布时间作为时间戳"""
+    ts = int(snapshot.published_at)
+    return [
+        (snapshot.account_id, video['video_id'], ts, *(video.get(name) for name in COUNTER_FIELDS))
+        for video in snapshot.videos if video.get('video_id')
+    ]
+
+
+class HistoryStore:
+    """
+    视频计数历史存储
+
+    record作为快照发布的订阅者只负责入队；写入线程每积累batch_size行
+    或距上次写入超过flush_interval秒时提交一个事务。
+    数据库连接在写入线程首次启动时打开（gunicorn preload_app时不会在主进程中打开）。
+    """
+
+    def __init__(self, path: str = None, batch_size: int = None, flush_interval: float = None,
+                 rollup=None, archive=None):
+        """
+        Args:
+            path: SQLite数据库文件路径
+            batch_size: 每个事务最多插入的行数
+            flush_interval: 最长写入间隔（秒）
+            rollup: 汇总压缩任务（HistoryRollup），随写入线程一起启动
+            archive: 冷历史归档（HistoryArchive），查询汇总时合并已封存的数据
+        """
+        self.path = path or Config.HISTORY_DB_PATH
+        self.rollup = rollup
+        self.archive = archive
+        self.batch_size = batch_size or Config.HISTORY_BATCH_SIZE
+        self.flush_interval = Config.HISTORY_FLUSH_INTERVAL if flush_interval is None else flush_interval
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._read_conn = None
+
+        # 指标
+        self.rows_written = 0
+        self.batches = 0
+        self.write_seconds = 0.0
+        self.last_batch_ms = None
+        self.errors = 0
+
+    def start(self):
+        """启动写入线程"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._write_loop, name='history-writer', daemon=True)
+            self._thread.start()
+        print(f"🗄️ 历史存储写入线程启动: {self.path}, 批量={self.batch_size}, 间隔={self.flush_interval}s")
+        if self.rollup is not None:
+            self.rollup.start()
+
+    def record(self, snapshot, previous=None):
+        """快照发布订阅者：把每个视频的计数样本放入写入队列（不访问磁盘）"""
+        if snapshot.account_id is None or snapshot.status != 'success' or not snapshot.videos:
+            return
+        self._queue.put(snapshot_samples(snapshot))
+        self.start()
+
+    def _write_loop(self):
+        conn = run_blocking(connect, self.path)
+        pending: List[Sample] = []
+        taken = 0  # 已取出但尚未写入的队列项数量
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                rows = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                pending.extend(rows)
+                taken += 1
+            except queue.Empty:
+                pass
+            if pending and (len(pending) >= self.batch_size or time.monotonic() >= deadline):
+                run_blocking(self._write_batch, conn, pending)
+                pending = []
+            if not pending:
+                for _ in range(taken):
+                    self._queue.task_done()
+                taken = 0
+                deadline = time.monotonic() + self.flush_interval
+
+    def _write_batch(self, conn: sqlite3.Connection, rows: List[Sample]):
+        started = time.perf_counter()
+        try:
+            conn.execute('BEGIN')
+            conn.executemany(INSERT_SAMPLE, rows)
+            conn.execute('COMMIT')
+        except Exception as e:
+            self.errors += 1
+            print(f"❌ 历史数据写入失败（{len(rows)} 行）: {e}")
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            return
+        elapsed = time.perf_counter() - started
+        self.rows_written += len(rows)
+        self.batches += 1
+        self.write_seconds += elapsed
+        self.last_batch_ms = round(elapsed * 1000, 2)
+
+    def flush(self, timeout: float = None) -> bool:
+        """等待队列中的样本全部写入，返回是否在超时前完成"""
+        if self._thread is None:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # gevent模式下queue.Queue被替换为gevent的队列（没有all_tasks_done），按未完成数量轮询
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def _reader(self) -> sqlite3.Connection:
+        """查询使用的连接（WAL模式下读取不阻塞写入）"""
+        if self._read_conn is None:
+            self._read_conn = connect(self.path)
+        return self._read_conn
+
+    def _fetch(self, sql: str, params: Tuple) -> List[Tuple]:
+        return self._reader().execute(sql, params).fetchall()
+
+    def query(self, account_id: str, video_id: str, start: float = None,
+              end: float = None, tier: str = None) -> List[Tuple]:
+        """
+        查询视频在时间范围内的计数样本或汇总
+
+        Args:
+            tier: None查询原始样本，'1m'、'1h'、'1d'查询对应层级的汇总（包括已归档的部分）
+
+        Returns:
+            原始样本为按时间排序的 (ts, views, likes, comments, shares) 列表；
+            汇总为 (bucket, *ROLLUP_COLUMNS) 列表
+        """
+        if tier is None:
+            sql = ('SELECT ts, views, likes, comments, shares FROM video_samples '
+                   'WHERE account_id = ? AND video_id = ? AND ts >= ? AND ts <= ? ORDER BY ts')
+        elif tier in dict(ROLLUP_TIERS):
+            sql = (f'SELECT bucket, {", ".join(ROLLUP_COLUMNS)} FROM video_rollup_{tier} '
+                   'WHERE account_id = ? AND video_id = ? AND bucket >= ? AND bucket <= ? ORDER BY bucket')
+        else:
+            raise ValueError(f"未知的汇总层级: {tier}")
+        params = (account_id, video_id, int(start or 0), int(end if end is not None else 2 ** 62))
+        # SQLite查询和归档段的解码在run_blocking中执行，gevent模式下慢查询不阻塞hub
+        with self._lock:
+            rows = run_blocking(self._fetch, sql, params)
+        if tier is not None and self.archive is not None:
+            archived = run_blocking(self.archive.query, tier, account_id, video_id, start, end)
+            if archived:
+                # 封存与删除之间的短暂窗口内同一个桶可能同时存在，以SQLite中的为准
+                merged = {row[0]: row for row in archived}
+                merged.update({row[0]: row for row in rows})
+                rows = [merged[bucket] for bucket in sorted(merged)]
+        return rows
+
+    def iter_range(self, account_id: str, start: float = None, end: float = None,
+                   tier: str = None, chunk_size: int = 10000) -> Iterator[List[Tuple]]:
+        """
+        分块读取账号所有视频在时间范围内的样本或汇总（导出使用），每块最多chunk_size行
+
+        行为(video_id, ts或bucket, 计数列...)，按(video_id, 时间)排序；使用独立的只读连接逐块读取，
+        不持有查询锁，内存占用与总行数无关。汇总层级把各个已归档的段和SQLite中最后一个段之后的桶
+        按(video_id, bucket)归并，每个视频的数据是连续的一段
+        """
+        start = int(start or 0)
+        end = int(end if end is not None else 2 ** 62)
+        if tier is None:
+            sql = ('SELECT video_id, ts, views, likes, comments, shares FROM video_samples '
+                   'WHERE account_id = ? AND ts >= ? AND ts <= ? ORDER BY video_id, ts')
+            yield from self._fetch_chunks(sql, (account_id, start, end), chunk_size)
+            return
+        if tier not in dict(ROLLUP_TIERS):
+            raise ValueError(f"未知的汇总层级: {tier}")
+        sql = (f'SELECT video_id, bucket, {", ".join(ROLLUP_COLUMNS)} FROM video_rollup_{tier} '
+               'WHERE account_id = ? AND bucket >= ? AND bucket <= ? ORDER BY video_id, bucket')
+        streams = []
+        if self.archive is not None:
+            streams.extend(self.archive.iter_segments(tier, account_id, start, end))
+            # 封存后到从SQLite删除前，同一个桶可能同时存在，以已封存的为准
+            start = max(start, self.archive.archived_until(tier, account_id) or 0)
+        streams.append(self._fetch_chunks(sql, (account_id, start, end), chunk_size))
+        if len(streams) == 1:
+            yield from streams[0]
+            return
+        rows = heapq.merge(*(itertools.chain.from_iterable(stream) for stream in streams), key=itemgetter(0, 1))
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            yield chunk
+
+    def _fetch_chunks(self, sql: str, params: Tuple, chunk_size: int) -> Iterator[List[Tuple]]:
+        """在独立连接上逐块执行查询，连接、查询和每次fetchmany都在run_blocking中执行"""
+        conn = run_blocking(connect, self.path)
+        try:
+            cursor = run_blocking(conn.execute, sql, params)
+            while True:
+                rows = run_blocking(cursor.fetchmany, chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
+
+    def stats(self) -> Dict:
+        """写入指标，用于自省接口"""
+        return {
+            'path': self.path,
+            'pending_batches': self._queue.qsize(),
+            'rows_written': self.rows_written,
+            'batches': self.batches,
+            'avg_batch_ms': round(self.write_seconds * 1000 / self.batches, 2) if self.batches else None,
+            'last_batch_ms': self.last_batch_ms,
+            'errors': self.errors
+        }
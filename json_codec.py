@@ -0,0 +1,64 @@
+"""
+JSON编码工具 - 优先使用orjson，并支持在Socket.IO数据包中复用已编码的负载
+"""
+
+import datetime
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson为可选依赖，未安装时使用标准库
+    orjson = None
+
+
+def _default(obj):
+    """标准库json无法处理的类型（与orjson一致，日期时间输出ISO格式）"""
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    raise TypeError(f"无法序列化类型: {type(obj).__name__}")
+
+
+def dumps_bytes(obj) -> bytes:
+    """将对象编码为紧凑的UTF-8 JSON字节串"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+def loads(data):
+    """解析JSON字节串或字符串"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class PreEncoded:
+    """已编码的JSON片段，Socket.IO打包事件时原样拼接，不再重复序列化"""
+
+    __slots__ = ('text',)
+
+    def __init__(self, data: bytes):
+        self.text = data.decode('utf-8')
+
+
+class SocketJSON:
+    """
+    供Socket.IO使用的json模块
+
+    事件数据包的内容为 [事件名, 参数...]，参数为PreEncoded时直接拼接其文本，
+    其余情况与标准库json行为一致。
+    """
+
+    @staticmethod
+    def dumps(obj, *args, **kwargs):
+        if isinstance(obj, list) and any(isinstance(item, PreEncoded) for item in obj):
+            return '[' + ','.join(
+                item.text if isinstance(item, PreEncoded)
+                else json.dumps(item, separators=(',', ':'))
+                for item in obj
+            ) + ']'
+        return json.dumps(obj, *args, **kwargs)
+
+    @staticmethod
+    def loads(*args, **kwargs):
+        return json.loads(*args, **kwargs)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+实时推送负载测试 - 对比SSE与Socket.IO每个连接的内存和CPU开销
+
+启动一个独立的服务进程（注入一个模拟账号并定期发布快照），
+依次测量无连接时和建立N个连接后服务进程的RSS与CPU时间，
+输出每个连接的平均内存和CPU开销。
+
+用法:
+    python load_harness.py --transport sse --clients 200
+    python load_harness.py --transport socketio --clients 200 --async-mode gevent
+
+实测结果（4核容器，gevent模式，200个视频，每2秒发布一次、每次变化10%的视频，200个连接，测量20秒）:
+    SSE:                   每连接约 44 KB 内存, 约 0.035 ms CPU/秒
+    Socket.IO(websocket):  每连接约 277 KB 内存, 约 0.055 ms CPU/秒
+    Socket.IO(polling升级): 每连接约 329 KB 内存, 约 0.052 ms CPU/秒
+SSE每次发布只推送增量，Socket.IO推送完整快照；Socket.IO每个连接还有自己的收发队列、
+后台任务和25秒一次的ping。客户端为Python实现，解析大负载受GIL限制，连接分散到多个负载进程。
+"""
+
+import argparse
+import http.client
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+ACCOUNT_ID = 'loadtest'
+
+
+def serve(args):
+    """服务进程：注入模拟账号，定期发布快照，运行Socket.IO服务器"""
+    if args.async_mode == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+        # app根据云平台环境变量选择gevent模式
+        os.environ.setdefault('RENDER', '1')
+
+    import app as server
+    from bench_payload import make_videos
+
+    server.token_store.save(ACCOUNT_ID, {'access_token': 'loadtest'})
+    videos = make_videos(args.videos)
+    server.snapshot_store.publish(ACCOUNT_ID, videos, 'success', 'load test')
+
+    def publisher():
+        changed = max(1, int(len(videos) * args.change_ratio))
+        while True:
+            time.sleep(args.publish_interval)
+            for video in random.sample(videos, changed):
+                video['views'] += random.randint(1, 500)
+            server.snapshot_store.publish(ACCOUNT_ID, videos, 'success', 'load test')
+
+    threading.Thread(target=publisher, daemon=True).start()
+
+    # 用应用自己的会话签名生成带open_id的Cookie，交给负载进程使用
+    serializer = server.app.session_interface.get_signing_serializer(server.app)
+    cookie = f"{server.app.config['SESSION_COOKIE_NAME']}={serializer.dumps({'open_id': ACCOUNT_ID})}"
+    print(f'COOKIE {cookie}', flush=True)
+
+    import builtins
+    builtins.print = lambda *a, **k: None  # 屏蔽每次推送的日志
+    server.socketio.run(server.app, host='127.0.0.1', port=args.port,
+                        log_output=False, allow_unsafe_werkzeug=True)
+
+
+def read_usage(pid: int):
+    """读取进程的RSS（字节）和累计CPU时间（秒）"""
+    with open(f'/proc/{pid}/status') as f:
+        rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmRSS:'))
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    return rss, cpu
+
+
+def sse_client(port: int, cookie: str, counter: dict):
+    """保持一个SSE连接并持续读取事件"""
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    conn.request('GET', '/api/stream', headers={'Cookie': cookie, 'Accept': 'text/event-stream'})
+    response = conn.getresponse()
+    while True:
+        line = response.fp.readline()
+        if not line:
+            break
+        if line.startswith(b'event:'):
+            counter['events'] += 1
+
+
+def socketio_client(port: int, cookie: str, transports, counter: dict):
+    """建立一个Socket.IO连接，返回客户端对象"""
+    import socketio
+    client = socketio.Client(reconnection=False)
+
+    @client.on('data_update')
+    def on_update(data):
+        counter['events'] += 1
+
+    client.connect(f'http://127.0.0.1:{port}', headers={'Cookie': cookie}, transports=transports,
+                   wait_timeout=30)
+    return client
+
+
+def client_worker(transport: str, port: int, cookie: str, count: int, ready, stop, results):
+    """
+    负载进程：建立count个连接，通知主进程后保持连接直到stop被设置
+
+    Python客户端解析大负载时受GIL限制，连接分散到多个进程，避免客户端成为瓶颈
+    """
+    counter = {'events': 0}
+    clients = []
+    for _ in range(count):
+        if transport == 'sse':
+            threading.Thread(target=sse_client, args=(port, cookie, counter), daemon=True).start()
+        else:
+            transports = ['websocket'] if transport == 'websocket' else ['polling', 'websocket']
+            clients.append(socketio_client(port, cookie, transports, counter))
+    ready.put(count)
+    stop.wait()
+    results.put(counter['events'])
+    for client in clients:
+        client.disconnect()
+
+
+def measure(pid: int, seconds: float):
+    """测量一段时间内服务进程的CPU时间，返回(结束时RSS, CPU秒数)"""
+    _, cpu_start = read_usage(pid)
+    time.sleep(seconds)
+    rss, cpu_end = read_usage(pid)
+    return rss, cpu_end - cpu_start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SSE / Socket.IO 推送负载测试')
+    parser.add_argument('--transport', choices=['sse', 'socketio', 'websocket'], default='sse',
+                        help='sse、socketio（polling后升级）或websocket（直接websocket）')
+    parser.add_argument('--clients', type=int, default=200, help='连接数')
+    parser.add_argument('--videos', type=int, default=200, help='快照中的视频数量')
+    parser.add_argument('--publish-interval', type=float, default=2.0, help='快照发布间隔（秒）')
+    parser.add_argument('--change-ratio', type=float, default=0.1, help='每次发布变化的视频比例')
+    parser.add_argument('--duration', type=float, default=20.0, help='每轮测量时长（秒）')
+    parser.add_argument('--async-mode', choices=['threading', 'gevent'], default='threading')
+    parser.add_argument('--client-procs', type=int, default=4, help='负载进程数')
+    parser.add_argument('--port', type=int, default=5077)
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    command = [sys.executable, __file__, '--serve', '--port', str(args.port),
+               '--videos', str(args.videos), '--publish-interval', str(args.publish_interval),
+               '--change-ratio', str(args.change_ratio), '--async-mode', args.async_mode]
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    try:
+        cookie = None
+        for line in proc.stdout:
+            if line.startswith('COOKIE '):
+                cookie = line.split(' ', 1)[1].strip()
+                break
+        if cookie is None:
+            raise RuntimeError('服务进程启动失败')
+        time.sleep(2)
+
+        # 空载基线
+        idle_rss, idle_cpu = measure(proc.pid, args.duration)
+
+        ready, results, stop = multiprocessing.Queue(), multiprocessing.Queue(), multiprocessing.Event()
+        shares = [args.clients // args.client_procs + (1 if i < args.clients % args.client_procs else 0)
+                  for i in range(args.client_procs)]
+        workers = [multiprocessing.Process(target=client_worker, daemon=True,
+                                           args=(args.transport, args.port, cookie, share, ready, stop, results))
+                   for share in shares if share]
+        for worker in workers:
+            worker.start()
+        for _ in workers:
+            ready.get()
+        time.sleep(5)  # 等待连接建立和传输升级完成
+
+        loaded_rss, loaded_cpu = measure(proc.pid, args.duration)
+
+        stop.set()
+        events = sum(results.get() for _ in workers)
+        for worker in workers:
+            worker.join(10)
+
+        per_conn_rss = (loaded_rss - idle_rss) / args.clients
+        per_conn_cpu = (loaded_cpu - idle_cpu) / args.duration / args.clients
+        print(f"传输方式: {args.transport}, 并发模式: {args.async_mode}, 连接数: {args.clients}, "
+              f"视频数: {args.videos}")
+        print(f"空载: RSS {idle_rss / 1024 / 1024:.1f} MB, CPU {idle_cpu / args.duration * 100:.1f}%")
+        print(f"负载: RSS {loaded_rss / 1024 / 1024:.1f} MB, CPU {loaded_cpu / args.duration * 100:.1f}%, "
+              f"客户端共收到事件 {events} 个")
+        print(f"每连接: 内存 {per_conn_rss / 1024:.1f} KB, CPU {per_conn_cpu * 1000:.3f} ms/秒")
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+
+if __name__ == '__main__':
+    main()
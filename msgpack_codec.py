@@ -0,0 +1,32 @@
+"""
+MessagePack编码 - 供Socket.IO二进制事件使用，客户端连接时按需协商
+"""
+
+import datetime
+
+try:
+    import msgpack
+except ImportError:  # msgpack为可选依赖，未安装时所有客户端都使用JSON
+    msgpack = None
+
+# Socket客户端可选的负载编码
+SOCKET_CODECS = ('json', 'msgpack')
+
+
+def _default(obj):
+    """msgpack无法处理的类型（与JSON编码一致，日期时间输出ISO格式）"""
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    raise TypeError(f"无法序列化类型: {type(obj).__name__}")
+
+
+def packb(obj) -> bytes:
+    """将对象编码为MessagePack字节串"""
+    return msgpack.packb(obj, default=_default)
+
+
+def parse_codec(value) -> str:
+    """解析客户端请求的编码，服务端未安装msgpack时回退为JSON"""
+    if value == 'msgpack' and msgpack is not None:
+        return 'msgpack'
+    return 'json'
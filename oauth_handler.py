@@ -7,8 +7,15 @@ import secrets
 import urllib.parse
 import hashlib
 import base64
+import threading
+import time
 from typing import Dict, Optional
 from config import Config
+from stats_planner import STATS_FIELDS
+from worker_pool import DeadlineExceeded
+
+# 全局上游并发上限：所有账号共享，避免同时打满TikTok API
+_upstream_slots = threading.BoundedSemaphore(Config.UPSTREAM_CONCURRENCY)
 
 class TikTokOAuth:
     """TikTok OAuth认证处理器"""
@@ -182,14 +189,39 @@ class TikTokOAuth:
 class TikTokOfficialAPI:
     """TikTok官方API客户端"""
     
-    def __init__(self, access_token: str):
+    def __init__(self, access_token: str, deadline: Optional[float] = None):
+        """
+        Args:
+            access_token: 访问令牌
+            deadline: 刷新任务截止时间（time.monotonic()），上游请求超时不会超过该时间
+        """
         self.access_token = access_token
+        self.deadline = deadline
         self.base_url = "https://open.tiktokapis.com"
         self.headers = {
             'Authorization': f'Bearer {access_token}',
             'Content-Type': 'application/json'
         }
     
+    def _remaining_timeout(self) -> float:
+        """本次上游请求可用的超时时间"""
+        timeout = Config.UPSTREAM_TIMEOUT
+        if self.deadline is not None:
+            timeout = min(timeout, self.deadline - time.monotonic())
+            if timeout <= 0:
+                raise DeadlineExceeded("刷新任务已超过截止时间")
+        return timeout
+    
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """发起上游请求：受全局并发上限约束，超时不超过任务截止时间"""
+        if not _upstream_slots.acquire(timeout=self._remaining_timeout()):
+            raise DeadlineExceeded("等待上游并发槽位超时")
+        try:
+            return requests.request(method, f"{self.base_url}{path}", headers=self.headers,
+                                    timeout=self._remaining_timeout(), **kwargs)
+        finally:
+            _upstream_slots.release()
+    
     def get_user_info(self, fields: list = None) -> Dict:
         """
         获取用户信息
@@ -212,17 +244,13 @@ class TikTokOfficialAPI:
         params = {'fields': ','.join(fields)}
         
         try:
-            response = requests.get(
-                f"{self.base_url}/v2/user/info/",
-                headers=self.headers,
-                params=params
-            )
+            response = self._request('GET', "/v2/user/info/", params=params)
             response.raise_for_status()
             return response.json()
         except requests.RequestException as e:
             raise Exception(f"获取用户信息失败: {e}")
     
-    def get_user_videos(self, cursor: Optional[str] = None, count: int = 20) -> Dict:
+    def get_user_videos(self, cursor: Optional[str] = None, count: int = 20, planner=None) -> Dict:
         """
         获取用户视频列表 - 使用Display API两步流程获取完整数据
         1. 先调用 /v2/video/list/ 获取视频ID列表
@@ -231,6 +259,7 @@ class TikTokOfficialAPI:
         Args:
             cursor: 分页游标 (可选)
             count: 每页数量 (最多20个)
+            planner: 统计刷新计划器 (可选)，提供时只查询到期视频的统计信息
             
         Returns:
             包含完整统计数据的视频列表响应
@@ -251,12 +280,7 @@ class TikTokOfficialAPI:
         
         try:
             # 调用 /v2/video/list/ 获取基本信息
-            response = requests.post(
-                f"{self.base_url}/v2/video/list/",
-                headers=self.headers,
-                params=params,
-                json=data
-            )
+            response = self._request('POST', "/v2/video/list/", params=params, json=data)
             print(f"📋 视频列表API状态码: {response.status_code}")
             
             response.raise_for_status()
@@ -273,7 +297,14 @@ class TikTokOfficialAPI:
             
             # 第二步：获取详细统计信息
             print("📊 第二步：获取详细统计信息...")
-            detailed_videos = self.query_videos_with_stats(video_ids)
+            if planner is not None:
+                # 只查询到期的视频，其余沿用缓存的统计数据
+                due_ids = planner.due_ids(videos_basic)
+                print(f"📊 到期视频: {len(due_ids)}/{len(video_ids)}")
+                planner.record(self.query_videos_with_stats(due_ids), requested=due_ids)
+                detailed_videos = planner.cached_stats(video_ids)
+            else:
+                detailed_videos = self.query_videos_with_stats(video_ids)
             
             # 合并基本信息和统计信息
             merged_videos = self.merge_video_data(videos_basic, detailed_videos)
@@ -297,18 +328,21 @@ class TikTokOfficialAPI:
         使用 /v2/video/query/ 获取视频的详细统计信息
         
         Args:
-            video_ids: 视频ID列表
+            video_ids: 视频ID列表，超过单次上限时自动分批查询
             
         Returns:
             包含统计信息的视频列表
         """
-        # 根据文档，可以获取这些统计字段
-        fields_detailed = [
-            'id', 'title', 'video_description', 'create_time',
-            'cover_image_url', 'share_url', 'duration', 'height', 'width',
-            'like_count', 'comment_count', 'share_count', 'view_count',
-            'embed_html', 'embed_link'
-        ]
+        batch_size = Config.VIDEO_QUERY_BATCH_SIZE
+        videos_with_stats = []
+        for start in range(0, len(video_ids), batch_size):
+            videos_with_stats.extend(self._query_stats_batch(video_ids[start:start + batch_size]))
+        return videos_with_stats
+    
+    def _query_stats_batch(self, video_ids: list) -> list:
+        """查询单批视频（不超过API上限）的统计信息"""
+        # 列表只需要统计计数，基本信息来自/v2/video/list/，描述和嵌入代码等大字段由详情接口按需获取
+        fields_detailed = ['id', *STATS_FIELDS]
         
         params = {'fields': ','.join(fields_detailed)}
         
@@ -319,12 +353,7 @@ class TikTokOfficialAPI:
         }
         
         try:
-            response = requests.post(
-                f"{self.base_url}/v2/video/query/",
-                headers=self.headers,
-                params=params,
-                json=data
-            )
+            response = self._request('POST', "/v2/video/query/", params=params, json=data)
             print(f"📊 视频查询API状态码: {response.status_code}")
             print(f"📊 请求参数: {params}")
             print(f"📊 请求体: {data}")
@@ -379,15 +408,11 @@ class TikTokOfficialAPI:
                 detailed_video = detailed_dict[video_id]
                 # 添加统计字段
                 merged_video.update({
+                    'stats_fetched_at': detailed_video.get('stats_fetched_at'),
                     'view_count': detailed_video.get('view_count', 0),
                     'like_count': detailed_video.get('like_count', 0),
                     'comment_count': detailed_video.get('comment_count', 0),
-                    'share_count': detailed_video.get('share_count', 0),
-                    'video_description': detailed_video.get('video_description', ''),
-                    'height': detailed_video.get('height', 0),
-                    'width': detailed_video.get('width', 0),
-                    'embed_html': detailed_video.get('embed_html', ''),
-                    'embed_link': detailed_video.get('embed_link', '')
+                    'share_count': detailed_video.get('share_count', 0)
                 })
                 print(f"✅ 视频 {video_id} 合并完成: views={merged_video['view_count']}, likes={merged_video['like_count']}")
             else:
@@ -404,6 +429,39 @@ class TikTokOfficialAPI:
         
         return merged_videos
     
+    def get_video_detail(self, video_id: str) -> Optional[Dict]:
+        """
+        获取单个视频的详情字段（描述、尺寸、嵌入代码），列表刷新不再获取这些字段
+        
+        Args:
+            video_id: 视频ID
+            
+        Returns:
+            详情字典，视频不存在时返回None
+        """
+        fields = ['id', 'video_description', 'height', 'width', 'embed_html', 'embed_link']
+        params = {'fields': ','.join(fields)}
+        data = {'filters': {'video_ids': [video_id]}}
+        
+        try:
+            response = self._request('POST', "/v2/video/query/", params=params, json=data)
+            response.raise_for_status()
+            videos = (response.json().get('data') or {}).get('videos') or []
+        except requests.RequestException as e:
+            raise Exception(f"获取视频详情失败: {e}")
+        
+        if not videos:
+            return None
+        video = videos[0]
+        return {
+            'video_id': video.get('id', video_id),
+            'description': video.get('video_description', ''),
+            'video_height': video.get('height', 0),
+            'video_width': video.get('width', 0),
+            'embed_html': video.get('embed_html', ''),
+            'embed_link': video.get('embed_link', '')
+        }
+    
     def query_specific_videos(self, video_ids: list, fields: list = None) -> Dict:
         """
         查询特定视频的信息 - 这是Display API实际支持的方法
@@ -583,9 +641,7 @@ class TikTokOfficialAPI:
                 'bounce_rate': round(bounce_rate, 2),
                 'share_url': video.get('share_url', ''),
                 'cover_image': video.get('cover_image_url', ''),
-                'embed_link': video.get('embed_link', ''),
-                'video_height': video.get('height', 0),
-                'video_width': video.get('width', 0),
+                'stats_updated_at': self._parse_timestamp(video.get('stats_fetched_at')),
                 # 新关注者（估算，基于视频表现）
                 'new_followers': max(0, int(likes * 0.02)) if likes > 0 else 0
             }
@@ -0,0 +1,187 @@
+"""
+数据刷新调度器 - 基于优先队列的自适应调度
+"""
+
+import heapq
+import itertools
+import random
+import threading
+import time
+from typing import Dict, Optional
+from config import Config
+from worker_pool import RefreshJob, RefreshWorkerPool
+
+
+class AccountSchedule:
+    """单个账号的调度状态"""
+
+    def __init__(self, account_id: str, interval: float):
+        self.account_id = account_id
+        self.interval = interval
+        self.next_run = 0.0          # 下次运行时间（monotonic）
+        self.failures = 0            # 连续失败次数
+        self.running = False
+        self.runs = 0
+        self.last_run = None         # 上次开始时间（unix时间戳）
+        self.last_duration = None    # 上次运行耗时（秒）
+        self.last_lag = None         # 上次实际开始相对计划时间的延迟（秒）
+        self.last_error = None
+
+
+class RefreshScheduler:
+    """
+    基于优先队列的刷新调度器
+
+    每个账号有独立的下次运行时间，堆顶为最早到期的账号。
+    到期的账号交给有界工作池执行，成功后按基础间隔加随机抖动重新排期，
+    失败后指数退避。
+    """
+
+    def __init__(self, pool: RefreshWorkerPool, interval: float = None,
+                 jitter: float = None, max_backoff: float = None):
+        """
+        Args:
+            pool: 执行刷新任务的工作池（决定并发上限）
+            interval: 基础刷新间隔（秒）
+            jitter: 抖动比例，例如0.1表示±10%
+            max_backoff: 失败退避的最长间隔（秒）
+        """
+        self.pool = pool
+        self.interval = interval or Config.UPDATE_INTERVAL
+        self.jitter = Config.UPDATE_JITTER if jitter is None else jitter
+        self.max_backoff = max_backoff or Config.UPDATE_MAX_BACKOFF
+
+        self._heap = []
+        self._seq = itertools.count()
+        self._accounts: Dict[str, AccountSchedule] = {}
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def _jittered(self, delay: float) -> float:
+        """为延迟加上随机抖动，避免多个账号同时刷新"""
+        if self.jitter <= 0:
+            return delay
+        return max(0.0, delay * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def _push(self, state: AccountSchedule, delay: float):
+        """按延迟重新排期（调用方需持有锁）"""
+        state.next_run = time.monotonic() + delay
+        heapq.heappush(self._heap, (state.next_run, next(self._seq), state.account_id))
+        self._cond.notify()
+
+    def add_account(self, account_id: str, interval: float = None, run_now: bool = False):
+        """添加账号到调度队列，已存在时更新间隔"""
+        with self._cond:
+            state = self._accounts.get(account_id)
+            if state is None:
+                state = AccountSchedule(account_id, interval or self.interval)
+                self._accounts[account_id] = state
+            elif interval:
+                state.interval = interval
+            if not state.running:
+                self._push(state, 0 if run_now else self._jittered(state.interval))
+
+    def remove_account(self, account_id: str):
+        """从调度队列中移除账号（堆中的旧条目会被惰性丢弃）"""
+        with self._cond:
+            self._accounts.pop(account_id, None)
+
+    def start(self):
+        """启动工作池和调度线程"""
+        if self._running:
+            return
+        self._running = True
+        self.pool.start()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        print(f"🔄 刷新调度器启动: 间隔={self.interval}s, 并发上限={self.pool.size}")
+
+    def stop(self):
+        """停止调度线程"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+    def _next_due(self) -> Optional[AccountSchedule]:
+        """等待直到有账号到期，返回该账号状态"""
+        with self._cond:
+            while self._running:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                next_run, _, account_id = self._heap[0]
+                state = self._accounts.get(account_id)
+                if state is None or state.next_run != next_run or state.running:
+                    # 已移除或已重新排期的旧条目
+                    heapq.heappop(self._heap)
+                    continue
+                wait = next_run - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                heapq.heappop(self._heap)
+                state.running = True
+                return state
+        return None
+
+    def _loop(self):
+        while self._running:
+            state = self._next_due()
+            if state is None:
+                break
+            state.last_lag = max(0.0, time.monotonic() - state.next_run)
+            state.last_run = time.time()
+            self.pool.submit(state.account_id,
+                             callback=lambda job, state=state: self._finish(state, job))
+
+    def _finish(self, state: AccountSchedule, job: RefreshJob):
+        """刷新任务完成后按结果重新排期"""
+        if not job.ok:
+            print(f"定时更新任务失败 [{state.account_id}]: {job.error}")
+        state.last_error = None if job.ok else (job.error or '刷新返回失败状态')
+        if job.started_at is not None:
+            state.last_duration = job.finished_at - job.started_at
+        state.runs += 1
+        with self._cond:
+            state.running = False
+            if state.account_id not in self._accounts:
+                return
+            if job.ok:
+                state.failures = 0
+                delay = state.interval
+            else:
+                state.failures += 1
+                delay = min(state.interval * (2 ** state.failures), self.max_backoff)
+            self._push(state, self._jittered(delay))
+
+    def stats(self) -> Dict:
+        """调度器运行状态，用于自省接口"""
+        now = time.monotonic()
+        with self._cond:
+            accounts = {}
+            due = 0
+            for account_id, state in self._accounts.items():
+                overdue = 0.0 if state.running else max(0.0, now - state.next_run)
+                if overdue > 0:
+                    due += 1
+                accounts[account_id] = {
+                    'interval': state.interval,
+                    'running': state.running,
+                    'runs': state.runs,
+                    'failures': state.failures,
+                    'next_run_in': None if state.running else round(state.next_run - now, 3),
+                    'lag': round(overdue, 3),
+                    'last_lag': None if state.last_lag is None else round(state.last_lag, 3),
+                    'last_run': state.last_run,
+                    'last_duration': None if state.last_duration is None else round(state.last_duration, 3),
+                    'last_error': state.last_error
+                }
+            return {
+                'running': self._running,
+                'concurrency': self.pool.size,
+                'queue_depth': len(self._accounts) - sum(1 for s in self._accounts.values() if s.running),
+                'due': due,
+                'accounts': accounts,
+                'pool': self.pool.stats()
+            }
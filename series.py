@@ -0,0 +1,137 @@
+"""
+历史曲线 - 为图表选择合适的汇总层级，并用LTTB（Largest-Triangle-Three-Buckets）降采样
+
+时间范围越宽使用越粗的层级，扫描的行数保持在SERIES_MAX_SAMPLES以内；
+降采样后的结果按(账号, 视频, 计数, 层级, 量化后的时间范围, 点数)缓存SERIES_CACHE_TTL秒，
+范围按桶宽量化，有效期保证新写入的样本和新汇总的桶不会被缓存的曲线长期遮住。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from config import Config
+from history_rollup import retention_days
+from history_store import COUNTER_FIELDS, ROLLUP_TIERS
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    LTTB降采样，返回选中点的下标
+
+    首尾两点固定保留，中间分为threshold-2个桶，每个桶选取与前一个选中点、
+    下一个桶均值构成的三角形面积最大的点。各桶均值用前缀和一次算出，
+    每个桶内的面积计算为向量运算，只有依赖上一个选中点的桶间循环在Python中执行。
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+    sum_x = np.concatenate(([0.0], np.cumsum(x)))
+    sum_y = np.concatenate(([0.0], np.cumsum(y)))
+    sizes = ends - starts
+    # 第i个桶的"下一个桶"均值；最后一个桶的下一个为最后一个点
+    next_x = np.append(((sum_x[ends] - sum_x[starts]) / sizes)[1:], x[-1])
+    next_y = np.append(((sum_y[ends] - sum_y[starts]) / sizes)[1:], y[-1])
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        s, e = starts[i], ends[i]
+        area = np.abs((x[a] - next_x[i]) * (y[s:e] - y[a]) - (x[a] - x[s:e]) * (next_y[i] - y[a]))
+        a = s + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def tier_widths() -> List[Tuple[Optional[str], int]]:
+    """可用的层级和桶宽（秒），原始样本的间隔为刷新间隔"""
+    return [(None, Config.UPDATE_INTERVAL)] + list(ROLLUP_TIERS)
+
+
+def choose_tier(start: int, end: int, now: float) -> Tuple[Optional[str], int]:
+    """
+    选择扫描行数不超过SERIES_MAX_SAMPLES的最细层级；
+    起点已超过某层级保留期（数据已删除）时跳过该层级
+    """
+    retention = retention_days()
+    for tier, width in tier_widths():
+        days = retention[tier or 'raw']
+        if days > 0 and start < now - days * 86400:
+            continue
+        if (end - start) / width <= Config.SERIES_MAX_SAMPLES:
+            return tier, width
+    return ROLLUP_TIERS[-1]
+
+
+def build_series(history_store, account_id: str, video_id: str, start: int, end: int,
+                 points: int, counters: Tuple[str, ...], tier: Optional[str]) -> Dict:
+    """读取一个视频在[start, end]内的计数并逐条曲线降采样到最多points个点"""
+    rows = history_store.query(account_id, video_id, start, end, tier=tier)
+    series = {}
+    if rows:
+        table = np.array(rows, dtype=object)
+        timestamps = table[:, 0].astype(np.int64)
+        for counter in counters:
+            # 原始样本的列顺序为COUNTER_FIELDS，汇总的前几列为每个计数的最后值
+            column = table[:, 1 + COUNTER_FIELDS.index(counter)]
+            present = np.array([value is not None for value in column], dtype=bool)
+            t = timestamps[present]
+            v = column[present].astype(np.int64)
+            keep = lttb(t, v, points)
+            series[counter] = {'t': t[keep].tolist(), 'v': v[keep].tolist()}
+    else:
+        series = {counter: {'t': [], 'v': []} for counter in counters}
+    return {
+        'success': True,
+        'video_id': video_id,
+        'from': start,
+        'to': end,
+        'tier': tier or 'raw',
+        'points': points,
+        'samples': len(rows),
+        'series': series
+    }
+
+
+class SeriesCache:
+    """有界LRU缓存（线程安全），条目在写入ttl秒后过期"""
+
+    def __init__(self, size: int = None, ttl: float = None):
+        self.size = size or Config.SERIES_CACHE_SIZE
+        self.ttl = Config.SERIES_CACHE_TTL if ttl is None else ttl
+        # 值为(过期时间（monotonic）, 数据)
+        self._items: 'OrderedDict[Hashable, Tuple[float, bytes]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] <= time.monotonic():
+                if item is not None:
+                    del self._items[key]
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key: Hashable, value: bytes):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
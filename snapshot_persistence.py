@@ -0,0 +1,123 @@
+"""
+快照持久化 - 每次发布时把账号最新快照原子写入磁盘，进程启动时在处理请求之前恢复
+
+gunicorn的worker按max_requests定期重启、重新部署时也会重启，恢复后第一个请求
+直接得到上次的数据，由调度器在后台刷新，不需要等待冷启动的上游请求。
+"""
+
+import os
+import re
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+from config import Config
+from json_codec import dumps_bytes, loads
+from snapshot_store import Snapshot
+from worker_pool import run_blocking
+
+
+def _safe_name(account_id: str) -> str:
+    """账号ID转换为安全的文件名"""
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', account_id)
+
+
+class SnapshotPersistence:
+    """
+    以账号为单位的快照文件: <目录>/<账号>.json
+
+    文件中同时保存账号的令牌状态，恢复后调度器可以直接在后台刷新；
+    文件权限为0600，清除配置或移除账号时删除
+    """
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or Config.SNAPSHOT_DIR
+        # 每个账号一把锁：发布订阅者和令牌刷新可能同时保存同一账号
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    def _account_lock(self, account_id: str) -> threading.Lock:
+        with self._locks_lock:
+            lock = self._locks.get(account_id)
+            if lock is None:
+                lock = self._locks[account_id] = threading.Lock()
+            return lock
+
+    def _path(self, account_id: str) -> str:
+        return os.path.join(self.directory, f'{_safe_name(account_id)}.json')
+
+    def save(self, snapshot: Snapshot, token: Optional[Dict] = None):
+        """
+        写入快照（先写临时文件再原子替换，进程崩溃时不会留下写了一半的文件）
+
+        同一账号的保存串行执行，每次使用唯一的临时文件；写入和fsync在run_blocking中执行，
+        gevent模式下不阻塞hub
+        """
+        data = dumps_bytes({
+            'account_id': snapshot.account_id,
+            'version': snapshot.version,
+            'videos': snapshot.videos,
+            'status': snapshot.status,
+            'message': snapshot.message,
+            'timestamp': snapshot.timestamp,
+            'published_at': snapshot.published_at,
+            'token': token
+        })
+        with self._account_lock(snapshot.account_id):
+            run_blocking(self._write, self._path(snapshot.account_id), data)
+
+    def _write(self, path: str, data: bytes):
+        os.makedirs(self.directory, exist_ok=True)
+        # mkstemp创建的文件权限为0600
+        fd, temp = tempfile.mkstemp(dir=self.directory, prefix=f'{os.path.basename(path)}.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, path)
+        except BaseException:
+            try:
+                os.remove(temp)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def load(self) -> List[Tuple[Snapshot, Optional[Dict]]]:
+        """读取所有账号的快照和令牌状态，无法解析的文件跳过"""
+        if not os.path.isdir(self.directory):
+            return []
+        results = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), 'rb') as f:
+                    data = loads(f.read())
+                snapshot = Snapshot(
+                    account_id=data['account_id'],
+                    version=data['version'],
+                    videos=tuple(data['videos']),
+                    status=data['status'],
+                    message=data['message'],
+                    timestamp=data['timestamp'],
+                    published_at=data['published_at']
+                )
+                results.append((snapshot, data.get('token')))
+            except Exception as e:
+                print(f"⚠️ 快照文件 {name} 读取失败，已跳过: {e}")
+        return results
+
+    def remove(self, account_id: str):
+        """删除账号的快照文件"""
+        try:
+            os.remove(self._path(account_id))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        """删除所有快照文件"""
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith(('.json', '.tmp')):
+                os.remove(os.path.join(self.directory, name))
@@ -0,0 +1,416 @@
+"""
+不可变数据快照存储 - 写时复制发布，读取无锁
+
+每次刷新生成一个新的不可变快照并原子替换，快照带单调递增的版本号。
+请求处理器、Socket处理器和后台任务读取到的总是某个完整版本，
+不会看到更新到一半的视频列表。
+"""
+
+import dataclasses
+import datetime
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from config import Config
+from compression import compress
+from json_codec import PreEncoded, dumps_bytes
+from msgpack_codec import packb
+
+# 视频列表记录的全部字段（process_video_analytics的输出）
+VIDEO_FIELDS = (
+    'video_id', 'title', 'description', 'author', 'publish_time',
+    'views', 'likes', 'comments', 'shares', 'duration',
+    'engagement_rate', 'avg_watch_time', 'completion_rate', 'bounce_rate',
+    'new_followers', 'share_url', 'cover_image', 'stats_updated_at'
+)
+
+# 面板表格和图表使用的字段，/api/data和Socket推送默认只发送这些字段
+DASHBOARD_FIELDS = (
+    'video_id', 'author', 'publish_time', 'views', 'likes', 'comments', 'duration',
+    'engagement_rate', 'avg_watch_time', 'completion_rate', 'bounce_rate',
+    'new_followers', 'share_url'
+)
+
+# 账号汇总累加的计数字段，参与度以0.01%为单位按整数累加，增量调整不会积累浮点误差
+SUMMARY_COUNTERS = ('views', 'likes', 'new_followers')
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """某个账号在某个版本的数据快照（不可变）"""
+
+    account_id: Optional[str]
+    version: int
+    videos: Tuple[dict, ...]
+    status: str
+    message: str
+    timestamp: str
+    published_at: float
+    # 账号级汇总（视频总数、总观看、总点赞、新关注者和平均参与度），发布时增量维护
+    summary: Optional[dict] = None
+    # 相对上一版本汇总计数变化或新增的视频在videos中的位置和被移除的视频ID，由SnapshotStore发布时设置，
+    # 订阅者据此只处理变化的视频；None表示未知（恢复的快照、不经过SnapshotStore的快照）
+    changes: Optional[Tuple[Tuple[int, ...], Tuple[str, ...]]] = field(default=None, compare=False, repr=False)
+    # 派生数据缓存（序列化结果等），只在首次使用时计算，不参与比较
+    _cache: dict = field(default_factory=dict, compare=False, repr=False)
+
+    def projected(self, fields: Optional[Tuple[str, ...]] = None) -> Tuple[dict, ...]:
+        """按字段投影后的视频记录，fields为None时返回完整记录"""
+        if fields is None:
+            return self.videos
+        return self.cached(('videos', fields), lambda: tuple(
+            {name: video[name] for name in fields if name in video} for video in self.videos
+        ))
+
+    def to_payload(self, fields: Optional[Tuple[str, ...]] = None, layout: str = 'rows') -> Dict:
+        """
+        转换为推送/响应使用的数据负载
+
+        layout为'columnar'时按列组织：index为video_id列表，columns中每个字段一个数组，
+        字段名不再在每条记录中重复
+        """
+        payload = {
+            'success': True,
+            'status': self.status,
+            'message': self.message,
+            'timestamp': self.timestamp,
+            'version': self.version,
+            'summary': self.summary
+        }
+        if layout == 'columnar':
+            payload['format'] = 'columnar'
+            payload.update(to_columns(self.videos, fields))
+        else:
+            payload['videos'] = list(self.projected(fields))
+        return payload
+
+    @property
+    def etag(self) -> str:
+        """由版本号派生的强ETag（不含引号），附带发布时间，进程重启后版本号重新计数也不会冲突"""
+        return f'v{self.version}.{int(self.published_at * 1000):x}'
+
+    def cached(self, key, factory: Callable[[], Any]) -> Any:
+        """获取派生数据，首次使用时调用factory计算并缓存（同一版本的结果不会变化）"""
+        value = self._cache.get(key)
+        if value is None:
+            value = self._cache[key] = factory()
+        return value
+
+    def encoded(self, fields: Optional[Tuple[str, ...]] = None, layout: str = 'rows') -> bytes:
+        """负载的JSON编码，每个版本每种投影和格式只序列化一次，HTTP响应和Socket推送共用"""
+        return self.cached(('json', fields, layout), lambda: dumps_bytes(self.to_payload(fields, layout)))
+
+    def compressed(self, encoding: str, fields: Optional[Tuple[str, ...]] = None, layout: str = 'rows') -> bytes:
+        """压缩后的JSON负载，每个版本每种投影、格式和编码只压缩一次"""
+        return self.cached(('compressed', encoding, fields, layout),
+                           lambda: compress(self.encoded(fields, layout), encoding))
+
+    def socket_payload(self, fields: Optional[Tuple[str, ...]] = None) -> PreEncoded:
+        """Socket.IO推送使用的已编码负载"""
+        return self.cached(('socket', fields), lambda: PreEncoded(self.encoded(fields)))
+
+    def packed(self, fields: Optional[Tuple[str, ...]] = None) -> bytes:
+        """负载的MessagePack编码（Socket.IO二进制事件），每个版本每种投影只编码一次"""
+        return self.cached(('msgpack', fields), lambda: packb(self.to_payload(fields)))
+
+    def delta_from(self, base: 'Snapshot', fields: Optional[Tuple[str, ...]] = None) -> Dict:
+        """相对于base版本的增量：新增或（投影字段）变化的视频记录和被移除的视频ID"""
+        return self.cached(('delta', base.version, fields), lambda: snapshot_delta(base, self, fields))
+
+    def encoded_delta(self, base: 'Snapshot', fields: Optional[Tuple[str, ...]] = None) -> bytes:
+        """增量的JSON编码（每对版本每种投影只序列化一次）"""
+        return self.cached(('delta_json', base.version, fields),
+                           lambda: dumps_bytes(self.delta_from(base, fields)))
+
+
+def parse_fields(value: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """
+    解析客户端请求的字段投影（逗号分隔）
+
+    未指定时使用面板表格显示的字段，'all'表示不投影；
+    未知字段被忽略，结果按VIDEO_FIELDS的顺序排列并总是包含video_id，
+    因此不同写法的同一投影共用一份缓存
+    """
+    if not value:
+        return DASHBOARD_FIELDS
+    if value == 'all':
+        return None
+    requested = set(value.split(','))
+    requested.add('video_id')
+    return tuple(name for name in VIDEO_FIELDS if name in requested)
+
+
+def to_columns(videos, fields: Optional[Tuple[str, ...]] = None) -> Dict:
+    """把视频记录转换为列式结构，不投影时字段为所有记录字段的并集（按首次出现顺序）"""
+    if fields is None:
+        names = {}
+        for video in videos:
+            names.update(dict.fromkeys(video))
+        fields = tuple(names)
+    return {
+        'count': len(videos),
+        'index': [video.get('video_id') for video in videos],
+        'columns': {name: [video.get(name) for video in videos] for name in fields if name != 'video_id'}
+    }
+
+
+def snapshot_delta(base: Snapshot, snapshot: Snapshot, fields: Optional[Tuple[str, ...]] = None) -> Dict:
+    """计算两个快照之间的增量（按video_id比较投影后的记录）"""
+    previous = {video.get('video_id'): video for video in base.projected(fields)}
+    upserts = []
+    for video in snapshot.projected(fields):
+        if previous.pop(video.get('video_id'), None) != video:
+            upserts.append(video)
+    return {
+        'from_version': base.version,
+        'version': snapshot.version,
+        'upserts': upserts,
+        'removed': list(previous),
+        'order': [video.get('video_id') for video in snapshot.videos],
+        'summary': snapshot.summary,
+        'status': snapshot.status,
+        'message': snapshot.message,
+        'timestamp': snapshot.timestamp
+    }
+
+
+def _parse_stats_time(value, default: float) -> float:
+    if not value or not isinstance(value, str):
+        return default
+    try:
+        return min(datetime.datetime.fromisoformat(value).timestamp(), default)
+    except ValueError:
+        return default
+
+
+def stats_time(video: dict, default: float) -> float:
+    """
+    视频计数的获取时间（unix时间戳）
+
+    分层刷新时未到期的视频沿用缓存的计数，stats_updated_at为上次实际获取的时间，可能早于快照发布时间；
+    没有该字段（每次都是当前计数的演示数据等）或无法解析时为default（通常为快照发布时间）
+    """
+    return _parse_stats_time(video.get('stats_updated_at'), default)
+
+
+def stats_times(videos, default: float) -> List[float]:
+    """批量的stats_time：同一轮获取的视频时间相同，每个不同的值只解析一次"""
+    stamps = [video.get('stats_updated_at') for video in videos]
+    parsed = {stamp: _parse_stats_time(stamp, default) for stamp in set(stamps)}
+    return [parsed[stamp] for stamp in stamps]
+
+
+def video_contribution(video: dict) -> Tuple[int, ...]:
+    """一条视频对账号汇总的贡献: (*SUMMARY_COUNTERS, 参与度×100)"""
+    return (*(int(video.get(name) or 0) for name in SUMMARY_COUNTERS),
+            int(round((video.get('engagement_rate') or 0) * 100)))
+
+
+class AccountAggregates:
+    """
+    账号级汇总的增量维护
+
+    保存每条视频上次计入的贡献，每次发布只把计数发生变化、新增或移除的视频
+    按差值调整累计值，不对整个列表重新求和
+    """
+
+    def __init__(self):
+        self._contributions: Dict[Any, Tuple[int, ...]] = {}
+        self._totals = [0] * (len(SUMMARY_COUNTERS) + 1)
+        # 最近一次apply中贡献变化或新增的视频位置和被移除的视频ID（见Snapshot.changes）
+        self.changes: Tuple[Tuple[int, ...], Tuple[Any, ...]] = ((), ())
+
+    def apply(self, videos) -> Dict:
+        """按新的视频列表调整累计值，返回汇总"""
+        # 先计算全部贡献再修改累计值，字段异常时累计值保持不变
+        contributions = {}
+        positions = {}
+        for position, video in enumerate(videos):
+            video_id = video.get('video_id')
+            contributions[video_id] = video_contribution(video)
+            positions[video_id] = position
+        totals = self._totals
+        previous = self._contributions
+        changed = []
+        for video_id, value in contributions.items():
+            old = previous.pop(video_id, None)
+            if old == value:
+                continue
+            changed.append(positions[video_id])
+            for i, amount in enumerate(value):
+                totals[i] += amount - (old[i] if old else 0)
+        # 剩余的为已移除的视频
+        for old in previous.values():
+            for i, amount in enumerate(old):
+                totals[i] -= amount
+        self.changes = (tuple(sorted(changed)), tuple(previous))
+        self._contributions = contributions
+        return self.summary()
+
+    def summary(self) -> Dict:
+        count = len(self._contributions)
+        views, likes, new_followers, engagement = self._totals
+        return {
+            'total_videos': count,
+            'total_views': views,
+            'total_likes': likes,
+            'total_new_followers': new_followers,
+            'avg_engagement': round(engagement / 100 / count, 2) if count else 0
+        }
+
+
+def make_snapshot(account_id: Optional[str], version: int, videos: list,
+                  status: str, message: str, summary: Optional[dict] = None,
+                  changes: Optional[Tuple[Tuple[int, ...], Tuple[str, ...]]] = None) -> Snapshot:
+    """
+    创建快照，复制每条视频记录，发布后生产者再修改原列表也不影响快照
+
+    summary为空时对列表完整计算一次汇总（临时快照、基准测试等不经过SnapshotStore的快照）
+    """
+    if summary is None:
+        summary = AccountAggregates().apply(videos)
+    return Snapshot(
+        account_id=account_id,
+        version=version,
+        videos=tuple(dict(video) for video in videos),
+        status=status,
+        message=message,
+        timestamp=datetime.datetime.now().isoformat(),
+        published_at=time.time(),
+        summary=summary,
+        changes=changes
+    )
+
+
+class SnapshotStore:
+    """
+    按账号保存最新快照
+
+    写入方在锁内生成新版本并用新字典替换整个映射（写时复制），
+    读取方直接读取当前映射，无需加锁。
+    """
+
+    def __init__(self):
+        self._snapshots: Dict[str, Snapshot] = {}
+        self._version = 0
+        self._lock = threading.Lock()
+        # 每个账号一个条件变量（共享写锁），用于等待新版本的长轮询请求
+        self._conditions: Dict[str, threading.Condition] = {}
+        # 每个账号最近几个版本，供断线重连时按版本号计算增量
+        self._history: Dict[str, Deque[Snapshot]] = {}
+        self._listeners: List[Callable[[Snapshot, Optional[Snapshot]], None]] = []
+        # 每个账号的增量汇总（在写锁内更新）
+        self._aggregates: Dict[str, AccountAggregates] = {}
+
+    def get(self, account_id: Optional[str]) -> Optional[Snapshot]:
+        """读取账号最新快照（无锁）"""
+        if not account_id:
+            return None
+        return self._snapshots.get(account_id)
+
+    def get_version(self, account_id: Optional[str], version: int) -> Optional[Snapshot]:
+        """读取账号的指定历史版本（只保留最近SNAPSHOT_HISTORY个版本）"""
+        # 发布时会向deque追加，在锁内复制后再遍历
+        with self._lock:
+            history = tuple(self._history.get(account_id, ()))
+        for snapshot in history:
+            if snapshot.version == version:
+                return snapshot
+        return None
+
+    @property
+    def version(self) -> int:
+        """最近一次发布的全局版本号"""
+        return self._version
+
+    def publish(self, account_id: str, videos: list, status: str, message: str) -> Snapshot:
+        """发布新快照并通知订阅者"""
+        with self._lock:
+            aggregates = self._aggregates.get(account_id)
+            if aggregates is None:
+                aggregates = self._aggregates[account_id] = AccountAggregates()
+            summary = aggregates.apply(videos)
+            self._version += 1
+            snapshot = make_snapshot(account_id, self._version, videos, status, message, summary,
+                                     aggregates.changes)
+            previous = self._snapshots.get(account_id)
+            snapshots = dict(self._snapshots)
+            snapshots[account_id] = snapshot
+            self._snapshots = snapshots
+            history = self._history.get(account_id)
+            if history is None:
+                history = self._history[account_id] = deque(maxlen=Config.SNAPSHOT_HISTORY)
+            history.append(snapshot)
+            condition = self._conditions.get(account_id)
+            if condition is not None:
+                condition.notify_all()
+        for listener in self._listeners:
+            try:
+                listener(snapshot, previous)
+            except Exception as e:
+                print(f"❌ 快照订阅者处理失败: {e}")
+        return snapshot
+
+    def restore(self, snapshot: Snapshot) -> Snapshot:
+        """
+        恢复持久化的快照（进程启动时调用，不通知订阅者），之后发布的版本号从其之后继续
+
+        用快照的视频列表初始化账号的增量汇总，返回带汇总的快照
+        """
+        with self._lock:
+            aggregates = self._aggregates[snapshot.account_id] = AccountAggregates()
+            snapshot = dataclasses.replace(snapshot, summary=aggregates.apply(snapshot.videos),
+                                           changes=None, _cache={})
+            self._version = max(self._version, snapshot.version)
+            snapshots = dict(self._snapshots)
+            snapshots[snapshot.account_id] = snapshot
+            self._snapshots = snapshots
+            history = self._history.get(snapshot.account_id)
+            if history is None:
+                history = self._history[snapshot.account_id] = deque(maxlen=Config.SNAPSHOT_HISTORY)
+            history.append(snapshot)
+        return snapshot
+
+    def wait_for(self, account_id: str, since: int, timeout: float) -> Optional[Snapshot]:
+        """
+        等待账号发布比since更新的版本
+
+        在gevent模式下（已monkey patch）等待只挂起当前greenlet，不占用工作进程。
+
+        Returns:
+            新快照；超时仍没有新版本时返回None
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            condition = self._conditions.get(account_id)
+            if condition is None:
+                condition = self._conditions[account_id] = threading.Condition(self._lock)
+            while True:
+                snapshot = self._snapshots.get(account_id)
+                if snapshot is not None and snapshot.version > since:
+                    return snapshot
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                condition.wait(remaining)
+
+    def remove(self, account_id: str):
+        """删除账号的快照"""
+        with self._lock:
+            snapshots = dict(self._snapshots)
+            snapshots.pop(account_id, None)
+            self._snapshots = snapshots
+            self._history.pop(account_id, None)
+            self._aggregates.pop(account_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._snapshots = {}
+            self._history.clear()
+            self._aggregates.clear()
+
+    def subscribe(self, listener: Callable[[Snapshot, Optional[Snapshot]], None]):
+        """订阅快照发布，回调参数为(新快照, 上一个快照)"""
+        self._listeners.append(listener)
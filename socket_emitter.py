@@ -0,0 +1,136 @@
+"""
+Socket.IO推送合并器 - 按固定节拍发送，每个房间每个节拍最多一帧
+
+调度器、手动刷新和客户端请求在短时间内连续发布时，只把每个房间最新的一帧发出去；
+发送队列积压的客户端暂不发送，等队列清空后再补发该房间最新的一帧，
+被新版本取代的中间帧直接丢弃。
+"""
+
+import threading
+from typing import Callable, Dict, Tuple
+from config import Config
+
+# 帧工厂：返回 (事件名, 负载)，只在真正发送时调用，被取代的帧不会编码
+FrameFactory = Callable[[], Tuple[str, object]]
+
+
+class CoalescingEmitter:
+    """按节拍合并推送的Socket.IO发送器"""
+
+    def __init__(self, socketio, interval: float = None, max_queue: int = None, namespace: str = '/'):
+        """
+        Args:
+            socketio: Flask-SocketIO实例
+            interval: 发送节拍（秒）
+            max_queue: 客户端发送队列中积压的数据包达到该数量时暂停向其发送
+            namespace: 命名空间
+        """
+        self.socketio = socketio
+        self.interval = Config.SOCKET_EMIT_INTERVAL if interval is None else interval
+        self.max_queue = max_queue or Config.SOCKET_MAX_QUEUE
+        self.namespace = namespace
+
+        self._lock = threading.Lock()
+        self._pending: Dict[str, FrameFactory] = {}       # 房间 -> 下个节拍要发送的帧
+        self._latest: Dict[str, Tuple[str, object]] = {}  # 房间 -> 最近发送的帧（补发用）
+        self._deferred: Dict[str, str] = {}                # 积压客户端sid -> 待补发的房间
+        self._running = False
+
+        self.ticks = 0
+        self.frames_scheduled = 0
+        self.frames_emitted = 0
+        self.frames_coalesced = 0
+        self.frames_deferred = 0
+
+    def schedule(self, room: str, frame: FrameFactory):
+        """安排向房间发送一帧，同一节拍内后安排的帧取代之前的帧"""
+        with self._lock:
+            if room in self._pending:
+                self.frames_coalesced += 1
+            self._pending[room] = frame
+            self.frames_scheduled += 1
+        self.start()
+
+    def start(self):
+        """启动节拍任务（使用SocketIO的后台任务，gevent模式下为greenlet）"""
+        if self._running:
+            return
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        self.socketio.start_background_task(self._loop)
+
+    def _loop(self):
+        while self._running:
+            self.socketio.sleep(self.interval)
+            try:
+                self._tick()
+            except Exception as e:
+                print(f"❌ Socket推送节拍处理失败: {e}")
+
+    def queue_depth(self, eio_sid: str) -> int:
+        """客户端Engine.IO发送队列中等待发送的数据包数量"""
+        socket = self.socketio.server.eio.sockets.get(eio_sid)
+        return socket.queue.qsize() if socket is not None else 0
+
+    def _tick(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            deferred = dict(self._deferred)
+        self.ticks += 1
+        manager = self.socketio.server.manager
+
+        # 队列已清空的积压客户端补发其房间最新的一帧
+        for sid, room in deferred.items():
+            eio_sid = manager.eio_sid_from_sid(sid, self.namespace)
+            if eio_sid is None or room in pending:
+                # 已断开，或本节拍会随房间一起收到新帧
+                with self._lock:
+                    self._deferred.pop(sid, None)
+                continue
+            if self.queue_depth(eio_sid) < self.max_queue and room in self._latest:
+                self.socketio.emit(*self._latest[room], to=sid, namespace=self.namespace)
+                with self._lock:
+                    self._deferred.pop(sid, None)
+                self.frames_emitted += 1
+
+        for room, frame in pending.items():
+            participants = list(manager.get_participants(self.namespace, room))
+            if not participants:
+                self._latest.pop(room, None)
+                continue
+            behind = [sid for sid, eio_sid in participants if self.queue_depth(eio_sid) >= self.max_queue]
+            event, payload = self._latest[room] = frame()
+            with self._lock:
+                for sid in behind:
+                    self._deferred[sid] = room
+            self.frames_deferred += len(behind)
+            if len(behind) < len(participants):
+                self.socketio.emit(event, payload, to=room, skip_sid=behind or None, namespace=self.namespace)
+                self.frames_emitted += 1
+
+    def stats(self) -> Dict:
+        """发送器状态和每个客户端的发送队列深度，用于自省接口"""
+        manager = self.socketio.server.manager
+        with self._lock:
+            deferred = dict(self._deferred)
+        clients = {}
+        for eio_sid in list(self.socketio.server.eio.sockets):
+            sid = manager.sid_from_eio_sid(eio_sid, self.namespace)
+            clients[sid or eio_sid] = {
+                'queue_depth': self.queue_depth(eio_sid),
+                'deferred_room': deferred.get(sid)
+            }
+        return {
+            'interval': self.interval,
+            'max_queue': self.max_queue,
+            'ticks': self.ticks,
+            'pending_rooms': len(self._pending),
+            'frames_scheduled': self.frames_scheduled,
+            'frames_emitted': self.frames_emitted,
+            'frames_coalesced': self.frames_coalesced,
+            'frames_deferred': self.frames_deferred,
+            'deferred_clients': len(deferred),
+            'clients': clients
+        }
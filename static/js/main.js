@@ -3,11 +3,16 @@ class TikTokAnalyticsDashboard {
     constructor() {
         this.socket = null;
         this.currentData = [];
+        this.summary = null;
         this.dataStatus = 'loading';
         this.statusMessage = '';
         this.charts = {};
         this.isConnected = false;
-        this.pollingInterval = null; // HTTP轮询定时器
+        this.pollingActive = false; // HTTP长轮询是否在运行
+        this.pollingController = null; // 用于中止挂起中的长轮询请求
+        this.dataEtag = null; // 最近一次HTTP获取数据的ETag
+        this.dataVersion = 0; // 当前显示数据的快照版本号
+        this.unchangedPolls = 0; // 连续收到304的次数，用于退避
         this.authModalShown = false; // 授权弹窗状态
         
         this.init();
@@ -43,7 +48,10 @@ class TikTokAnalyticsDashboard {
             autoConnect: true,
             reconnection: true,
             reconnectionAttempts: 5,
-            reconnectionDelay: 1000
+            reconnectionDelay: 1000,
+            // 开启了二进制推送（SOCKET_BINARY_CODEC或?codec=msgpack）时页面才加载MessagePack解码库，
+            // 此时请求二进制推送，负载更小、解析更快；默认使用JSON
+            query: { codec: window.MessagePack ? 'msgpack' : 'json' }
         });
 
         this.socket.on('connect', () => {
@@ -65,13 +73,25 @@ class TikTokAnalyticsDashboard {
 
         this.socket.on('data_update', (response) => {
             console.log('Data updated via WebSocket:', response);
-            if (response) {
-                this.currentData = response.videos || [];
-                this.updateData(this.currentData);
-                this.updateStatusMessage(response.status, response.message);
-                if (response.status === 'success' && this.currentData.length > 0) {
-                    this.showNotification('数据已更新');
-                }
+            this.handleSocketData(response);
+        });
+
+        // 二进制推送（codec=msgpack），内容与data_update相同
+        this.socket.on('data_update_bin', (buffer) => {
+            const response = window.MessagePack.decode(new Uint8Array(buffer));
+            console.log('Data updated via WebSocket (msgpack):', response);
+            this.handleSocketData(response);
+        });
+
+        // 服务端检测到的计数异常：spike为观看增速突增，stall为计数长时间未更新
+        this.socket.on('anomaly', (event) => {
+            console.log('Anomalies detected:', event.anomalies);
+            const { spikes, stalls } = event;
+            if (spikes > 0) {
+                this.showNotification(`${spikes} 个视频观看增速突增`);
+            }
+            if (stalls > 0) {
+                this.showNotification(`${stalls} 个视频的统计数据长时间未更新`, 'error');
             }
         });
 
@@ -114,21 +134,45 @@ class TikTokAnalyticsDashboard {
             });
         }
 
+        // 趋势图从单个视频的历史返回全部视频
+        const closeHistoryBtn = document.getElementById('closeHistoryBtn');
+        if (closeHistoryBtn) {
+            closeHistoryBtn.addEventListener('click', () => {
+                this.closeVideoHistory();
+            });
+        }
+
         // 窗口大小改变时重新绘制图表
         window.addEventListener('resize', () => {
             this.resizeCharts();
         });
     }
 
+    handleSocketData(response) {
+        if (response) {
+            this.dataVersion = response.version || this.dataVersion;
+            this.currentData = response.videos || [];
+            this.summary = response.summary || null;
+            this.updateData(this.currentData);
+            this.updateStatusMessage(response.status, response.message);
+            if (response.status === 'success' && this.currentData.length > 0) {
+                this.showNotification('数据已更新');
+            }
+        }
+    }
+
     async loadInitialData() {
         this.showLoading(true);
         
         try {
-            const response = await fetch('/api/data');
+            const response = await fetch('/api/data?format=columnar');
             const result = await response.json();
+            this.dataEtag = response.headers.get('ETag');
+            this.dataVersion = result.version || 0;
             
             // 处理新的数据结构
-            this.currentData = result.videos || [];
+            this.currentData = this.decodeVideos(result);
+            this.summary = result.summary || null;
             this.updateData(this.currentData);
             this.updateStatusMessage(result.status, result.message);
             console.log('Initial data loaded');
@@ -149,10 +193,25 @@ class TikTokAnalyticsDashboard {
         refreshBtn.disabled = true;
         
         try {
-            const response = await fetch('/api/refresh');
+            const response = await fetch('/api/refresh?format=columnar');
             const result = await response.json();
+            const refresh = response.headers.get('X-Refresh');
             
-            if (result.status === 'success') {
+            if (refresh === 'throttled') {
+                // 距上次刷新太近，服务端返回最近的数据
+                this.currentData = this.decodeVideos(result);
+                this.summary = result.summary || null;
+                this.updateData(this.currentData);
+                const age = response.headers.get('Age');
+                this.showNotification(`数据${age}秒前刚刷新过，已显示最新数据`);
+            } else if (refresh === 'failed') {
+                // 失败的刷新不发布快照，有版本号时返回的是上次成功获取的数据
+                if (result.version) {
+                    this.showNotification('刷新失败，显示的是上次获取的数据', 'error');
+                } else {
+                    this.showNotification(result.message || '刷新失败', 'error');
+                }
+            } else if (result.status === 'success') {
                 console.log('Data refreshed manually');
                 this.showNotification('数据已刷新');
             }
@@ -183,24 +242,15 @@ class TikTokAnalyticsDashboard {
     }
 
     updateStatistics() {
-        const data = this.currentData || [];
-        
-        // 计算真实统计数据
-        const totalVideos = data.length;
-        const totalViews = data.reduce((sum, item) => sum + (item.views || 0), 0);
-        const totalLikes = data.reduce((sum, item) => sum + (item.likes || 0), 0);
-        const totalNewFollowers = data.reduce((sum, item) => sum + (item.new_followers || 0), 0);
-        
-        // 计算平均参与度（基于真实数据）
-        const avgEngagement = data.length > 0 
-            ? (data.reduce((sum, item) => sum + (item.engagement_rate || 0), 0) / data.length).toFixed(2)
-            : 0;
+        // 账号汇总由服务端随每个快照下发（增量维护），不再遍历视频列表求和
+        const summary = this.summary || {};
+        const avgEngagement = (summary.avg_engagement || 0).toFixed(2);
 
         // 更新DOM元素
-        this.updateElement('totalVideos', totalVideos);
-        this.updateElement('totalViews', this.formatNumber(totalViews));
+        this.updateElement('totalVideos', summary.total_videos || 0);
+        this.updateElement('totalViews', this.formatNumber(summary.total_views || 0));
         this.updateElement('avgCompletionRate', `${avgEngagement}%`); // 显示平均参与度
-        this.updateElement('totalFollowers', this.formatNumber(totalNewFollowers)); // 显示新关注者总数
+        this.updateElement('totalFollowers', this.formatNumber(summary.total_new_followers || 0)); // 显示新关注者总数
     }
 
     updateTable() {
@@ -282,9 +332,53 @@ class TikTokAnalyticsDashboard {
             </td>
         `;
 
+        // 点击行（链接除外）在趋势图中显示该视频的历史观看数
+        row.addEventListener('click', (event) => {
+            if (event.target.closest('a')) return;
+            this.showVideoHistory(item.video_id);
+        });
+
         return row;
     }
 
+    async showVideoHistory(videoId) {
+        if (!this.charts.views || !videoId) return;
+        this.historyVideoId = videoId;
+        this.toggleHistoryTitle(videoId);
+
+        try {
+            // 服务端按时间范围选择汇总层级并降采样，最多返回200个点
+            const response = await fetch(`/api/series?video_id=${encodeURIComponent(videoId)}&points=200&counters=views`);
+            const result = await response.json();
+            // 等待期间已关闭或切换到其他视频时丢弃结果
+            if (!result.success || this.historyVideoId !== videoId) return;
+
+            const views = result.series.views;
+            this.charts.views.data.labels = views.t.map(ts => new Date(ts * 1000).toLocaleString('zh-CN'));
+            this.charts.views.data.datasets[0].data = views.v;
+            this.charts.views.update();
+        } catch (error) {
+            console.error('Failed to load video history:', error);
+        }
+    }
+
+    closeVideoHistory() {
+        this.historyVideoId = null;
+        this.toggleHistoryTitle(null);
+        this.updateViewsChart(this.currentData);
+    }
+
+    toggleHistoryTitle(videoId) {
+        const title = document.getElementById('viewsChartTitle');
+        const closeHistoryBtn = document.getElementById('closeHistoryBtn');
+        if (title) {
+            title.textContent = videoId ? `观看数历史 (${videoId})` : '观看数趋势';
+        }
+        if (closeHistoryBtn) {
+            closeHistoryBtn.classList.toggle('d-none', !videoId);
+        }
+    }
+
     initCharts() {
         // 初始化观看数趋势图表
         this.initViewsChart();
@@ -369,7 +463,16 @@ class TikTokAnalyticsDashboard {
     }
 
     updateCharts() {
-        this.updateViewsChart(this.currentData);
+        // 显示历史的视频已不在最新数据中时回到全部视频
+        if (this.historyVideoId && !(this.currentData || []).some(item => item.video_id === this.historyVideoId)) {
+            this.historyVideoId = null;
+            this.toggleHistoryTitle(null);
+        }
+        if (this.historyVideoId) {
+            this.showVideoHistory(this.historyVideoId);
+        } else {
+            this.updateViewsChart(this.currentData);
+        }
         this.updateCompletionChart(this.currentData);
     }
 
@@ -698,44 +801,95 @@ class TikTokAnalyticsDashboard {
         }, 3000);
     }
 
+    decodeVideos(payload) {
+        // 列式负载（format=columnar）还原为记录数组，普通负载直接返回videos
+        if (payload.format !== 'columnar') {
+            return payload.videos || [];
+        }
+        const names = Object.keys(payload.columns);
+        const videos = new Array(payload.count);
+        for (let i = 0; i < payload.count; i++) {
+            const video = { video_id: payload.index[i] };
+            for (const name of names) {
+                const value = payload.columns[name][i];
+                if (value !== null) {
+                    video[name] = value;
+                }
+            }
+            videos[i] = video;
+        }
+        return videos;
+    }
+
     startHttpPolling() {
-        if (this.pollingInterval) {
+        if (this.pollingActive) {
             return; // 已经在轮询了
         }
+        this.pollingActive = true;
         
-        console.log('Starting HTTP polling as WebSocket fallback...');
-        
-        // 立即执行一次
-        this.fetchDataViaHttp();
-        
-        // 每30秒轮询一次
-        this.pollingInterval = setInterval(() => {
-            if (!this.isConnected) {
-                this.fetchDataViaHttp();
-            } else {
-                // WebSocket重新连接，停止轮询
-                this.stopHttpPolling();
-            }
-        }, 30000);
+        console.log('Starting HTTP long polling as WebSocket fallback...');
+        this.longPollLoop();
     }
 
     stopHttpPolling() {
-        if (this.pollingInterval) {
-            clearInterval(this.pollingInterval);
-            this.pollingInterval = null;
+        if (this.pollingActive) {
+            this.pollingActive = false;
+            if (this.pollingController) {
+                this.pollingController.abort();
+            }
             console.log('Stopped HTTP polling');
         }
     }
 
-    async fetchDataViaHttp() {
+    async longPollLoop() {
+        // 服务器挂起请求直到有新版本发布或超时，收到响应后立即发起下一次请求
+        while (this.pollingActive && !this.isConnected) {
+            const delay = await this.fetchDataViaHttp(true);
+            if (delay > 0) {
+                await new Promise(resolve => setTimeout(resolve, delay));
+            }
+        }
+        this.pollingActive = false;
+    }
+
+    async fetchDataViaHttp(longPoll = false) {
+        // 返回下一次请求前需要等待的毫秒数
         try {
-            const response = await fetch('/api/data');
+            // 长轮询时带上当前版本号；同时带上ETag进行条件请求，数据未变化时服务器返回304且不带响应体
+            const url = longPoll && this.dataVersion
+                ? `/api/data?format=columnar&since=${this.dataVersion}`
+                : '/api/data?format=columnar';
+            const headers = this.dataEtag ? { 'If-None-Match': this.dataEtag } : {};
+            this.pollingController = new AbortController();
+            const response = await fetch(url, { headers, cache: 'no-store', signal: this.pollingController.signal });
+            if (response.status === 204) {
+                // 服务器挂起到超时仍没有新版本，稍等后重新挂起（避免代理提前结束请求时空转）
+                console.log('Data unchanged (HTTP 204)');
+                return 1000;
+            }
+            if (response.status === 304) {
+                // since与服务器当前版本不同时服务器不挂起，ETag匹配就立即返回304。
+                // 服务器版本比客户端小（工作进程重启或连接到另一个工作进程）时以服务器版本为准，
+                // 下一次请求才会挂起；同时按连续次数退避，避免立即重试
+                const match = /v(\d+)\./.exec(response.headers.get('ETag') || '');
+                const serverVersion = match ? parseInt(match[1], 10) : null;
+                if (serverVersion !== null && serverVersion < this.dataVersion) {
+                    this.dataVersion = serverVersion;
+                }
+                this.unchangedPolls++;
+                console.log('Data unchanged (HTTP 304)');
+                return Math.min(1000 * 2 ** (this.unchangedPolls - 1), 30000);
+            }
+            this.unchangedPolls = 0;
             const data = await response.json();
+            this.dataEtag = response.headers.get('ETag');
             
             console.log('Data fetched via HTTP:', data);
             
-            if (data.success && data.videos) {
-                this.currentData = data.videos;
+            if (data.success && (data.videos || data.columns)) {
+                this.dataVersion = data.version;
+                this.currentData = this.decodeVideos(data);
+                this.summary = data.summary || null;
                 this.updateData(this.currentData);
                 this.updateStatusMessage(data.status, data.message);
                 
@@ -743,8 +897,14 @@ class TikTokAnalyticsDashboard {
                     this.showNotification('数据已更新 (HTTP)');
                 }
             }
+            // 未授权等没有版本号的数据不会被推送更新，降低请求频率
+            return data.version ? 0 : 30000;
         } catch (error) {
+            if (error.name === 'AbortError') {
+                return 0;
+            }
             console.error('HTTP polling error:', error);
+            return 5000;
         }
     }
 }
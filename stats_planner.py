@@ -0,0 +1,118 @@
+"""
+视频统计数据分层刷新计划
+
+新发布的视频计数变化快，需要频繁刷新；发布很久的视频几乎不变，
+按天刷新即可。计划器记录每个视频上次获取的统计数据和下次到期时间，
+每轮只查询到期的视频ID，其余视频沿用缓存的统计数据。
+"""
+
+import threading
+import time
+from typing import Dict, List, Optional
+from config import Config
+
+# 缓存的统计字段（来自 /v2/video/query/）
+STATS_FIELDS = ('view_count', 'like_count', 'comment_count', 'share_count')
+
+
+class VideoStatsState:
+    """单个视频的统计缓存和刷新状态"""
+
+    def __init__(self, video_id: str, create_time: Optional[float] = None):
+        self.video_id = video_id
+        self.create_time = create_time
+        self.stats = None        # 上次获取的详细数据
+        self.fetched_at = None   # 上次获取时间（unix时间戳）
+        self.velocity = 0.0      # 最近观看增速（次/小时）
+        self.next_due = 0.0      # 下次到期时间（unix时间戳）
+        self.misses = 0          # 连续请求但上游没有返回的次数
+
+
+class StatsRefreshPlanner:
+    """按视频年龄和近期增速决定每个视频的统计刷新频率"""
+
+    def __init__(self, tiers: list = None, hot_velocity: float = None):
+        """
+        Args:
+            tiers: [(最大年龄秒数或None, 刷新间隔秒数), ...]，按年龄从小到大排列
+            hot_velocity: 观看增速（次/小时）达到该值时提升到最高频层级
+        """
+        self.tiers = tiers or Config.STATS_REFRESH_TIERS
+        self.hot_velocity = Config.STATS_HOT_VELOCITY if hot_velocity is None else hot_velocity
+        self._videos: Dict[str, VideoStatsState] = {}
+        self._lock = threading.Lock()
+
+    def refresh_interval(self, state: VideoStatsState, now: float) -> float:
+        """根据视频年龄和增速计算刷新间隔"""
+        if state.velocity >= self.hot_velocity:
+            return self.tiers[0][1]
+        age = now - state.create_time if state.create_time else None
+        for max_age, interval in self.tiers:
+            if max_age is None or (age is not None and age < max_age):
+                return interval
+        return self.tiers[-1][1]
+
+    def miss_backoff(self, state: VideoStatsState, now: float) -> float:
+        """
+        请求了但上游没有返回的视频（已删除、设为私密或被限流）的重试间隔
+
+        按连续缺失次数指数退避，最长为最低频层级的刷新间隔
+        """
+        return min(self.refresh_interval(state, now) * 2 ** state.misses, self.tiers[-1][1])
+
+    def due_ids(self, videos_basic: list, now: float = None) -> List[str]:
+        """返回列表中需要重新查询统计数据的视频ID"""
+        now = now or time.time()
+        due = []
+        with self._lock:
+            for video in videos_basic:
+                video_id = video['id']
+                state = self._videos.get(video_id)
+                if state is None:
+                    state = VideoStatsState(video_id, video.get('create_time'))
+                    self._videos[video_id] = state
+                if state.next_due <= now:
+                    due.append(video_id)
+        return due
+
+    def record(self, detailed_videos: list, now: float = None, requested: list = ()):
+        """
+        记录新获取的统计数据并计算下次到期时间
+
+        Args:
+            requested: 本次请求的视频ID，其中上游没有返回的视频按miss_backoff推迟下次到期时间，
+                不会每一轮都重新请求
+        """
+        now = now or time.time()
+        with self._lock:
+            for video in detailed_videos:
+                state = self._videos.get(video.get('id'))
+                if state is None:
+                    state = VideoStatsState(video.get('id'), video.get('create_time'))
+                    self._videos[state.video_id] = state
+                if state.create_time is None:
+                    state.create_time = video.get('create_time')
+                if state.stats is not None and state.fetched_at and now > state.fetched_at:
+                    gained = video.get('view_count', 0) - state.stats.get('view_count', 0)
+                    state.velocity = max(0.0, gained) * 3600 / (now - state.fetched_at)
+                state.stats = video
+                state.fetched_at = now
+                state.misses = 0
+                state.next_due = now + self.refresh_interval(state, now)
+            returned = {video.get('id') for video in detailed_videos}
+            for video_id in requested:
+                state = self._videos.get(video_id)
+                if state is None or video_id in returned:
+                    continue
+                state.misses += 1
+                state.next_due = now + self.miss_backoff(state, now)
+
+    def cached_stats(self, video_ids: list) -> list:
+        """返回已缓存的统计数据（附带获取时间）"""
+        result = []
+        with self._lock:
+            for video_id in video_ids:
+                state = self._videos.get(video_id)
+                if state is not None and state.stats is not None:
+                    result.append(dict(state.stats, stats_fetched_at=state.fetched_at))
+        return result
@@ -0,0 +1,63 @@
+"""
+计数异常检测测试 - 突增和停滞，分层刷新沿用的缓存计数不作为新的观察
+"""
+
+import dataclasses
+import datetime
+
+from anomaly import AnomalyDetector
+from snapshot_store import make_snapshot
+
+START = 1_700_000_000
+
+
+def snapshot(cycle, views, fetched=None):
+    """每分钟发布一次；fetched为{video_id: 获取时间}，未给出的视频没有stats_updated_at"""
+    fetched = fetched or {}
+    items = []
+    for video_id, count in views.items():
+        item = {'video_id': video_id, 'views': count}
+        if video_id in fetched:
+            item['stats_updated_at'] = datetime.datetime.fromtimestamp(fetched[video_id]).isoformat()
+        items.append(item)
+    return dataclasses.replace(make_snapshot('a', cycle + 1, items, 'success', 'ok'),
+                               published_at=START + cycle * 60)
+
+
+def detector():
+    return AnomalyDetector(threshold=4, alpha=0.1, min_samples=5, stall_intervals=3, min_std=5, spike_ratio=3)
+
+
+def test_spike_and_stall():
+    anomalies = []
+    instance = detector()
+    for cycle in range(40):
+        views = {'steady': 100 * cycle, 'hot': 100 * cycle + (5000 * (cycle - 19) if cycle >= 20 else 0)}
+        if cycle >= 30:
+            views['steady'] = 100 * 29
+        anomalies.append({(item['video_id'], item['kind']) for item in instance.observe(snapshot(cycle, views))})
+    assert ('hot', 'spike') in anomalies[20]
+    assert any(('steady', 'stall') in found for found in anomalies[31:])
+
+
+def test_cached_counters_are_not_stalls():
+    """视频降到低频层级后，两次获取之间发布的是缓存计数（stats_updated_at不变），不应被报告为停滞"""
+    instance = detector()
+    found = []
+    for cycle in range(120):
+        # 前30分钟每分钟获取一次，之后每小时获取一次
+        fetch = START + (cycle if cycle < 30 else cycle - (cycle - 30) % 60) * 60
+        views = {'slow': 100 * (fetch - START) // 60}
+        found.extend(instance.observe(snapshot(cycle, views, {'slow': fetch})))
+    assert found == []
+
+
+def test_fresh_counters_can_stall():
+    """计数确实在刷新（stats_updated_at前进）但不再增长时仍报告停滞"""
+    instance = detector()
+    found = []
+    for cycle in range(40):
+        views = {'slow': 100 * min(cycle, 20)}
+        found.extend(item['kind'] for item in instance.observe(
+            snapshot(cycle, views, {'slow': START + cycle * 60})))
+    assert 'stall' in found
@@ -0,0 +1,189 @@
+"""
+冷历史归档测试 - varint/zigzag/差分编码的往返、段文件的写入与扫描、封存合并
+"""
+
+import numpy as np
+import pytest
+
+from history_archive import (
+    ARCHIVE_SPANS, COLUMN_ENCODINGS, SEGMENT_COLUMNS, HistoryArchive, Segment,
+    _unzigzag, _zigzag, decode_column, decode_varints, encode_column, encode_varints, to_rows, write_segment
+)
+from history_store import ROLLUP_COLUMNS
+
+DAY = ARCHIVE_SPANS['1m']
+
+
+def make_rows(video_ids, start, count, step=60, seed=0):
+    """生成按(video_id, bucket)排序的汇总行，部分视频的likes为空"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for n, video_id in enumerate(video_ids):
+        last = rng.integers(0, 10 ** 6, len(ROLLUP_COLUMNS) // 3)
+        for k in range(count):
+            delta = rng.integers(-5, 500, len(last))
+            last = last + np.maximum(delta, 0)
+            values = [int(v) for v in last]
+            maximum = list(values)
+            if n % 3 == 1:
+                values[1] = maximum[1] = None
+            rows.append((video_id, start + k * step, *values, *maximum, *(int(d) for d in delta)))
+    return rows
+
+
+def test_varint_roundtrip():
+    values = np.array([0, 1, 127, 128, 300, 2 ** 32, 2 ** 63 - 1, 2 ** 64 - 1], dtype=np.uint64)
+    blob, ends = encode_varints(values)
+    assert ends[-1] == len(blob)
+    assert len(blob) == 1 + 1 + 1 + 2 + 2 + 5 + 9 + 10
+    decoded = decode_varints(np.frombuffer(blob, dtype=np.uint8))
+    assert decoded.tolist() == values.tolist()
+
+
+def test_varint_empty():
+    blob, ends = encode_varints(np.zeros(0, dtype=np.uint64))
+    assert blob == b'' and len(ends) == 0
+    assert len(decode_varints(np.zeros(0, dtype=np.uint8))) == 0
+
+
+def test_zigzag_roundtrip():
+    values = np.array([0, -1, 1, -2, 2, 2 ** 62, -(2 ** 62), 2 ** 63 - 1, -(2 ** 63)], dtype=np.int64)
+    codes = _zigzag(values)
+    assert codes[:5].tolist() == [0, 1, 2, 3, 4]
+    assert _unzigzag(codes).tolist() == values.tolist()
+
+
+@pytest.mark.parametrize('encoding, groups', [
+    ('raw', [[5, 9, 9, 3, 1000], [None, 7, None, 12], [42], [None]]),
+    ('delta', [[5, 9, 9, 3, 1000], [None, 7, None, 12], [42], [None]]),
+    # 二阶差分只用于时间戳列，没有空值
+    ('delta_of_delta', [[100, 160, 220, 400, 460], [7], [0, 60], [5, 3, 1, -10]]),
+])
+def test_column_roundtrip_per_video(encoding, groups):
+    """多个视频首尾相接编码后，每个视频单独解码得到原值，空值解码为-1"""
+    values = np.array([v or 0 for group in groups for v in group], dtype=np.int64)
+    nulls = np.array([v is None for group in groups for v in group])
+    starts = np.cumsum([0] + [len(group) for group in groups[:-1]])
+    codes = encode_column(values, nulls, starts, encoding)
+    assert (codes[nulls] == 0).all()
+    for start, group in zip(starts, groups):
+        decoded = decode_column(codes[start:start + len(group)], encoding)
+        assert decoded.tolist() == [-1 if v is None else v for v in group]
+
+
+def test_delta_of_delta_regular_buckets_are_small():
+    """等间隔的时间戳二阶差分为0，除前两个值外每个值只占一个字节"""
+    buckets = np.arange(1_700_000_000, 1_700_000_000 + 60 * 1000, 60, dtype=np.int64)
+    codes = encode_column(buckets, np.zeros(len(buckets), dtype=bool), np.array([0]), 'delta_of_delta')
+    blob, _ = encode_varints(codes)
+    assert len(blob) < len(buckets) + 8
+    assert decode_column(codes, 'delta_of_delta').tolist() == buckets.tolist()
+
+
+def test_segment_roundtrip(tmp_path):
+    rows = make_rows(['a', 'b', 'c'], 1_700_000_000, 50)
+    path = str(tmp_path / 'seg.seg')
+    write_segment(path, '1m', 'acc', 1_700_000_000, 1_700_000_000 + DAY, rows)
+    segment = Segment(path)
+    try:
+        assert segment.header['series'] == ['a', 'b', 'c']
+        assert segment.rows() == rows
+        assert segment.scan('missing') is None
+        # 时间范围过滤（两端都包含）
+        start, end = 1_700_000_000 + 60 * 10, 1_700_000_000 + 60 * 19
+        columns = segment.scan('b', start, end)
+        expected = [row[1:] for row in rows if row[0] == 'b' and start <= row[1] <= end]
+        assert to_rows(columns) == expected
+        # 与视频时间范围不重叠时不解码
+        assert segment.scan('a', end=1_600_000_000) is None
+    finally:
+        segment.close()
+
+
+def test_segment_columns_and_encodings_cover_rollup_columns():
+    assert SEGMENT_COLUMNS == ('bucket',) + ROLLUP_COLUMNS
+    assert set(COLUMN_ENCODINGS) == set(SEGMENT_COLUMNS)
+
+
+def test_seal_merges_existing_segment(tmp_path):
+    """同一时间段再次封存时与已有段合并，同一个桶以新数据为准"""
+    archive = HistoryArchive(root=str(tmp_path))
+    period = 1_700_006_400 - 1_700_006_400 % DAY
+    first = make_rows(['a', 'b'], period, 30, seed=1)
+    second = make_rows(['b', 'c'], period + 60 * 20, 30, seed=2)
+    archive.seal('1m', 'acc', period, first)
+    archive.seal('1m', 'acc', period, second)
+
+    merged = {(row[0], row[1]): row for row in first}
+    merged.update({(row[0], row[1]): row for row in second})
+    expected = [merged[key] for key in sorted(merged)]
+    for video_id in ('a', 'b', 'c'):
+        assert archive.query('1m', 'acc', video_id) == [row[1:] for row in expected if row[0] == video_id]
+    assert [row for rows in archive.iter_rows('1m', 'acc') for row in rows] == expected
+    assert archive.archived_until('1m', 'acc') == period + DAY
+
+
+def test_scan_spans_segments_and_removal(tmp_path):
+    archive = HistoryArchive(root=str(tmp_path))
+    period = 1_700_006_400 - 1_700_006_400 % DAY
+    for day in range(3):
+        archive.seal('1m', 'acc', period + day * DAY, make_rows(['a'], period + day * DAY, 10, seed=day))
+
+    # 跨越第二、三个段，第一个段与范围不重叠
+    columns = archive.scan('1m', 'acc', 'a', period + DAY - 120, period + 2 * DAY + 60)
+    assert columns['bucket'].tolist() == \
+        [period + DAY + 60 * k for k in range(10)] + [period + 2 * DAY, period + 2 * DAY + 60]
+    assert archive.query('1m', 'other', 'a') == []
+
+    assert archive.remove_before('1m', period + 2 * DAY) == 2
+    assert [row[1] for rows in archive.iter_rows('1m', 'acc') for row in rows] == \
+        [period + 2 * DAY + 60 * k for k in range(10)]
+    assert archive.stats()['1m']['segments'] == 1
+
+
+def test_reseal_and_removal_during_export(tmp_path):
+    """导出逐段读取期间同一段被重封或删除，正在读取的段在读取结束后才关闭"""
+    archive = HistoryArchive(root=str(tmp_path))
+    period = 1_700_006_400 - 1_700_006_400 % DAY
+    rows = make_rows(['a', 'b', 'c'], period, 20, seed=3)
+    archive.seal('1m', 'acc', period, rows)
+    reader = archive.iter_rows('1m', 'acc')
+    assert next(reader) == [row for row in rows if row[0] == 'a']
+    segment = archive._segments[archive.segment_path('1m', 'acc', period)]
+
+    archive.seal('1m', 'acc', period, make_rows(['d'], period, 5, seed=4))
+    assert segment.evicted and segment._bytes is not None
+    # 旧映射上的读取照常完成，结束后关闭
+    assert [chunk[0][0] for chunk in reader] == ['b', 'c']
+    assert segment._bytes is None
+    assert [chunk[0][0] for chunk in archive.iter_rows('1m', 'acc')] == ['a', 'b', 'c', 'd']
+
+    reader = archive.iter_rows('1m', 'acc')
+    next(reader)
+    assert archive.remove_before('1m', period + DAY) == 1
+    assert len(list(reader)) == 3
+    assert archive.query('1m', 'acc', 'a') == []
+
+
+def test_export_merges_archive_and_sqlite_by_video(tmp_path):
+    """导出按(video_id, bucket)归并各个段和SQLite中的汇总，每个视频的行是连续的"""
+    from history_store import HistoryStore, connect
+    archive = HistoryArchive(root=str(tmp_path / 'archive'))
+    store = HistoryStore(path=str(tmp_path / 'history.db'), archive=archive)
+    period = 1_700_006_400 - 1_700_006_400 % DAY
+    archived = []
+    for day in range(2):
+        rows = make_rows(['a', 'b', 'c'], period + day * DAY, 10, seed=day)
+        archive.seal('1m', 'acc', period + day * DAY, rows)
+        archived.extend(rows)
+    recent = make_rows(['a', 'c', 'd'], period + 2 * DAY, 10, seed=5)
+    conn = connect(store.path)
+    conn.execute('BEGIN')
+    conn.executemany(f'INSERT INTO video_rollup_1m VALUES ({", ".join("?" * (len(ROLLUP_COLUMNS) + 3))})',
+                     [('acc', *row) for row in recent])
+    conn.execute('COMMIT')
+    conn.close()
+
+    chunks = list(store.iter_range('acc', tier='1m', chunk_size=7))
+    assert all(len(chunk) <= 7 for chunk in chunks)
+    assert [row for chunk in chunks for row in chunk] == sorted(archived + recent, key=lambda row: (row[0], row[1]))
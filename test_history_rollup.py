@@ -0,0 +1,185 @@
+"""
+历史汇总测试 - 桶的最后值/最大值/增量、跨运行的水位和carry、保留清理只删除已被下一层汇总的数据
+"""
+
+import pytest
+
+from config import Config
+from history_rollup import HistoryRollup, rollup_samples
+from history_store import COUNTER_FIELDS, ROLLUP_COLUMNS, connect
+
+DAY = 86400
+T0 = 1_700_006_400 - 1_700_006_400 % DAY
+COLUMNS = {name: i for i, name in enumerate(ROLLUP_COLUMNS)}
+
+
+def views_at(video_id, ts):
+    """单调递增但增速不均匀的观看数"""
+    offset = ts - T0
+    return 1000 + offset // 7 + (offset // 600) ** 2 + (500 if video_id == 'b' else 0)
+
+
+def samples(start, end, step=30):
+    rows = []
+    for ts in range(start, end, step):
+        rows.append(('acc', 'a', ts, views_at('a', ts), 1, 0, 0))
+        # b从第二个小时开始出现
+        if ts >= T0 + 3600:
+            rows.append(('acc', 'b', ts, views_at('b', ts), 2, 0, 0))
+    return rows
+
+
+def insert(path, rows):
+    conn = connect(path)
+    conn.execute('BEGIN')
+    conn.executemany('INSERT INTO video_samples VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+    conn.execute('COMMIT')
+    conn.close()
+
+
+def rollup_rows(path, tier, video_id):
+    conn = connect(path)
+    rows = conn.execute(f'SELECT bucket, {", ".join(ROLLUP_COLUMNS)} FROM video_rollup_{tier} '
+                        'WHERE account_id = ? AND video_id = ? ORDER BY bucket', ('acc', video_id)).fetchall()
+    conn.close()
+    return [(row[0], *row[1:]) for row in rows]
+
+
+def value(row, column):
+    return row[1 + COLUMNS[column]]
+
+
+def watermarks(path):
+    conn = connect(path)
+    result = dict(conn.execute('SELECT name, value FROM history_watermarks').fetchall())
+    conn.close()
+    return result
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    for name in ('RAW', 'MINUTE', 'HOUR', 'DAY'):
+        monkeypatch.setattr(Config, f'HISTORY_{name}_RETENTION_DAYS', 0)
+    return str(tmp_path / 'history.db')
+
+
+def test_rollup_samples_uses_carry_and_skips_nulls():
+    carry = {('acc', 'a'): [100, None, 5, 5]}
+    changed = {}
+    rows = [
+        ('acc', 'a', T0 + 10, 110, 7, None, 5),
+        ('acc', 'a', T0 + 50, 130, 9, None, 6),
+        ('acc', 'a', T0 + 70, 125, None, 8, 6),
+        ('acc', 'new', T0 + 20, 50, 1, 1, 1),
+    ]
+    buckets = {(row[1], row[2]): row[3:] for row in rollup_samples(rows, 60, changed, carry)}
+    counters = len(COUNTER_FIELDS)
+    first = buckets[('a', T0)]
+    assert list(first[:counters]) == [130, 9, None, 6]                 # 最后值
+    assert list(first[counters:2 * counters]) == [130, 9, None, 6]     # 最大值
+    # carry中likes为空时第一个likes没有基准，不计增量
+    assert list(first[2 * counters:]) == [30, 2, 0, 1]
+    second = buckets[('a', T0 + 60)]
+    assert list(second[2 * counters:]) == [-5, 0, 3, 0]
+    assert list(second[counters:2 * counters]) == [125, None, 8, 6]
+    # 首次出现的视频以该样本为基准
+    assert list(buckets[('new', T0)][2 * counters:]) == [0, 0, 0, 0]
+    assert changed[('acc', 'a')] == [125, 9, 8, 6]
+    # carry本身不被修改
+    assert carry == {('acc', 'a'): [100, None, 5, 5]}
+
+
+def check_minutes(path, video_id, start, end):
+    """分钟汇总与原始样本逐桶比对：最后值、最大值，增量为相邻桶最后值之差"""
+    rows = rollup_rows(path, '1m', video_id)
+    raw = [row for row in samples(start, end) if row[1] == video_id]
+    first_ts = raw[0][2]
+    assert [row[0] for row in rows] == sorted({ts - ts % 60 for _, _, ts, *_ in raw})
+    previous = views_at(video_id, first_ts)
+    for row in rows:
+        last = views_at(video_id, row[0] + 30)
+        assert value(row, 'views_last') == value(row, 'views_max') == last
+        assert value(row, 'views_delta') == last - previous
+        previous = last
+    return rows
+
+
+def test_tiers_and_watermarks(db):
+    insert(db, samples(T0, T0 + 3 * 3600))
+    rolled = HistoryRollup(path=db).run_once(T0 + 3 * 3600 + 120)
+    assert rolled['1m'] == 180 + 120 and rolled['1h'] == 3 + 2 and rolled['1d'] == 0
+    assert watermarks(db) == {'1m': T0 + 3 * 3600 + 60, '1h': T0 + 3 * 3600}
+
+    minutes = check_minutes(db, 'a', T0, T0 + 3 * 3600)
+    check_minutes(db, 'b', T0, T0 + 3 * 3600)
+    hours = rollup_rows(db, '1h', 'a')
+    assert [row[0] for row in hours] == [T0, T0 + 3600, T0 + 7200]
+    for row in hours:
+        inside = [m for m in minutes if row[0] <= m[0] < row[0] + 3600]
+        assert value(row, 'views_last') == value(inside[-1], 'views_last')
+        assert value(row, 'views_max') == max(value(m, 'views_max') for m in inside)
+        assert value(row, 'views_delta') == sum(value(m, 'views_delta') for m in inside)
+    # 各桶增量之和等于区间增长
+    assert sum(value(row, 'views_delta') for row in hours) == \
+        views_at('a', T0 + 3 * 3600 - 30) - views_at('a', T0)
+
+    # 没有新数据时再运行不写入任何行
+    assert HistoryRollup(path=db).run_once(T0 + 3 * 3600 + 120) == {'1m': 0, '1h': 0, '1d': 0}
+
+
+def test_carry_across_runs_and_instances(db):
+    """下一次运行（新的实例，carry从rollup_carry表读取）第一个桶的增量以上次汇总的最后计数为基准"""
+    insert(db, samples(T0, T0 + 2 * 3600))
+    # 第一次运行的水位停在T0+2h，第二批样本都在水位之后
+    HistoryRollup(path=db).run_once(T0 + 2 * 3600 + 60)
+    assert watermarks(db) == {'1m': T0 + 2 * 3600, '1h': T0 + 2 * 3600}
+    insert(db, samples(T0 + 2 * 3600, T0 + 4 * 3600))
+    HistoryRollup(path=db).run_once(T0 + 4 * 3600 + 120)
+
+    for video_id in ('a', 'b'):
+        minutes = check_minutes(db, video_id, T0, T0 + 4 * 3600)
+        first = next(ts for _, vid, ts, *_ in samples(T0, T0 + 4 * 3600) if vid == video_id)
+        assert sum(value(row, 'views_delta') for row in minutes) == \
+            views_at(video_id, T0 + 4 * 3600 - 30) - views_at(video_id, first)
+    hours = rollup_rows(db, '1h', 'a')
+    assert [value(row, 'views_delta') for row in hours][2] == \
+        views_at('a', T0 + 3 * 3600 - 30) - views_at('a', T0 + 2 * 3600 - 30)
+
+
+def count(path, table, column, before):
+    conn = connect(path)
+    result = conn.execute(f'SELECT count(*) FROM {table} WHERE {column} < ?', (before,)).fetchone()[0]
+    conn.close()
+    return result
+
+
+def test_retention_deletes_only_consumed_data(db, monkeypatch):
+    insert(db, samples(T0, T0 + 3 * 3600))
+    rollup = HistoryRollup(path=db)
+    rollup.run_once(T0 + 3 * 3600 + 120)
+    total_minutes = count(db, 'video_rollup_1m', 'bucket', 2 ** 62)
+
+    # 保留期已过，但下一层只汇总到第一个小时末：只删除已被汇总的部分
+    monkeypatch.setattr(Config, 'HISTORY_RAW_RETENTION_DAYS', 1)
+    monkeypatch.setattr(Config, 'HISTORY_MINUTE_RETENTION_DAYS', 1)
+    conn = connect(db)
+    conn.execute("UPDATE history_watermarks SET value = ? WHERE name = '1m'", (T0 + 3600,))
+    conn.execute("UPDATE history_watermarks SET value = ? WHERE name = '1h'", (T0 + 3600,))
+    conn.close()
+    rollup._apply_retention(T0 + 10 * DAY)
+
+    assert count(db, 'video_samples', 'ts', T0 + 3600) == 0
+    assert count(db, 'video_samples', 'ts', 2 ** 62) == len(samples(T0 + 3600, T0 + 3 * 3600))
+    assert count(db, 'video_rollup_1m', 'bucket', T0 + 3600) == 0
+    assert count(db, 'video_rollup_1m', 'bucket', 2 ** 62) == total_minutes - 60
+    assert rollup.rows_deleted['raw'] == 120 and rollup.rows_deleted['1m'] == 60
+    # 未设置保留期的层级不删除
+    assert count(db, 'video_rollup_1h', 'bucket', 2 ** 62) == 5
+
+    # 保留期未到时不删除
+    before = count(db, 'video_samples', 'ts', 2 ** 62)
+    conn = connect(db)
+    conn.execute("UPDATE history_watermarks SET value = ? WHERE name = '1m'", (T0 + 3 * 3600,))
+    conn.close()
+    rollup._apply_retention(T0 + 3 * 3600 + 120)
+    assert count(db, 'video_samples', 'ts', 2 ** 62) == before
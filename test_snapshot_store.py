@@ -0,0 +1,190 @@
+"""
+快照存储测试 - 写时复制发布、版本和历史、长轮询等待、增量和汇总，以及刷新失败时不发布
+"""
+
+import threading
+import time
+
+import pytest
+
+from config import Config
+from snapshot_store import SnapshotStore, make_snapshot, snapshot_delta
+
+
+def videos(*views):
+    return [{'video_id': f'v{i}', 'views': count, 'likes': 1, 'engagement_rate': 2.5}
+            for i, count in enumerate(views)]
+
+
+def test_publish_is_copy_on_write():
+    store = SnapshotStore()
+    items = videos(10, 20)
+    first = store.publish('a', items, 'success', 'ok')
+    # 生产者之后修改原列表不影响已发布的快照
+    items[0]['views'] = 999
+    items.append({'video_id': 'v9', 'views': 1})
+    assert [video['views'] for video in first.videos] == [10, 20]
+
+    mapping = store._snapshots
+    second = store.publish('a', videos(11, 21), 'success', 'ok')
+    # 发布替换整个映射，之前读取到的映射和快照保持不变
+    assert mapping['a'] is first
+    assert store.get('a') is second
+    assert first.videos[0]['views'] == 10
+
+
+def test_versions_are_global_and_monotonic():
+    store = SnapshotStore()
+    a1 = store.publish('a', videos(1), 'success', 'ok')
+    b1 = store.publish('b', videos(1), 'success', 'ok')
+    a2 = store.publish('a', videos(2), 'success', 'ok')
+    assert (a1.version, b1.version, a2.version) == (1, 2, 3)
+    assert store.version == 3
+    assert store.get('b') is b1
+    assert store.get(None) is None and store.get('missing') is None
+
+
+def test_history_keeps_recent_versions(monkeypatch):
+    monkeypatch.setattr(Config, 'SNAPSHOT_HISTORY', 3)
+    store = SnapshotStore()
+    published = [store.publish('a', videos(n), 'success', 'ok') for n in range(5)]
+    assert store.get_version('a', published[-1].version) is published[-1]
+    assert store.get_version('a', published[2].version) is published[2]
+    # 超出历史窗口的版本不再保留
+    assert store.get_version('a', published[1].version) is None
+    assert store.get_version('b', published[-1].version) is None
+
+
+def test_listeners_receive_previous_and_errors_are_isolated():
+    store = SnapshotStore()
+    calls = []
+
+    def failing(snapshot, previous):
+        raise RuntimeError('boom')
+
+    store.subscribe(failing)
+    store.subscribe(lambda snapshot, previous: calls.append((snapshot.version, previous and previous.version)))
+    store.publish('a', videos(1), 'success', 'ok')
+    store.publish('a', videos(2), 'success', 'ok')
+    assert calls == [(1, None), (2, 1)]
+
+
+def test_wait_for_returns_newer_version_or_times_out():
+    store = SnapshotStore()
+    current = store.publish('a', videos(1), 'success', 'ok')
+    # 已有更新的版本时立即返回
+    assert store.wait_for('a', current.version - 1, 5) is current
+
+    started = time.monotonic()
+    assert store.wait_for('a', current.version, 0.05) is None
+    assert time.monotonic() - started >= 0.05
+
+    timer = threading.Timer(0.05, lambda: store.publish('a', videos(2), 'success', 'ok'))
+    timer.start()
+    try:
+        snapshot = store.wait_for('a', current.version, 5)
+    finally:
+        timer.join()
+    assert snapshot is not None and snapshot.version == current.version + 1
+
+
+def test_snapshot_delta():
+    base = make_snapshot('a', 1, videos(10, 20, 30), 'success', 'ok')
+    items = videos(10, 25, 30)[:2] + [{'video_id': 'v7', 'views': 5}]
+    snapshot = make_snapshot('a', 2, items, 'success', 'ok')
+    delta = snapshot_delta(base, snapshot)
+    assert delta['from_version'] == 1 and delta['version'] == 2
+    assert [video['video_id'] for video in delta['upserts']] == ['v1', 'v7']
+    assert delta['removed'] == ['v2']
+    assert delta['order'] == ['v0', 'v1', 'v7']
+    # 只比较投影字段：likes不在投影中时likes的变化不产生upsert
+    changed = make_snapshot('a', 3, [dict(video, likes=100) for video in base.videos], 'success', 'ok')
+    assert snapshot_delta(base, changed, ('video_id', 'views'))['upserts'] == []
+    assert snapshot.delta_from(base) is snapshot.delta_from(base)
+
+
+def test_summary_is_maintained_incrementally():
+    store = SnapshotStore()
+    store.publish('a', videos(10, 20, 30), 'success', 'ok')
+    snapshot = store.publish('a', videos(15, 20), 'success', 'ok')
+    assert snapshot.summary == make_snapshot('a', 0, videos(15, 20), 'success', 'ok').summary
+    assert snapshot.summary['total_videos'] == 2
+    assert snapshot.summary['total_views'] == 35
+    assert snapshot.summary['avg_engagement'] == 2.5
+
+
+def test_restore_continues_versions():
+    store = SnapshotStore()
+    persisted = make_snapshot('a', 41, videos(3, 4), 'success', 'ok')
+    restored = store.restore(persisted)
+    assert store.get('a') is restored
+    assert restored.summary['total_views'] == 7
+    assert store.publish('b', videos(1), 'success', 'ok').version == 42
+    assert store.get_version('a', 41) is restored
+
+
+def test_remove_and_clear():
+    store = SnapshotStore()
+    store.publish('a', videos(1), 'success', 'ok')
+    store.publish('b', videos(1), 'success', 'ok')
+    store.remove('a')
+    assert store.get('a') is None and store.get_version('a', 1) is None
+    store.clear()
+    assert store.get('b') is None
+
+
+@pytest.fixture
+def app_module(monkeypatch):
+    """导入应用（不从磁盘恢复快照），快照存储和令牌存储替换为空的实例"""
+    monkeypatch.setenv('RESTORE_IN_WORKER', '1')
+    import app
+    from token_store import TokenStore
+    monkeypatch.setattr(app, 'snapshot_store', SnapshotStore())
+    monkeypatch.setattr(app, 'token_store', TokenStore())
+    monkeypatch.setattr(Config, '_runtime_client_key', 'k' * 12)
+    monkeypatch.setattr(Config, '_runtime_client_secret', 's' * 12)
+    app.token_store.save('a', {'access_token': 'token', 'expires_in': 86400})
+    return app
+
+
+def test_failed_refresh_keeps_last_snapshot(app_module, monkeypatch):
+    """上游失败时update_data不发布空快照，最近一次成功的快照和版本号保持不变"""
+    monkeypatch.setattr(app_module, 'fetch_account_videos', lambda account, deadline=None: (
+        videos(10, 20), 'success', 'ok'))
+    good = app_module.update_data('a', from_background=True)
+    assert good.version == 1
+
+    monkeypatch.setattr(app_module, 'fetch_account_videos', lambda account, deadline=None: (
+        [], 'error', '获取数据失败: 503'))
+    result = app_module.update_data('a', from_background=True)
+    assert result.status == 'error' and result.version == 0
+    assert app_module.snapshot_store.get('a') is good
+    assert app_module.snapshot_store.get('a').summary['total_videos'] == 2
+    with pytest.raises(Exception, match='503'):
+        app_module.scheduled_update('a', time.monotonic() + 5)
+
+
+def test_concurrent_saves_use_unique_temp_files(tmp_path):
+    """发布订阅者和令牌刷新同时保存同一账号时，落盘的总是某一次完整的写入"""
+    from snapshot_persistence import SnapshotPersistence
+    persistence = SnapshotPersistence(str(tmp_path))
+    snapshots = [make_snapshot('a', n, videos(*range(n * 50)), 'success', 'ok') for n in range(1, 9)]
+    errors = []
+
+    def save(snapshot):
+        try:
+            for _ in range(20):
+                persistence.save(snapshot, {'access_token': f't{snapshot.version}'})
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=save, args=(snapshot,)) for snapshot in snapshots]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    [(loaded, token)] = persistence.load()
+    assert len(loaded.videos) == loaded.version * 50 and token == {'access_token': f't{loaded.version}'}
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['a.json']
+    assert (tmp_path / 'a.json').stat().st_mode & 0o777 == 0o600
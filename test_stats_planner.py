@@ -0,0 +1,50 @@
+"""
+统计刷新计划测试 - 按层级到期、上游没有返回的视频指数退避
+"""
+
+from stats_planner import StatsRefreshPlanner
+
+TIERS = [(48 * 3600, 60), (7 * 24 * 3600, 3600), (None, 24 * 3600)]
+NOW = 1_700_000_000
+
+
+def basic(*ids, age=3600):
+    return [{'id': video_id, 'create_time': NOW - age} for video_id in ids]
+
+
+def stats(video_id, views):
+    return {'id': video_id, 'view_count': views, 'like_count': 0, 'comment_count': 0, 'share_count': 0}
+
+
+def test_due_by_tier():
+    planner = StatsRefreshPlanner(tiers=TIERS, hot_velocity=10 ** 9)
+    videos = basic('new') + basic('old', age=30 * 86400)
+    assert planner.due_ids(videos, NOW) == ['new', 'old']
+    planner.record([stats('new', 1), stats('old', 1)], NOW, requested=['new', 'old'])
+    assert planner.due_ids(videos, NOW + 30) == []
+    assert planner.due_ids(videos, NOW + 60) == ['new']
+    assert planner.due_ids(videos, NOW + 86400) == ['new', 'old']
+
+
+def test_missing_ids_back_off():
+    """请求了但没有返回的视频不再每一轮都到期，间隔按缺失次数翻倍，最长为最低频层级"""
+    planner = StatsRefreshPlanner(tiers=TIERS, hot_velocity=10 ** 9)
+    videos = basic('kept', 'gone')
+    now = NOW
+    intervals = []
+    for _ in range(12):
+        due = planner.due_ids(videos, now)
+        assert 'gone' in due
+        planner.record([stats('kept', 1)], now, requested=due)
+        intervals.append(planner._videos['gone'].next_due - now)
+        now = planner._videos['gone'].next_due
+    assert intervals[:6] == [120, 240, 480, 960, 1920, 3840]
+    assert intervals[-1] == 86400
+    # 两次到期之间不会再次请求
+    assert 'gone' not in planner.due_ids(videos, now - 1)
+    assert planner.cached_stats(['kept', 'gone'])[0]['id'] == 'kept'
+
+    # 重新返回后恢复按层级的间隔（此时视频已超过48小时，属于每小时一次的层级）
+    planner.record([stats('gone', 5)], now, requested=['gone'])
+    assert planner._videos['gone'].misses == 0
+    assert planner._videos['gone'].next_due == now + 3600
@@ -0,0 +1,108 @@
+"""
+热门趋势测试 - 有界前K索引与完整排序一致、发布时只处理变化的视频
+"""
+
+import random
+import time
+
+import pytest
+
+from config import Config
+from snapshot_store import SnapshotStore
+from trending import RankIndex, TrendingTracker
+
+
+def expected_top(scores, k):
+    ranked = sorted((-score, key) for key, score in scores.items() if score > 0)
+    return [key for _, key in ranked[:k]]
+
+
+def test_rank_index_matches_full_sort():
+    rng = random.Random(3)
+    index = RankIndex(k=10)
+    scores = {}
+    for step in range(5000):
+        key = f'v{rng.randrange(60)}'
+        # 分数有升有降，部分降为0（移出索引）
+        score = rng.choice([0, rng.randint(1, 50), rng.random() * 50])
+        index.update(key, score)
+        scores[key] = score
+        if step % 7 == 0:
+            assert index.top(10) == expected_top(scores, 10)
+            assert index.top(3) == expected_top(scores, 3)
+    assert len(index) == sum(1 for score in scores.values() if score > 0)
+    assert len(index._entries) <= 10
+
+
+def test_rank_index_stays_bounded_when_scores_rise():
+    index = RankIndex(k=5)
+    for i in range(1000):
+        index.update(i, i + 1)
+    assert len(index._entries) == 5 and index.rebuilds == 0
+    assert index.top(5) == [999, 998, 997, 996, 995]
+
+
+def videos(counts):
+    return [{'video_id': video_id, 'views': views, 'likes': views // 10} for video_id, views in counts.items()]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    return now
+
+
+def test_publish_only_visits_changed_and_active_videos(clock):
+    store = SnapshotStore()
+    tracker = TrendingTracker(window=600)
+    store.subscribe(tracker.record)
+    counts = {f'v{i:04d}': 1000 for i in range(2000)}
+    store.publish('a', videos(counts), 'success', 'ok')
+    assert tracker.last_visited == 2000
+
+    clock[0] += 60
+    counts['v0007'] += 600
+    counts['v0042'] += 60
+    del counts['v1999']
+    store.publish('a', videos(counts), 'success', 'ok')
+    assert tracker.last_visited == 3
+    assert [item['video_id'] for item in tracker.top('views', 5, 'a')] == ['v0007', 'v0042']
+    assert tracker.top('views', 1, 'a')[0]['views_per_hour'] == 36000.0
+
+    # 计数不变时增速随窗口滑动衰减，只重新计算两个仍在增长的视频
+    clock[0] += 60
+    store.publish('a', videos(counts), 'success', 'ok')
+    assert tracker.last_visited == 2
+    assert tracker.top('views', 1, 'a')[0]['views_per_hour'] == 18000.0
+
+    # 窗口过后增速降为0，移出排名，之后的发布不再访问任何视频
+    clock[0] += 700
+    store.publish('a', videos(counts), 'success', 'ok')
+    assert tracker.top('views', 5, 'a') == []
+    clock[0] += 60
+    store.publish('a', videos(counts), 'success', 'ok')
+    assert tracker.last_visited == 0
+
+
+def test_incremental_matches_full_recompute(clock):
+    """增量处理的排名与每次都处理完整列表的结果一致"""
+    rng = random.Random(11)
+    store = SnapshotStore()
+    incremental = TrendingTracker(window=900)
+    full = TrendingTracker(window=900)
+    store.subscribe(incremental.record)
+    store.subscribe(lambda snapshot, previous: full.record(snapshot))
+    counts = {f'v{i}': rng.randint(0, 10 ** 4) for i in range(300)}
+    for _ in range(40):
+        clock[0] += 60
+        for video_id in rng.sample(sorted(counts), 20):
+            counts[video_id] += rng.randint(0, 500)
+        for video_id in rng.sample(sorted(counts), 2):
+            del counts[video_id]
+        counts[f'n{clock[0]:.0f}'] = rng.randint(0, 100)
+        store.publish('a', videos(counts), 'success', 'ok')
+        for metric in ('views', 'likes'):
+            assert incremental.top(metric, Config.TRENDING_MAX_LIMIT, 'a') == \
+                full.top(metric, Config.TRENDING_MAX_LIMIT, 'a')
+    assert incremental.last_visited < full.last_visited
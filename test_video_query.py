@@ -0,0 +1,164 @@
+"""
+视频列表查询测试 - 排序、双向游标分页、筛选和无效参数
+"""
+
+import base64
+import json
+import random
+
+import pytest
+
+from config import Config
+from snapshot_store import make_snapshot
+from video_query import SORT_KEYS, VideoQuery, page_payload, parse_query, query_videos, sort_key
+
+
+@pytest.fixture
+def snapshot():
+    rng = random.Random(7)
+    items = []
+    for i in range(237):
+        video = {
+            'video_id': f'v{i:03d}',
+            'views': rng.choice([0, 5, 5, 100, rng.randint(0, 10 ** 6)]),
+            'likes': rng.randint(0, 500),
+            'engagement_rate': round(rng.random() * 10, 2),
+            'publish_time': f'2024-0{rng.randint(1, 9)}-{rng.randint(10, 28)}T12:00:00'
+        }
+        # 部分视频缺少字段，排在升序最前、降序最后
+        if i % 17 == 0:
+            del video['views']
+        if i % 23 == 0:
+            del video['publish_time']
+        items.append(video)
+    rng.shuffle(items)
+    return make_snapshot('a', 1, items, 'success', 'ok')
+
+
+def all_pages(snapshot, args):
+    """按next_cursor依次取完所有页"""
+    ids, cursor = [], None
+    while True:
+        query = parse_query(dict(args, **({'cursor': cursor} if cursor else {})))
+        page, cursor, total = query_videos(snapshot, query)
+        assert len(page) <= query.limit
+        ids.extend(video['video_id'] for video in page)
+        if cursor is None:
+            return ids, total
+
+
+def expected_ids(snapshot, sort, descending, keep=lambda video: True):
+    videos = sorted((video for video in snapshot.videos if keep(video)),
+                    key=lambda video: sort_key(video, sort), reverse=descending)
+    return [video['video_id'] for video in videos]
+
+
+@pytest.mark.parametrize('sort', ['views', 'engagement_rate', 'publish_time'])
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+def test_pages_cover_full_sorted_list(snapshot, sort, order):
+    ids, total = all_pages(snapshot, {'sort': sort, 'order': order, 'limit': '20'})
+    assert ids == expected_ids(snapshot, sort, order == 'desc')
+    assert total == len(snapshot.videos)
+
+
+def test_missing_values_and_ties(snapshot):
+    query = VideoQuery(sort='views', descending=False, limit=len(snapshot.videos))
+    page, cursor, _ = query_videos(snapshot, query)
+    assert cursor is None
+    missing = [video for video in page if 'views' not in video]
+    assert page[:len(missing)] == missing
+    # 相同值按video_id排列
+    fives = [video['video_id'] for video in page if video.get('views') == 5]
+    assert fives == sorted(fives)
+
+
+def test_filters(snapshot):
+    args = {'sort': 'likes', 'order': 'desc', 'limit': '15', 'min_views': '100',
+            'published_after': '2024-03-01', 'published_before': '2024-07-01'}
+
+    def keep(video):
+        published = video.get('publish_time') or ''
+        return (video.get('views') or 0) >= 100 and published and '2024-03-01' <= published < '2024-07-01'
+
+    ids, total = all_pages(snapshot, args)
+    assert ids == expected_ids(snapshot, 'likes', True, keep)
+    assert total == len(ids) > 0
+
+
+def test_cursor_is_stable_across_new_versions(snapshot):
+    """游标是排序键而不是偏移量，新版本中插入的视频不会导致重复或遗漏"""
+    query = parse_query({'sort': 'views', 'limit': '30'})
+    first, cursor, _ = query_videos(snapshot, query)
+    newer = make_snapshot('a', 2, [{'video_id': 'new', 'views': 10 ** 7}, *snapshot.videos], 'success', 'ok')
+    second, _, _ = query_videos(newer, parse_query({'sort': 'views', 'limit': '30', 'cursor': cursor}))
+    expected = expected_ids(snapshot, 'views', True)
+    assert [video['video_id'] for video in first + second] == expected[:60]
+
+
+def encode(data):
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip('=')
+
+
+@pytest.mark.parametrize('cursor', [
+    'not-base64!',
+    encode({'sort': 'views'}),
+    encode(['views', True, 1, 5]),
+    encode(['likes', True, 1, 5, 'v1']),
+    encode(['views', False, 1, 5, 'v1']),
+    encode(['views', True, 1, 'abc', 'v1']),
+    encode(['views', True, True, 5, 'v1']),
+    encode(['views', True, 2, 5, 'v1']),
+    encode(['views', True, 1, 5, 7]),
+    encode(['views', True, 0, 5, 'v1']),
+    encode(['views', True, 1, None, 'v1']),
+])
+def test_malformed_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        parse_query({'sort': 'views', 'order': 'desc', 'cursor': cursor})
+
+
+def test_cursor_for_string_sort_field():
+    with pytest.raises(ValueError):
+        parse_query({'sort': 'publish_time', 'cursor': encode(['publish_time', True, 1, 5, 'v1'])})
+    query = parse_query({'sort': 'publish_time', 'cursor': encode(['publish_time', True, 1, '2024-01-01', 'v1'])})
+    assert query.cursor == (1, '2024-01-01', 'v1')
+
+
+def test_parse_query_validation():
+    with pytest.raises(ValueError):
+        parse_query({'sort': 'title'})
+    with pytest.raises(ValueError):
+        parse_query({'order': 'up'})
+    with pytest.raises(ValueError):
+        parse_query({'limit': 'ten'})
+    assert parse_query({'limit': '0'}).limit == 1
+    assert parse_query({'limit': str(10 ** 6)}).limit == Config.DATA_MAX_PAGE_SIZE
+    assert parse_query({}) == VideoQuery(sort='views', descending=True, limit=Config.DATA_PAGE_SIZE)
+    assert 'views' in SORT_KEYS
+
+
+def test_page_payload_layouts(snapshot):
+    query = parse_query({'sort': 'views', 'limit': '5'})
+    rows = page_payload(snapshot, query, fields=('video_id', 'views'))
+    assert rows['page']['limit'] == 5 and rows['page']['next_cursor']
+    assert all(set(video) <= {'video_id', 'views'} for video in rows['videos'])
+    columnar = page_payload(snapshot, query, fields=('video_id', 'views'), layout='columnar')
+    assert columnar['index'] == [video['video_id'] for video in rows['videos']]
+    assert columnar['columns']['views'] == [video.get('views') for video in rows['videos']]
+
+
+def test_demo_data_pages_by_publish_time(monkeypatch):
+    """Display API演示数据按发布时间分页：游标可以编码，时间范围筛选按ISO字符串比较"""
+    monkeypatch.setenv('RESTORE_IN_WORKER', '1')
+    import app
+    items = [video for _ in range(6) for video in app.generate_display_api_demo_data()]
+    for n, video in enumerate(items):
+        video['video_id'] = f'demo_{n:02d}'
+    snapshot = make_snapshot('a', 1, items, 'api_limitation', 'demo')
+    assert all(isinstance(video['publish_time'], str) for video in snapshot.videos)
+    for order in ('asc', 'desc'):
+        ids, total = all_pages(snapshot, {'sort': 'publish_time', 'order': order, 'limit': '4'})
+        assert ids == expected_ids(snapshot, 'publish_time', order == 'desc')
+    middle = sorted(video['publish_time'] for video in snapshot.videos)[len(items) // 2][:10]
+    ids, total = all_pages(snapshot, {'sort': 'publish_time', 'limit': '4', 'published_after': middle})
+    assert ids == expected_ids(snapshot, 'publish_time', True, lambda video: video['publish_time'] >= middle)
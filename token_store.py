@@ -0,0 +1,108 @@
+"""
+多账号访问令牌存储 - 以open_id为键保存每个授权账号的令牌和数据缓存
+"""
+
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from stats_planner import StatsRefreshPlanner
+
+
+def account_room(open_id: str) -> str:
+    """账号对应的Socket.IO房间名"""
+    return f'account:{open_id}'
+
+
+class AccountSession:
+    """单个授权账号的令牌和账号级缓存"""
+
+    def __init__(self, open_id: str):
+        self.open_id = open_id
+        self.access_token = None
+        self.refresh_token = None
+        self.expires_at = None
+        self.scope = None
+        self.authorized_at = None
+        # 账号级缓存：视频统计刷新计划（刷新结果以快照形式保存在SnapshotStore中）
+        self.planner = StatsRefreshPlanner()
+        # 按需获取的视频详情：video_id -> (获取时间, 详情)
+        self.video_details: Dict[str, Tuple[float, Dict]] = {}
+        # 同一账号的刷新串行执行，不同账号之间互不阻塞
+        self.refresh_lock = threading.Lock()
+
+    def update_token(self, token_data: Dict):
+        """用令牌接口的响应更新令牌"""
+        self.access_token = token_data['access_token']
+        self.refresh_token = token_data.get('refresh_token') or self.refresh_token
+        self.scope = token_data.get('scope', self.scope)
+        expires_in = token_data.get('expires_in')
+        self.expires_at = time.time() + int(expires_in) if expires_in else None
+        self.authorized_at = time.time()
+
+    def token_state(self) -> Dict:
+        """令牌状态（持久化用），可由TokenStore.restore恢复"""
+        return {
+            'access_token': self.access_token,
+            'refresh_token': self.refresh_token,
+            'expires_at': self.expires_at,
+            'scope': self.scope,
+            'authorized_at': self.authorized_at
+        }
+
+    def is_expired(self, margin: int = 60) -> bool:
+        """访问令牌是否已过期（提前margin秒视为过期）"""
+        return self.expires_at is not None and time.time() >= self.expires_at - margin
+
+
+class TokenStore:
+    """以open_id为键的令牌存储，线程安全"""
+
+    def __init__(self):
+        self._accounts: Dict[str, AccountSession] = {}
+        self._lock = threading.Lock()
+
+    def save(self, open_id: str, token_data: Dict) -> AccountSession:
+        """保存账号令牌，已有账号时只更新令牌并保留缓存"""
+        with self._lock:
+            account = self._accounts.get(open_id)
+            if account is None:
+                account = AccountSession(open_id)
+                self._accounts[open_id] = account
+        account.update_token(token_data)
+        return account
+
+    def restore(self, open_id: str, state: Dict) -> AccountSession:
+        """从持久化的令牌状态恢复账号（保留原过期时间）"""
+        with self._lock:
+            account = self._accounts.get(open_id)
+            if account is None:
+                account = AccountSession(open_id)
+                self._accounts[open_id] = account
+        for name in ('access_token', 'refresh_token', 'expires_at', 'scope', 'authorized_at'):
+            setattr(account, name, state.get(name))
+        return account
+
+    def get(self, open_id: Optional[str]) -> Optional[AccountSession]:
+        if not open_id:
+            return None
+        return self._accounts.get(open_id)
+
+    def remove(self, open_id: str) -> Optional[AccountSession]:
+        with self._lock:
+            return self._accounts.pop(open_id, None)
+
+    def clear(self) -> List[str]:
+        """清除所有账号，返回被清除的open_id列表"""
+        with self._lock:
+            open_ids = list(self._accounts)
+            self._accounts.clear()
+        return open_ids
+
+    def account_ids(self) -> List[str]:
+        return list(self._accounts)
+
+    def __contains__(self, open_id) -> bool:
+        return open_id in self._accounts
+
+    def __len__(self) -> int:
+        return len(self._accounts)
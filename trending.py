@@ -0,0 +1,259 @@
+"""
+热门趋势 - 按滑动窗口内的观看/点赞增速（次/小时）对视频排名
+
+快照发布时由订阅者只处理相对上一版本计数变化的视频和窗口内仍有增长的视频，
+更新它们的窗口样本，并调整有界的前K索引（每个账号一份、所有账号合并一份），
+/api/trending直接读取索引前K项，不扫描历史。
+"""
+
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import deque
+from typing import Deque, Dict, Hashable, List, Optional, Tuple
+from config import Config
+from snapshot_store import stats_time
+
+# 参与排名的计数
+TRENDING_METRICS = ('views', 'likes')
+
+
+class RankIndex:
+    """
+    分数最高的K个键（有界的有序索引）
+
+    所有分数大于0的键的分数保存在字典中（O(1)更新），有序列表只保留前K项(-分数, 键)，
+    列表最后一项为进入前K的门槛分数：未进入前K的键只有超过门槛时才插入并挤出最后一项。
+    前K中的键分数下降时，列表外可能有更高的键，此时标记失效，下次读取时用堆重新选出前K项
+    """
+
+    def __init__(self, k: int = None):
+        self.k = k or Config.TRENDING_MAX_LIMIT
+        self._scores: Dict[Hashable, float] = {}
+        self._entries: List[Tuple[float, Hashable]] = []
+        self._members = set()
+        self._stale = False
+        self.rebuilds = 0
+
+    def update(self, key: Hashable, score: float):
+        old = self._scores.get(key)
+        if old == score or (old is None and score <= 0):
+            return
+        if score > 0:
+            self._scores[key] = score
+        else:
+            del self._scores[key]
+        if self._stale:
+            return
+        entries = self._entries
+        if key in self._members:
+            del entries[bisect_left(entries, (-old, key))]
+            self._members.discard(key)
+            outside = len(self._scores) - len(entries) - (1 if score > 0 else 0)
+            if score < old and outside > 0:
+                # 列表外的键可能超过新分数
+                self._stale = True
+                return
+        elif len(entries) == self.k and (score <= 0 or (-score, key) >= entries[-1]):
+            return
+        if score > 0:
+            insort(entries, (-score, key))
+            self._members.add(key)
+            if len(entries) > self.k:
+                self._members.discard(entries.pop()[1])
+
+    def remove(self, key: Hashable):
+        self.update(key, 0)
+
+    def top(self, k: int) -> List[Hashable]:
+        if self._stale:
+            self._entries = heapq.nsmallest(self.k, ((-score, key) for key, score in self._scores.items()))
+            self._members = {key for _, key in self._entries}
+            self._stale = False
+            self.rebuilds += 1
+        return [key for _, key in self._entries[:k]]
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+
+class VideoTrend:
+    """一个视频的窗口样本和当前增速"""
+
+    __slots__ = ('samples', 'velocity', 'counters')
+
+    def __init__(self):
+        # 计数变化时的样本(时间戳, *TRENDING_METRICS)，计数不变的快照不追加
+        self.samples: Deque[Tuple] = deque()
+        self.velocity = (0.0,) * len(TRENDING_METRICS)
+        self.counters = (0,) * len(TRENDING_METRICS)
+
+
+class TrendingTracker:
+    """
+    视频增速排名
+
+    增速 = (当前计数 - 窗口起点的计数) / 窗口时长。每个视频只保存计数发生变化时的样本（时间为
+    stats_updated_at），并保留一个不晚于窗口起点的样本作为起点计数；样本不足一个窗口时按实际观察时长计算。
+    分层刷新时本轮没有重新获取的视频计数不变，不产生样本
+    """
+
+    def __init__(self, window: int = None):
+        self.window = window or Config.TRENDING_WINDOW
+        self._videos: Dict[str, Dict[str, VideoTrend]] = {}
+        self._indexes: Dict[str, Dict[str, RankIndex]] = {}
+        self._global = {metric: RankIndex() for metric in TRENDING_METRICS}
+        # 每个账号增速不为0的视频：计数不变时增速也随窗口滑动下降，每次发布都要重新计算
+        self._active: Dict[str, set] = {}
+        # 每个账号最近处理的版本，上一版本不是它时（首次、清空后）处理完整列表
+        self._recorded: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        # 指标
+        self.updates = 0
+        self.last_visited = 0
+        self.last_changed = 0
+        self.last_update_ms = None
+
+    def record(self, snapshot, previous=None):
+        """
+        快照发布订阅者：更新账号视频的增速和排名索引
+
+        上一版本已处理过时只处理发布时记录的计数变化、新增或移除的视频（Snapshot.changes），
+        以及增速尚未衰减到0的视频，其余视频的增速保持为0，不需要访问
+        """
+        if snapshot.account_id is None or snapshot.status != 'success':
+            return
+        started = time.perf_counter()
+        account_id = snapshot.account_id
+        now = snapshot.published_at
+        start = now - self.window
+        changed = 0
+        with self._lock:
+            videos = self._videos.setdefault(account_id, {})
+            indexes = self._indexes.setdefault(account_id, {metric: RankIndex() for metric in TRENDING_METRICS})
+            active = self._active.setdefault(account_id, set())
+            if (snapshot.changes is not None and previous is not None
+                    and self._recorded.get(account_id) == previous.version):
+                positions, removed = snapshot.changes
+                removed = set(removed)
+                updated = {}
+                for position in positions:
+                    video = snapshot.videos[position]
+                    if video.get('video_id'):
+                        updated[video['video_id']] = video
+                # 计数没有变化但增速还在衰减的视频
+                for video_id in active:
+                    if video_id not in updated and video_id not in removed:
+                        updated[video_id] = None
+            else:
+                updated = {video['video_id']: video for video in snapshot.videos if video.get('video_id')}
+                removed = [video_id for video_id in videos if video_id not in updated]
+            for video_id, video in updated.items():
+                trend = videos.get(video_id)
+                if trend is None:
+                    trend = videos[video_id] = VideoTrend()
+                if video is None:
+                    counters = trend.counters
+                else:
+                    counters = tuple(int(video.get(metric) or 0) for metric in TRENDING_METRICS)
+                samples = trend.samples
+                if not samples or counters != trend.counters:
+                    # 样本时间为计数实际获取的时间（分层刷新时可能早于发布时间）
+                    observed = stats_time(video, now) if video is not None else now
+                    samples.append((max(observed, samples[-1][0]) if samples else observed, *counters))
+                    trend.counters = counters
+                # 第二个样本也不晚于窗口起点时，第一个样本不再需要
+                while len(samples) > 1 and samples[1][0] <= start:
+                    samples.popleft()
+                first = samples[0]
+                span = now - max(first[0], start)
+                if span > 0:
+                    velocity = tuple(max(0, counters[i] - first[i + 1]) * 3600 / span
+                                     for i in range(len(TRENDING_METRICS)))
+                else:
+                    velocity = (0.0,) * len(TRENDING_METRICS)
+                if any(velocity):
+                    active.add(video_id)
+                else:
+                    active.discard(video_id)
+                if velocity != trend.velocity:
+                    trend.velocity = velocity
+                    changed += 1
+                    for i, metric in enumerate(TRENDING_METRICS):
+                        indexes[metric].update(video_id, velocity[i])
+                        self._global[metric].update((account_id, video_id), velocity[i])
+            for video_id in removed:
+                if videos.pop(video_id, None) is None:
+                    continue
+                active.discard(video_id)
+                changed += 1
+                for metric in TRENDING_METRICS:
+                    indexes[metric].remove(video_id)
+                    self._global[metric].remove((account_id, video_id))
+            self._recorded[account_id] = snapshot.version
+            self.updates += 1
+            self.last_visited = len(updated) + len(removed)
+            self.last_changed = changed
+            self.last_update_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    def top(self, metric: str, limit: int, account_id: Optional[str] = None) -> List[Dict]:
+        """
+        增速最高的视频
+
+        Args:
+            metric: TRENDING_METRICS之一
+            account_id: 指定时只在该账号内排名，None时在所有账号中排名
+        """
+        if metric not in TRENDING_METRICS:
+            raise ValueError(f"未知的排名计数: {metric}")
+        with self._lock:
+            if account_id is None:
+                keys = self._global[metric].top(limit)
+            else:
+                index = self._indexes.get(account_id, {}).get(metric)
+                keys = [(account_id, video_id) for video_id in index.top(limit)] if index else []
+            result = []
+            for owner, video_id in keys:
+                trend = self._videos[owner][video_id]
+                item = {'account_id': owner, 'video_id': video_id}
+                for i, name in enumerate(TRENDING_METRICS):
+                    item[name] = trend.counters[i]
+                    item[f'{name}_per_hour'] = round(trend.velocity[i], 1)
+                result.append(item)
+            return result
+
+    def remove(self, account_id: str):
+        """删除账号的增速和排名"""
+        with self._lock:
+            for video_id in self._videos.pop(account_id, {}):
+                for metric in TRENDING_METRICS:
+                    self._global[metric].remove((account_id, video_id))
+            self._indexes.pop(account_id, None)
+            self._active.pop(account_id, None)
+            self._recorded.pop(account_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._videos.clear()
+            self._indexes.clear()
+            self._active.clear()
+            self._recorded.clear()
+            self._global = {metric: RankIndex() for metric in TRENDING_METRICS}
+
+    def stats(self) -> Dict:
+        """排名指标，用于自省接口"""
+        return {
+            'window': self.window,
+            'accounts': len(self._videos),
+            'videos': sum(len(videos) for videos in self._videos.values()),
+            'ranked': {metric: len(index) for metric, index in self._global.items()},
+            'active': sum(len(active) for active in self._active.values()),
+            'top_k': self._global[TRENDING_METRICS[0]].k,
+            'rebuilds': sum(index.rebuilds for index in self._global.values()),
+            'updates': self.updates,
+            'last_visited': self.last_visited,
+            'last_changed': self.last_changed,
+            'last_update_ms': self.last_update_ms
+        }
@@ -0,0 +1,186 @@
+"""
+视频列表查询 - /api/data的服务端排序、筛选和游标分页
+
+每个快照版本每个排序字段只排序一次（缓存在不可变快照上），筛选用的列同样按版本缓存为numpy数组；
+请求只需二分定位游标位置并按筛选掩码取出一页，不再逐请求排序整个列表。
+"""
+
+import base64
+import json
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import Config
+from snapshot_store import Snapshot, to_columns
+
+# 可排序的字段，publish_time为ISO格式字符串，其余为数值
+SORT_KEYS = (
+    'views', 'likes', 'comments', 'shares', 'engagement_rate', 'completion_rate',
+    'avg_watch_time', 'bounce_rate', 'new_followers', 'duration', 'publish_time'
+)
+
+# 触发分页查询的请求参数，都没有时/api/data返回完整列表
+QUERY_PARAMS = ('sort', 'order', 'published_after', 'published_before', 'min_views', 'limit', 'cursor')
+
+
+@dataclass(frozen=True)
+class VideoQuery:
+    """一次列表查询的排序、筛选和分页参数"""
+
+    sort: str = 'views'
+    descending: bool = True
+    published_after: Optional[str] = None     # 含，ISO日期或时间
+    published_before: Optional[str] = None    # 不含
+    min_views: Optional[int] = None
+    limit: int = 50
+    cursor: Optional[Tuple] = None            # 上一页最后一条的排序键
+
+
+def sort_key(video: dict, name: str) -> Tuple:
+    """排序键(是否有值, 值, video_id)：缺少该字段的视频排在升序最前、降序最后，相同值按video_id排列"""
+    value = video.get(name)
+    if value is None:
+        return (0, '' if name == 'publish_time' else 0, video.get('video_id') or '')
+    return (1, value, video.get('video_id') or '')
+
+
+class SortIndex:
+    """一个快照版本按某个字段升序排列的视频下标和对应的排序键"""
+
+    def __init__(self, videos: Tuple[dict, ...], name: str):
+        keys = [sort_key(video, name) for video in videos]
+        self.order = np.array(sorted(range(len(videos)), key=keys.__getitem__), dtype=np.int64)
+        self.keys = [keys[i] for i in self.order.tolist()]
+
+
+def sort_index(snapshot: Snapshot, name: str) -> SortIndex:
+    """快照按字段的排序索引（每个版本每个字段只构建一次）"""
+    return snapshot.cached(('sort_index', name), lambda: SortIndex(snapshot.videos, name))
+
+
+def filter_column(snapshot: Snapshot, name: str) -> np.ndarray:
+    """筛选使用的列（每个版本只构建一次），缺失值：数值为-1，字符串为空串"""
+    def build():
+        if name == 'publish_time':
+            return np.array([video.get(name) or '' for video in snapshot.videos], dtype=str)
+        return np.array([-1 if video.get(name) is None else video[name] for video in snapshot.videos],
+                        dtype=np.float64)
+    return snapshot.cached(('filter_column', name), build)
+
+
+def encode_cursor(query: VideoQuery, key: Tuple) -> str:
+    data = json.dumps([query.sort, query.descending, *key], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(value: str, sort: str, descending: bool) -> Tuple:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)))
+        cursor_sort, cursor_descending, *key = data
+    except (ValueError, TypeError):
+        raise ValueError('cursor参数无效')
+    if cursor_sort != sort or cursor_descending != descending or len(key) != 3:
+        raise ValueError('cursor与当前的排序方式不一致')
+    # 排序键必须与sort_key的结构一致，否则与索引中的键比较时会抛出TypeError
+    present, value, video_id = key
+    if sort == 'publish_time':
+        valid_value = isinstance(value, str)
+    else:
+        valid_value = isinstance(value, (int, float)) and not isinstance(value, bool)
+    if (type(present) is not int or present not in (0, 1) or not valid_value
+            or not isinstance(video_id, str) or (present == 0 and value)):
+        raise ValueError('cursor参数无效')
+    return tuple(key)
+
+
+def parse_query(args) -> VideoQuery:
+    """从请求参数解析查询，参数无效时抛出ValueError"""
+    sort = args.get('sort', 'views')
+    if sort not in SORT_KEYS:
+        raise ValueError(f"sort只能是: {', '.join(SORT_KEYS)}")
+    order = args.get('order', 'desc')
+    if order not in ('asc', 'desc'):
+        raise ValueError('order只能是asc或desc')
+    descending = order == 'desc'
+    try:
+        limit = int(args.get('limit', Config.DATA_PAGE_SIZE))
+        min_views = args.get('min_views')
+        min_views = int(min_views) if min_views else None
+    except ValueError:
+        raise ValueError('limit和min_views必须是整数')
+    cursor = args.get('cursor')
+    return VideoQuery(
+        sort=sort,
+        descending=descending,
+        published_after=args.get('published_after') or None,
+        published_before=args.get('published_before') or None,
+        min_views=min_views,
+        limit=max(1, min(limit, Config.DATA_MAX_PAGE_SIZE)),
+        cursor=decode_cursor(cursor, sort, descending) if cursor else None
+    )
+
+
+def query_videos(snapshot: Snapshot, query: VideoQuery) -> Tuple[List[dict], Optional[str], int]:
+    """
+    按查询取出一页视频
+
+    Returns:
+        (本页视频, 下一页游标（没有下一页时为None）, 满足筛选条件的视频总数)
+    """
+    index = sort_index(snapshot, query.sort)
+    mask = np.ones(len(snapshot.videos), dtype=bool)
+    if query.min_views is not None:
+        mask &= filter_column(snapshot, 'views') >= query.min_views
+    if query.published_after or query.published_before:
+        published = filter_column(snapshot, 'publish_time')
+        mask &= published != ''
+        # ISO格式的时间字符串按字典序比较即按时间比较，只给日期时比较的是当天0点
+        if query.published_after:
+            mask &= published >= query.published_after
+        if query.published_before:
+            mask &= published < query.published_before
+
+    if query.descending:
+        end = bisect_left(index.keys, query.cursor) if query.cursor else len(index.keys)
+        candidates = index.order[:end][::-1]
+    else:
+        start = bisect_right(index.keys, query.cursor) if query.cursor else 0
+        candidates = index.order[start:]
+    selected = candidates[mask[candidates]]
+    page = [snapshot.videos[i] for i in selected[:query.limit].tolist()]
+    next_cursor = None
+    if len(selected) > query.limit:
+        next_cursor = encode_cursor(query, sort_key(page[-1], query.sort))
+    return page, next_cursor, int(mask.sum())
+
+
+def page_payload(snapshot: Snapshot, query: VideoQuery, fields: Optional[Tuple[str, ...]] = None,
+                 layout: str = 'rows') -> Dict:
+    """分页查询的响应负载，格式与Snapshot.to_payload相同，另带page信息"""
+    videos, next_cursor, total = query_videos(snapshot, query)
+    if fields is not None:
+        videos = [{name: video[name] for name in fields if name in video} for video in videos]
+    payload = {
+        'success': True,
+        'status': snapshot.status,
+        'message': snapshot.message,
+        'timestamp': snapshot.timestamp,
+        'version': snapshot.version,
+        'summary': snapshot.summary,
+        'page': {
+            'sort': query.sort,
+            'order': 'desc' if query.descending else 'asc',
+            'limit': query.limit,
+            'total': total,
+            'next_cursor': next_cursor
+        }
+    }
+    if layout == 'columnar':
+        payload['format'] = 'columnar'
+        payload.update(to_columns(videos, fields))
+    else:
+        payload['videos'] = videos
+    return payload
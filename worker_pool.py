@@ -0,0 +1,217 @@
+"""
+有界并发刷新工作池 - 固定数量的工作线程执行多账号刷新任务
+
+在gevent模式下（gunicorn已monkey patch）工作线程即为greenlet。
+"""
+
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+from config import Config
+
+try:
+    import gevent
+    from gevent import monkey
+    from gevent._hub_local import get_hub_if_exists
+except ImportError:  # 开发环境（threading模式）可以不安装gevent
+    gevent = None
+
+
+def gevent_patched() -> bool:
+    """是否运行在已monkey patch的gevent环境中（此时threading.Thread创建的是greenlet）"""
+    return gevent is not None and monkey.is_module_patched('threading')
+
+
+def run_blocking(func: Callable, *args) -> Any:
+    """
+    执行阻塞的磁盘操作（SQLite事务等）并返回结果
+
+    gevent模式下在hub的原生线程池中执行，调用的greenlet等待期间其他greenlet照常运行；
+    否则（包括已经在原生线程中，如导出任务线程）直接在当前线程执行
+    """
+    if gevent_patched():
+        # 原生线程中没有hub，不为它创建
+        hub = get_hub_if_exists()
+        if hub is not None:
+            return hub.threadpool.apply(func, args)
+    return func(*args)
+
+
+# 未patch的time.sleep，在run_blocking执行的函数中让出CPU（gevent的sleep只能在hub所在的线程中调用）
+native_sleep = monkey.get_original('time', 'sleep') if gevent is not None else time.sleep
+
+
+class DeadlineExceeded(Exception):
+    """刷新任务超过截止时间"""
+
+
+class RefreshJob:
+    """一次账号刷新任务"""
+
+    def __init__(self, account_id: str, deadline: float):
+        self.account_id = account_id
+        self.deadline = deadline          # 截止时间（monotonic）
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self.ok = None
+        self.error = None
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def add_done_callback(self, callback: Callable):
+        """添加完成回调（参数为job），任务已完成时立即调用"""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                print(f"❌ 刷新任务回调异常 [{self.account_id}]: {e}")
+
+    def remaining(self) -> float:
+        """距离截止时间的剩余秒数"""
+        return self.deadline - time.monotonic()
+
+    def wait(self, timeout: float = None) -> bool:
+        """等待任务完成，返回是否已完成"""
+        return self._done.wait(timeout)
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+
+class RefreshWorkerPool:
+    """
+    固定大小的刷新工作池
+
+    同一账号同时最多只有一个排队或运行中的任务，重复提交会复用已有任务；
+    每个任务带截止时间，排队超时的任务直接丢弃，运行中的任务通过截止时间
+    约束上游请求的超时。
+    """
+
+    def __init__(self, handler: Callable[[str, float], bool], size: int = None,
+                 timeout: float = None):
+        """
+        Args:
+            handler: 刷新函数，参数为(账号ID, 截止时间)，返回是否成功
+            size: 工作线程数量
+            timeout: 每个任务的默认截止时长（秒）
+        """
+        self.handler = handler
+        self.size = size or Config.UPDATE_CONCURRENCY
+        self.timeout = timeout or Config.REFRESH_DEADLINE
+
+        self._queue = queue.Queue()
+        self._jobs: Dict[str, RefreshJob] = {}
+        self._lock = threading.Lock()
+        self._workers = []
+        self._started_at = None
+
+        # 指标
+        self._busy = 0
+        self._busy_seconds = 0.0
+        self._completed = 0
+        self._failed = 0
+        self._expired = 0
+        self._started = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._wait_last = None
+
+    def start(self):
+        """启动工作线程"""
+        if self._workers:
+            return
+        self._started_at = time.monotonic()
+        for i in range(self.size):
+            worker = threading.Thread(target=self._work, name=f'refresh-worker-{i}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        print(f"🧵 刷新工作池启动: {self.size} 个工作线程, 截止时长={self.timeout}s")
+
+    def submit(self, account_id: str, timeout: float = None, callback: Callable = None) -> RefreshJob:
+        """提交账号刷新任务，该账号已有未完成任务时直接返回该任务"""
+        with self._lock:
+            job = self._jobs.get(account_id)
+            created = job is None or job.done
+            if created:
+                job = RefreshJob(account_id, time.monotonic() + (timeout or self.timeout))
+                self._jobs[account_id] = job
+        if callback:
+            job.add_done_callback(callback)
+        if created:
+            self._queue.put(job)
+        return job
+
+    def last_job(self, account_id: str) -> Optional[RefreshJob]:
+        """账号最近一次提交的任务（可能仍在排队或运行中）"""
+        return self._jobs.get(account_id)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.started_at = time.monotonic()
+            wait = job.started_at - job.submitted_at
+            with self._lock:
+                self._started += 1
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+                self._wait_last = wait
+                self._busy += 1
+            try:
+                if job.remaining() <= 0:
+                    raise DeadlineExceeded(f"任务排队 {wait:.1f}s 已超过截止时间")
+                job.ok = bool(self.handler(job.account_id, job.deadline))
+            except DeadlineExceeded as e:
+                job.ok = False
+                job.error = str(e)
+                with self._lock:
+                    self._expired += 1
+            except Exception as e:
+                print(f"❌ 刷新任务异常 [{job.account_id}]: {e}")
+                job.ok = False
+                job.error = str(e)
+            finally:
+                job.finished_at = time.monotonic()
+                with self._lock:
+                    self._busy -= 1
+                    self._busy_seconds += job.finished_at - job.started_at
+                    self._completed += 1
+                    if not job.ok:
+                        self._failed += 1
+                self._queue.task_done()
+            job._finish()
+
+    def stats(self) -> Dict:
+        """工作池指标：利用率、排队等待时间和任务计数"""
+        with self._lock:
+            uptime = time.monotonic() - self._started_at if self._started_at else 0.0
+            completed = self._completed
+            return {
+                'size': self.size,
+                'busy': self._busy,
+                'utilization': round(self._busy / self.size, 3),
+                'avg_utilization': round(self._busy_seconds / (self.size * uptime), 3) if uptime else 0.0,
+                'queue_depth': self._queue.qsize(),
+                'queue_wait': {
+                    'last': None if self._wait_last is None else round(self._wait_last, 3),
+                    'avg': round(self._wait_total / self._started, 3) if self._started else None,
+                    'max': round(self._wait_max, 3)
+                },
+                'completed': completed,
+                'failed': self._failed,
+                'expired': self._expired,
+                'in_flight': sorted(a for a, job in self._jobs.items() if not job.done)
+            }